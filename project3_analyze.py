@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Analyze
+This module runs the analysis of project3_script on any recordings, without plotting,
+so it can be used as a library and from the command line. A Pipeline holds the
+settings of the analysis, taken from its defaults, a JSON config file and keyword
+arguments, and runs every stage of project3_module on each recording, caching the
+stage results with project3_cache. Only numpy is imported when this module is loaded:
+scipy is imported by the stages which need it, so a run whose results are all cached
+never loads it, and matplotlib is only imported when plots are asked for.
+
+Installing the project (pip install .) adds the command hrv-analyze, which runs main.
+
+Example:
+    hrv-analyze "rest_data (1).txt" "wallsit_data (1).txt" --duration 300 --format csv --output results.csv
+
+    pipeline = p3a.Pipeline('settings.json', threshold = 35)
+    results = pipeline.run(['rest_data (1).txt'])
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import argparse
+import csv
+import json
+import os
+import sys
+import numpy as np
+import project3_cache as p3c
+
+# settings of the analysis and their defaults, the same values project3_script uses
+default_settings = {'duration': 300, 'fs': 500, 'threshold': 40, 'dt': 0.1, 'lowcut': 0.5,
+                    'highcut': 2.5, 'order': 2, 'dtype': None, 'use_cache': True, 'cache_dir': None}
+
+# columns of the results table, one row per recording
+results_dtype = [('input_file', object), ('sample_count', int), ('beat_count', int),
+                 ('hrv', float), ('ratio', float), ('error', object)]
+
+# formats the results table can be written in
+output_formats = ('table', 'csv', 'json', 'parquet')
+
+#%% Settings
+# Create function to read the settings of a pipeline from a JSON file
+def read_config(config_file):
+    '''
+    A function to read analysis settings from a JSON file holding an object whose
+    keys are names in default_settings.
+
+    Parameters
+    ----------
+    config_file : string
+        Name of the .json file
+
+    Raises
+    ------
+    ValueError
+        If the file holds a setting which does not exist.
+
+    Returns
+    -------
+    settings : dictionary
+        The settings in the file
+
+    '''
+    with open(config_file) as json_file:
+        settings = json.load(json_file)
+    unknown = set(settings) - set(default_settings)
+    if unknown:
+        raise ValueError(f"Unknown settings in {config_file}: {', '.join(sorted(unknown))}")
+    return settings
+
+#%% Pipeline
+class Pipeline:
+    '''
+    A class which runs the analysis of project3_module with one set of settings on
+    any number of recordings.
+
+    Parameters
+    ----------
+    config : string or dictionary, optional
+        Name of a JSON config file, see read_config, or a dictionary of settings.
+        The default is None, which uses default_settings.
+    **settings
+        Settings which replace those of default_settings and config, such as
+        duration, fs, threshold or dtype ('float32' or 'float64', see
+        project3_module.get_signal_dtype).
+
+    '''
+    def __init__(self, config = None, **settings):
+        if isinstance(config, str):
+            config = read_config(config)
+        self.settings = dict(default_settings)
+        for overrides in (config or {}, settings):
+            unknown = set(overrides) - set(default_settings)
+            if unknown:
+                raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+            self.settings.update(overrides)
+
+    def analyze(self, input_file):
+        '''
+        A function to run every stage of the analysis on one recording.
+
+        Parameters
+        ----------
+        input_file : string
+            Name of the txt, .ecg or .npy file to analyze
+
+        Returns
+        -------
+        results : dictionary
+            Every result named in project3_cache.stage_outputs, such as data_file,
+            filtered_signal, beat_time, interpolated_ibi, hrv and ratio
+
+        '''
+        settings = self.settings
+        analysis_settings = (input_file, settings['duration'], settings['fs'], settings['threshold'],
+                             settings['dt'], settings['lowcut'], settings['highcut'], settings['order'],
+                             settings['dtype'])
+        return p3c.run_cached_pipeline(*analysis_settings, directory = settings['cache_dir'],
+                                       use_cache = settings['use_cache'])
+
+    def run(self, input_files):
+        '''
+        A function to analyze many recordings into a results table. A recording which
+        fails is reported in the error column instead of stopping the run.
+
+        Parameters
+        ----------
+        input_files : list of strings
+            Names of the recordings
+
+        Returns
+        -------
+        results : structured array size (n,) where n is the # of recordings
+            One row with the fields of results_dtype for each recording
+
+        '''
+        rows = []
+        for input_file in input_files:
+            try:
+                results = self.analyze(input_file)
+                rows.append((input_file, len(results['data_file']), len(results['beat_time']),
+                             float(results['hrv']), float(results['ratio']), ''))
+            except Exception as error:
+                rows.append((input_file, 0, 0, np.nan, np.nan, f'{type(error).__name__}: {error}'))
+        return np.array(rows, dtype = results_dtype)
+
+    def save_plots(self, input_file, output_dir):
+        '''
+        A function to save plots of the filtered signal with its beats and of the IBI
+        spectrum of one recording as png files. matplotlib is only imported here.
+
+        Parameters
+        ----------
+        input_file : string
+            Name of the recording
+        output_dir : string
+            Folder the plots are saved in, created if needed
+
+        Returns
+        -------
+        plot_files : list of strings
+            Names of the png files written
+
+        '''
+        import matplotlib
+        # the plots are only saved, so draw them without opening a window
+        if 'matplotlib.pyplot' not in sys.modules:
+            matplotlib.use('Agg')
+        import matplotlib.pyplot as plt
+        import project3_plotting as p3plt
+        results = self.analyze(input_file)
+        os.makedirs(output_dir, exist_ok = True)
+        name = os.path.splitext(os.path.basename(input_file))[0]
+        plot_files = [os.path.join(output_dir, f'{name} beats.png'), os.path.join(output_dir, f'{name} spectrum.png')]
+
+        figure, ax = plt.subplots(figsize = (10, 4))
+        p3plt.plot_beats(results['filtered_signal'], results['beat_locations'], self.settings['fs'], ax)
+        ax.set_title(f'{name} filtered ECG with heartbeats')
+        figure.savefig(plot_files[0])
+        plt.close(figure)
+
+        figure, ax = plt.subplots(figsize = (10, 4))
+        p3plt.plot_spectrum(results['frequency'], results['power'], results['low_freq'], results['low_power'],
+                            results['high_freq'], results['high_power'], ax)
+        ax.set_title(f"{name} IBI spectrum, LF/HF ratio {float(results['ratio']):.2f}")
+        figure.savefig(plot_files[1])
+        plt.close(figure)
+        return plot_files
+
+#%% Output
+# Create function to write the results table in one of the output formats
+def write_results(results, output_format = 'table', output_file = None):
+    '''
+    A function to write a results table as an aligned text table, csv, JSON (a list
+    of one object per recording) or parquet (this needs pyarrow to be installed).
+
+    Parameters
+    ----------
+    results : structured array size (n,)
+        Results table from Pipeline.run
+    output_format : string, optional
+        One of output_formats. The default is 'table'.
+    output_file : string, optional
+        Name of the file to write. The default is None, which prints to the screen;
+        parquet must be written to a file.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if output_format not in output_formats:
+        raise ValueError(f"Unknown output format '{output_format}', choose one of {', '.join(output_formats)}")
+    rows = [dict(zip(results.dtype.names, row)) for row in results.tolist()]
+    if output_format == 'parquet':
+        if output_file is None:
+            raise ValueError('parquet output needs an output file')
+        # pyarrow is only needed for parquet output, so import it here
+        import pyarrow
+        import pyarrow.parquet
+        table = pyarrow.table({name: results[name].tolist() for name in results.dtype.names})
+        pyarrow.parquet.write_table(table, output_file)
+        return
+    output = open(output_file, 'w', newline = '') if output_file is not None else sys.stdout
+    try:
+        if output_format == 'csv':
+            writer = csv.writer(output)
+            writer.writerow(results.dtype.names)
+            writer.writerows(results.tolist())
+        elif output_format == 'json':
+            json.dump(rows, output, indent = 1)
+            output.write('\n')
+        else:
+            output.write(f"{'recording':<30}{'samples':>10}{'beats':>8}{'HRV (s)':>10}{'LF/HF':>8}  error\n")
+            for row in rows:
+                output.write(f"{row['input_file']:<30}{row['sample_count']:>10}{row['beat_count']:>8}"
+                             f"{row['hrv']:>10.3f}{row['ratio']:>8.2f}  {row['error']}\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+#%% Command line
+# Create function to run the hrv-analyze command
+def main(argv = None):
+    '''
+    A function to parse the command line arguments, analyze the recordings and
+    write the results table.
+
+    Parameters
+    ----------
+    argv : list of strings, optional
+        Command line arguments. The default is None, which uses sys.argv.
+
+    Returns
+    -------
+    exit_status : integer
+        0 if every recording was analyzed, otherwise 1
+
+    '''
+    parser = argparse.ArgumentParser(prog = 'hrv-analyze', description = 'Calculate the HRV and LF/HF ratio of ECG recordings.')
+    parser.add_argument('input_files', nargs = '+', help = 'txt, .ecg or .npy recordings')
+    parser.add_argument('--config', default = None, help = 'JSON file of settings, overridden by the options below')
+    parser.add_argument('--duration', type = int, help = 'seconds of data to analyze (default 300)')
+    parser.add_argument('--fs', type = int, help = 'sampling frequency in Hz (default 500)')
+    parser.add_argument('--threshold', type = float, help = 'beat detection threshold (default 40)')
+    parser.add_argument('--dt', type = float, help = 'spacing of the interpolated IBIs in seconds (default 0.1)')
+    parser.add_argument('--dtype', choices = ('float32', 'float64'), help = 'type to load and filter the signal in (default float64)')
+    parser.add_argument('--format', default = 'table', choices = output_formats, help = 'format of the results')
+    parser.add_argument('--output', default = None, help = 'file to write the results to instead of the screen')
+    parser.add_argument('--no-cache', action = 'store_true', help = 'do not read or store cached stage results')
+    parser.add_argument('--plot', default = None, metavar = 'DIR', help = 'also save plots of each recording in DIR')
+    args = parser.parse_args(argv)
+
+    settings = {name: getattr(args, name) for name in ('duration', 'fs', 'threshold', 'dt', 'dtype')
+                if getattr(args, name) is not None}
+    if args.no_cache:
+        settings['use_cache'] = False
+    pipeline = Pipeline(args.config, **settings)
+    results = pipeline.run(args.input_files)
+    write_results(results, args.format, args.output)
+    if args.plot is not None:
+        for row in results[results['error'] == '']:
+            pipeline.save_plots(row['input_file'], args.plot)
+    # report the files that failed
+    failed = results[results['error'] != '']
+    for row in failed:
+        print(f"{row['input_file']}: {row['error']}", file = sys.stderr)
+    return 1 if len(failed) > 0 else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Batch
+This module runs the analysis from the project 3 module on many recordings at once.
+Recordings with the same number of samples are stacked into a 2D array so the
+bandpass filter, beat detection, IBI interpolation and FFT band power are each done
+with one NumPy/SciPy call for the whole stack instead of once per file. The results
+are returned as a table with one row per recording.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import csv
+import numpy as np
+from scipy import fft
+import project3_module as p3m
+
+# columns of the results table returned by analyze_recordings
+results_dtype = [('input_file', object), ('sample_count', int), ('beat_count', int),
+                 ('hrv', float), ('ratio', float)]
+
+#%% Batch beat detection and IBI interpolation
+# Create function to detect heartbeats in every row of a stack of signals
+def detect_beats_batch(signals, threshold, fs):
+    '''
+    A function to detect beats in a stack of signals with one vectorized pass, using
+    the same rule as detect_beats (the first sample of every run at or above threshold).
+
+    Parameters
+    ----------
+    signals : array of floats size (n, x) where n is the # of recordings and x is the # of samples
+        2D array containing one filtered ecg signal per row
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    fs : integer
+        The sampling frequency in Hz or 1/s
+
+    Returns
+    -------
+    beat_row : Array of integers size (b,) where b is the total # of beats detected
+        Row of signals that each beat belongs to, in increasing order.
+    beat_locations : Array of integers size (b,)
+        Sample index of each beat within its row.
+    beat_time : Array of floats size (b,)
+        Time in seconds of each beat within its row.
+
+    '''
+    above = signals >= threshold
+    # a beat starts where a sample is above the threshold and the one before it is not
+    starts = above.copy()
+    starts[:, 1:] &= ~above[:, :-1]
+    # nonzero works row by row, so beats come out sorted by row then by time
+    beat_row, beat_locations = np.nonzero(starts)
+    beat_time = beat_locations / fs
+    return beat_row, beat_locations, beat_time
+
+# Create function to interpolate the IBIs of every recording on its own time grid
+def interpolate_ibis_batch(beat_row, beat_time, recording_count, interpolated_time,
+                           method = 'linear'):
+    '''
+    A function to calculate the inter-beat intervals of many recordings and interpolate
+    them on evenly spaced time grids, shared or one per row. Linear interpolation is done with a
+    single call to np.interp: each row is shifted to its own time offset so rows never
+    interpolate into each other, and extra points at the edges of each row hold its
+    first and last IBI. The cubic methods are fitted row by row with interpolate_ibis,
+    since each row needs its own spline, so they cost one Python-level fit per recording
+    (see the batch suite of project3_benchmark for how much this costs).
+
+    Parameters
+    ----------
+    beat_row : Array of integers size (b,) where b is the total # of beats
+        Row that each beat belongs to, sorted by row then by time.
+    beat_time : Array of floats size (b,)
+        Time in seconds of each beat within its row.
+    recording_count : integer
+        Number of recordings (rows) in the batch
+    interpolated_time : Array of floats size (m,) or (n, m) where n is recording_count
+        Evenly spaced times in seconds at which to interpolate the IBIs of every row,
+        or of each row. Rows of different lengths are padded with nan, and give nan there.
+    method : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+
+    Returns
+    -------
+    interpolated_ibi : Array of floats size (n, m) where n is recording_count
+        Interpolated IBI timecourse of each recording. Rows with fewer than
+        two beats are filled with nan.
+
+    '''
+    interpolated_time = np.broadcast_to(interpolated_time, (recording_count, np.shape(interpolated_time)[-1]))
+    interpolated_ibi = np.full(interpolated_time.shape, np.nan)
+    # IBIs are only taken between beats in the same row
+    same_row = beat_row[1:] == beat_row[:-1]
+    ibi_values = np.diff(beat_time)[same_row]
+    ibi_row = beat_row[1:][same_row]
+    ibi_time = beat_time[1:][same_row]
+    if len(ibi_values) == 0:
+        return interpolated_ibi
+    if method != 'linear':
+        # splines need their own fit for every row
+        for row in np.unique(ibi_row):
+            row_beats = beat_time[beat_row == row]
+            known = ~np.isnan(interpolated_time[row])
+            interpolated_ibi[row, known] = p3m.interpolate_ibis(row_beats, interpolated_time[row, known], method)
+        return interpolated_ibi
+
+    # give each row its own stretch of the time axis with a gap between rows
+    max_time = max(np.nanmax(interpolated_time), ibi_time.max())
+    span = max_time + 2
+    rows = np.unique(ibi_row)
+    first_index = np.searchsorted(ibi_row, rows, side = 'left')
+    last_index = np.searchsorted(ibi_row, rows, side = 'right') - 1
+    # edge points just before and just after each row hold its first and last IBI
+    edge_time = np.concatenate((rows*span - 0.5, rows*span + max_time + 0.5))
+    edge_values = np.concatenate((ibi_values[first_index], ibi_values[last_index]))
+    known_time = np.concatenate((ibi_row*span + ibi_time, edge_time))
+    known_values = np.concatenate((ibi_values, edge_values))
+    # sort by shifted time so rows come one after another
+    order = np.argsort(known_time, kind = 'stable')
+
+    #interpolate every row in one call on the shifted grid, nan times give nan
+    grid = (rows[:, np.newaxis]*span + interpolated_time[rows]).ravel()
+    interpolated_ibi[rows] = np.interp(grid, known_time[order], known_values[order]).reshape(len(rows), -1)
+    return interpolated_ibi
+
+#%% Batch analysis
+# Create function to run the full analysis on a stack of equal-length signals
+def analyze_signal_stack(signals, threshold, fs, dt = 0.1, method = 'linear'):
+    '''
+    A function to filter a stack of equal-length ECG signals, detect beats, and calculate
+    the HRV and LF/HF ratio of every row, with each step done once for the whole stack.
+    The results match calculate_ibis, frequency_filter and extract_mean_power run on
+    each row: the IBIs of each row are interpolated from its second beat to its last.
+
+    Filtering, beat detection and linear IBI interpolation are single calls for the
+    whole stack. The FFT is not: each row's IBI timecourse has its own length, which
+    sets its own frequency axis, so rows are transformed together only when their
+    lengths match, and the FFT costs one call per distinct length. Padding every row to
+    one common length would make this a single call, but it moves the frequencies and
+    changes the LF/HF ratio by up to about 15% (see Spectrum), so the results would no
+    longer match frequency_filter. With real recordings almost every row has its own
+    length, so this step, like the cubic and PCHIP fits, scales with the number of
+    recordings rather than running once. The batch suite of project3_benchmark times
+    the stack against analyzing each row with project3_module.
+
+    Parameters
+    ----------
+    signals : array of floats size (n, x) where n is the # of recordings and x is the # of samples
+        2D array containing one unfiltered ecg signal per row
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    dt : float, optional
+        Spacing in seconds of the interpolated IBI timecourse. The default is 0.1.
+    method : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+
+    Returns
+    -------
+    beat_count : Array of integers size (n,)
+        Number of beats detected in each recording
+    hrv : Array of floats size (n,)
+        Standard deviation of the interpolated IBIs of each recording
+    ratio : Array of floats size (n,)
+        Ratio of mean LF power to mean HF power of each recording
+
+    '''
+    recording_count = len(signals)
+    # filter every recording with one filtfilt call along the sample axis
+    filtered_signals = p3m.filter_butter(signals, fs, axis = -1)
+    beat_row, _, beat_time = detect_beats_batch(filtered_signals, threshold, fs)
+    beat_count = np.bincount(beat_row, minlength = recording_count)
+
+    # interpolate the IBIs of each row at dt from its second beat to its last, as
+    # resample_ibis does, padding the shorter grids with nan
+    first_beat = np.searchsorted(beat_row, np.arange(recording_count), side = 'left')
+    grid_start = np.full(recording_count, np.nan)
+    grid_length = np.zeros(recording_count, dtype = int)
+    has_ibi = beat_count >= 2
+    grid_start[has_ibi] = beat_time[first_beat[has_ibi] + 1]
+    grid_end = beat_time[first_beat[has_ibi] + beat_count[has_ibi] - 1]
+    # the same length np.arange gives
+    grid_length[has_ibi] = np.maximum(np.ceil((grid_end - grid_start[has_ibi]) / dt), 0)
+    steps = np.arange(grid_length.max(initial = 0))
+    interpolated_time = np.where(steps < grid_length[:, np.newaxis], grid_start[:, np.newaxis] + steps*dt, np.nan)
+    interpolated_ibi = interpolate_ibis_batch(beat_row, beat_time, recording_count, interpolated_time, method)
+    with np.errstate(invalid = 'ignore', divide = 'ignore'):
+        hrv = np.full(recording_count, np.nan)
+        hrv[grid_length > 0] = np.nanstd(interpolated_ibi[grid_length > 0], axis = -1)
+
+        # take the FFT of every IBI timecourse of the same length at once, they share one
+        # frequency axis; rows of different lengths need their own call, see the docstring
+        ratio = np.full(recording_count, np.nan)
+        for length in np.unique(grid_length[grid_length > 0]):
+            rows = np.where(grid_length == length)[0]
+            ibi_rows = interpolated_ibi[rows, :length]
+            power = np.square(np.abs(fft.rfft(ibi_rows - np.mean(ibi_rows, axis = -1, keepdims = True), axis = -1)))
+            frequency = fft.rfftfreq(length, dt)
+            low_band = (frequency >= p3m.ratio_bands['lf'][0]) & (frequency <= p3m.ratio_bands['lf'][1])
+            high_band = (frequency >= p3m.ratio_bands['hf'][0]) & (frequency <= p3m.ratio_bands['hf'][1])
+            # ratio of mean LF power to mean HF power for every row
+            ratio[rows] = np.mean(power[:, low_band], axis = -1) / np.mean(power[:, high_band], axis = -1)
+    return beat_count, hrv, ratio
+
+# Create function to analyze a list of recording files
+def analyze_recordings(input_files, duration, fs, threshold, dt = 0.1, method = 'linear'):
+    '''
+    A function to load many recordings, group the ones with the same number of
+    samples into stacks, and analyze each stack with analyze_signal_stack.
+
+    Parameters
+    ----------
+    input_files : list of strings
+        Names of the txt files to be analyzed
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBI timecourse. The default is 0.1.
+    method : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+
+    Returns
+    -------
+    results : structured array size (n,) where n is the # of input files
+        One row per recording, in the order of input_files, with fields input_file,
+        sample_count, beat_count, hrv and ratio.
+
+    '''
+    results = np.zeros(len(input_files), dtype = results_dtype)
+    signals = [p3m.load_data(input_file, duration, fs) for input_file in input_files]
+    results['input_file'] = input_files
+    results['sample_count'] = [len(signal) for signal in signals]
+    # analyze each group of recordings with the same length as one stack
+    for sample_count in np.unique(results['sample_count']):
+        group = np.where(results['sample_count'] == sample_count)[0]
+        stack = np.stack([signals[index] for index in group])
+        beat_count, hrv, ratio = analyze_signal_stack(stack, threshold, fs, dt, method)
+        results['beat_count'][group] = beat_count
+        results['hrv'][group] = hrv
+        results['ratio'][group] = ratio
+    return results
+
+# Create function to write the results table to a csv file
+def save_results_table(results, output_file):
+    '''
+    A function to write a results table from analyze_recordings to a csv file
+    with a header row of field names.
+
+    Parameters
+    ----------
+    results : structured array size (n,)
+        Results table with one row per recording
+    output_file : string
+        Name of the csv file to write
+
+    Returns
+    -------
+    None.
+
+    '''
+    with open(output_file, 'w', newline = '') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(results.dtype.names)
+        writer.writerows(results.tolist())
@@ -0,0 +1,983 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Benchmark
+This script measures the speed and accuracy of the analysis functions. It contains a
+generator for synthetic ECG signals with known beat times, so the accuracy of the beat
+detectors can be measured exactly, and it also runs the detectors on the bundled
+recordings, where the true beats are unknown and accuracy is judged by how many of the
+detected inter-beat intervals are physiologically possible. The spectral estimates are
+compared by their cost and by how much their LF/HF ratio varies between signals.
+Finally, every stage of project3_module and the full pipeline are timed on the bundled
+recordings and on synthetic recordings of 5 minutes, 1 hour and 24 hours, recording
+wall time, peak memory and samples/sec, and compared against a stored baseline. The
+dtype suite runs the analysis with float32 signals, checks its HRV and LF/HF ratio
+against float64, and measures the time and memory saved. The startup suite times a
+headless run of project3_analyze in a new Python process, from importing it to
+printing the results, with and without cached stage results. The store suite measures
+how many rows per second project3_store appends with and without batching, and how
+long an indexed query for one activity takes. The channels suite compares processing
+three leads of a synthetic recording one at a time and in one multi-lead pass, and
+scores the beats fused across the leads against a lead with motion artifacts. The bands
+suite times sweeping hundreds of frequency band definitions over one IBI spectrum,
+recomputing the FFT for each band and querying one Spectrum. The batch suite times
+project3_batch on stacks of recordings against analyzing each recording alone.
+
+Run it with:
+    python project3_benchmark.py                  # stage benchmark, compared to the baseline
+    python project3_benchmark.py --save-baseline  # stage benchmark, stored as the new baseline
+    python project3_benchmark.py --suites detectors spectral ibi dtype startup store channels bands batch
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from scipy import signal as sps
+import project3_module as p3m
+import project3_detectors as p3d
+import project3_spectral as p3s
+import project3_store as p3store
+
+# bundled recordings and their activity labels
+bundled_recordings = {
+    'Rest': 'rest_data (1).txt',
+    'Relaxing': 'on_phone_data (1).txt',
+    'Mental Stress': 'stressful_rest (1).txt',
+    'Physical Activity': 'wallsit_data (1).txt',
+}
+
+# file the stage benchmark results are stored in and compared against
+baseline_file = 'benchmark_baseline.json'
+
+#%% Synthetic data
+# Create function to generate a synthetic ECG signal with known beat times
+def generate_synthetic_ecg(duration, fs, heart_rate = 70, seed = 0, noise = 5, drift = 40):
+    '''
+    A function to generate an ECG-like signal at the Arduino's scale, with beat
+    intervals that vary with breathing (0.25 Hz), with a slower 0.1 Hz rhythm and at
+    random, beat sizes that vary with breathing, plus a slow baseline drift and
+    random noise.
+
+    Parameters
+    ----------
+    duration : float
+        Length of the signal in seconds
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    heart_rate : float, optional
+        Average heart rate in beats per minute. The default is 70.
+    seed : integer, optional
+        Seed of the random number generator. The default is 0.
+    noise : float, optional
+        Standard deviation of the added noise. The default is 5.
+    drift : float, optional
+        Amplitude of the 0.05 Hz baseline drift. The default is 40.
+
+    Returns
+    -------
+    signal : array of floats size (x,) where x is duration*fs
+        1D array containing the synthetic ecg voltage data
+    beat_time : Array of floats size (b,) where b is the # of beats
+        True times in seconds of the R peaks
+
+    '''
+    rng = np.random.default_rng(seed)
+    sample_count = int(duration*fs)
+    # draw enough beat intervals to fill the signal, then keep the beats inside it
+    mean_ibi = 60 / heart_rate
+    beat_count = int(duration / (0.7*mean_ibi)) + 2
+    ibi_values = mean_ibi + 0.02*rng.standard_normal(beat_count)
+    beat_time = np.cumsum(ibi_values)
+    ibi_values += 0.04*np.sin(2*np.pi*0.25*beat_time) + 0.03*np.sin(2*np.pi*0.1*beat_time)
+    beat_time = np.cumsum(ibi_values)
+    beat_time = beat_time[beat_time < duration - 0.5]
+
+    # place an impulse at each beat and convolve it with the shape of one heartbeat,
+    # with the beat size changing with breathing
+    impulses = np.zeros(sample_count)
+    impulses[np.round(beat_time*fs).astype(int)] = 1 + 0.3*np.sin(2*np.pi*0.25*beat_time)
+    template_time = np.arange(-0.3, 0.5, 1/fs)
+    waves = [(15, -0.2, 0.025), (-20, -0.03, 0.01), (300, 0, 0.04), (-40, 0.03, 0.01), (40, 0.25, 0.05)]
+    template = sum(amplitude*np.exp(-0.5*np.square((template_time - center) / width))
+                   for amplitude, center, width in waves)
+    # shift the output so the template's zero time lines up with the impulse
+    beats = sps.oaconvolve(impulses, template)[int(0.3*fs):int(0.3*fs) + sample_count]
+
+    time_general = np.arange(sample_count)/fs
+    baseline = 300 + drift*np.sin(2*np.pi*0.05*time_general)
+    signal = baseline + beats + noise*rng.standard_normal(sample_count)
+    return signal, beat_time
+
+# Create function to save a synthetic signal as a text recording
+def save_synthetic_recording(signal, output_file):
+    '''
+    A function to round a synthetic signal to integer ADC values and save it in the
+    same text format as the Arduino recordings, one sample per line.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) where x is the number of samples
+        1D array containing the synthetic ecg voltage data
+    output_file : string
+        Name of the txt file to write
+
+    Returns
+    -------
+    None.
+
+    '''
+    samples = np.clip(np.round(signal), 0, 1023).astype(int)
+    with open(output_file, 'w') as text_file:
+        # write in chunks so a 24 hour recording is not joined into one huge string
+        for chunk_start in range(0, len(samples), p3m.chunk_size):
+            text_file.write('\n'.join(map(str, samples[chunk_start:chunk_start + p3m.chunk_size].tolist())) + '\n')
+
+#%% Accuracy measures
+# Create function to compare detected beats with the true beats
+def score_beats(detected_time, true_time, tolerance = 0.15):
+    '''
+    A function to measure how well detected beats match the true beats. A beat counts
+    as matched if there is a beat in the other set within the tolerance.
+
+    Parameters
+    ----------
+    detected_time : Array of floats size (d,)
+        Times in seconds of the detected beats
+    true_time : Array of floats size (t,)
+        Times in seconds of the true beats
+    tolerance : float, optional
+        Largest time difference in seconds for a match. The default is 0.15.
+
+    Returns
+    -------
+    sensitivity : float
+        Fraction of true beats which were detected
+    precision : float
+        Fraction of detected beats which are true beats
+
+    '''
+    def nearest_distance(times, reference):
+        # distance from each time to the closest reference time
+        if len(reference) == 0:
+            return np.full(len(times), np.inf)
+        index = np.clip(np.searchsorted(reference, times), 1, max(len(reference) - 1, 1))
+        return np.minimum(np.abs(times - reference[index - 1]), np.abs(times - reference[np.minimum(index, len(reference) - 1)]))
+    sensitivity = np.mean(nearest_distance(true_time, detected_time) <= tolerance) if len(true_time) > 0 else np.nan
+    precision = np.mean(nearest_distance(detected_time, true_time) <= tolerance) if len(detected_time) > 0 else np.nan
+    return sensitivity, precision
+
+# Create function to judge beats when the true beats are unknown
+def score_plausibility(beat_time, shortest_ibi = 0.3, longest_ibi = 2):
+    '''
+    A function to get the fraction of inter-beat intervals between 30 and 200 bpm.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds of the detected beats
+    shortest_ibi : float, optional
+        Shortest plausible IBI in seconds. The default is 0.3.
+    longest_ibi : float, optional
+        Longest plausible IBI in seconds. The default is 2.
+
+    Returns
+    -------
+    plausible_fraction : float
+        Fraction of the IBIs which are plausible
+
+    '''
+    ibi_values = np.diff(beat_time)
+    if len(ibi_values) == 0:
+        return np.nan
+    plausible_fraction = np.mean((ibi_values >= shortest_ibi) & (ibi_values <= longest_ibi))
+    return plausible_fraction
+
+#%% Benchmarks
+# Create function to time a function call
+def time_call(function, *args, repeats = 3, **kwargs):
+    '''
+    A function to call a function several times and return its result and its
+    fastest wall time.
+
+    Parameters
+    ----------
+    function : callable
+        Function to time
+    *args
+        Arguments passed to the function
+    repeats : integer, optional
+        Number of times to call the function. The default is 3.
+    **kwargs
+        Keyword arguments passed to the function
+
+    Returns
+    -------
+    result : any
+        Result of the last call
+    best_time : float
+        Fastest wall time in seconds
+
+    '''
+    best_time = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args, **kwargs)
+        best_time = min(best_time, time.perf_counter() - start)
+    return result, best_time
+
+# Create function to benchmark every beat detector
+def benchmark_detectors(fs = 500, duration = 300, threshold = 40, repeats = 3):
+    '''
+    A function to run every detector in project3_detectors on a synthetic signal and on
+    the bundled recordings, and print their speed and accuracy.
+
+    Parameters
+    ----------
+    fs : integer, optional
+        The sampling frequency in Hz or 1/s. The default is 500.
+    duration : integer, optional
+        Length in seconds of each signal. The default is 300.
+    threshold : float, optional
+        Threshold for the threshold detectors. The default is 40.
+    repeats : integer, optional
+        Number of times each detector is timed. The default is 3.
+
+    Returns
+    -------
+    rows : list of tuples
+        (signal name, detector, beats, samples/sec, sensitivity, precision, plausible fraction)
+        for every signal and detector
+
+    '''
+    signals = {}
+    synthetic_signal, true_time = generate_synthetic_ecg(duration, fs)
+    signals['Synthetic'] = (p3m.filter_butter(synthetic_signal, fs), true_time)
+    for label, input_file in bundled_recordings.items():
+        signals[label] = (p3m.filter_butter(p3m.load_data(input_file, duration, fs), fs), None)
+
+    # settings for the detectors that use a threshold
+    settings = {'threshold': {'threshold': threshold}, 'refractory': {'threshold': threshold}}
+    rows = []
+    print(f"{'signal':<18}{'detector':<14}{'beats':>7}{'Msamples/s':>12}{'sens':>7}{'prec':>7}{'plaus':>7}")
+    for label, (filtered_signal, true_time) in signals.items():
+        for method in p3d.detectors:
+            (beat_locations, beat_time), best_time = time_call(
+                p3d.detect, filtered_signal, fs, method, repeats = repeats, **settings.get(method, {}))
+            samples_per_second = len(filtered_signal) / best_time
+            if true_time is not None:
+                sensitivity, precision = score_beats(beat_time, true_time)
+            else:
+                sensitivity, precision = np.nan, np.nan
+            plausible_fraction = score_plausibility(beat_time)
+            rows.append((label, method, len(beat_time), samples_per_second, sensitivity, precision, plausible_fraction))
+            print(f'{label:<18}{method:<14}{len(beat_time):>7}{samples_per_second/1e6:>12.1f}'
+                  f'{sensitivity:>7.3f}{precision:>7.3f}{plausible_fraction:>7.3f}')
+    return rows
+
+# Create function to benchmark every spectral estimate
+def benchmark_spectral_methods(fs = 500, duration = 300, trials = 20):
+    '''
+    A function to run every method in project3_spectral on the beat times of several
+    synthetic signals with different random seeds, and print the average time of each
+    method and the mean and spread of the LF/HF ratio it finds.
+
+    Parameters
+    ----------
+    fs : integer, optional
+        The sampling frequency in Hz or 1/s. The default is 500.
+    duration : integer, optional
+        Length in seconds of each signal. The default is 300.
+    trials : integer, optional
+        Number of synthetic signals. The default is 20.
+
+    Returns
+    -------
+    rows : list of tuples
+        (method, mean seconds per call, mean LF/HF, standard deviation of LF/HF)
+
+    '''
+    beat_times = [generate_synthetic_ecg(duration, fs, seed = seed)[1] for seed in range(trials)]
+    rows = []
+    print(f"{'method':<8}{'ms/call':>10}{'LF/HF':>10}{'std':>10}")
+    for method in p3s.spectral_methods:
+        ratios = []
+        start = time.perf_counter()
+        for beat_time in beat_times:
+            ratios.append(p3s.calculate_band_powers(beat_time, method)['lf_hf'])
+        seconds_per_call = (time.perf_counter() - start) / trials
+        rows.append((method, seconds_per_call, np.mean(ratios), np.std(ratios)))
+        print(f'{method:<8}{seconds_per_call*1e3:>10.2f}{np.mean(ratios):>10.3f}{np.std(ratios):>10.3f}')
+    return rows
+
+# Create function to time IBI resampling as the recording duration grows
+def benchmark_ibi_resampling(durations = (300, 3600, 24*3600), dt = 0.1, repeats = 3):
+    '''
+    A function to resample the IBIs of synthetic beat series of increasing duration
+    with every interpolation method and print the time per second of recording, which
+    should stay about the same as the duration grows. The length of the IBI grid is
+    checked by tests/test_module.py.
+
+    Parameters
+    ----------
+    durations : tuple of floats, optional
+        Recording durations in seconds. The default is 5 minutes, 1 hour and 24 hours.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    repeats : integer, optional
+        Number of times each call is timed. The default is 3.
+
+    Returns
+    -------
+    rows : list of tuples
+        (duration, method, # of interpolated IBIs, microseconds per second of recording)
+
+    '''
+    rows = []
+    print(f"{'duration':>10}{'method':>8}{'IBIs':>10}{'us/s':>8}")
+    for duration in durations:
+        # beat times only, no need to build the full ECG signal
+        rng = np.random.default_rng(0)
+        beat_time = np.cumsum(0.85 + 0.05*rng.standard_normal(int(duration / 0.6)))
+        beat_time = beat_time[beat_time < duration]
+        for method in ('linear', 'cubic', 'pchip'):
+            (interpolated_time, interpolated_ibi), best_time = time_call(
+                p3m.resample_ibis, beat_time, dt, method, repeats = repeats)
+            rows.append((duration, method, len(interpolated_ibi), best_time / duration * 1e6))
+            print(f'{duration:>10}{method:>8}{len(interpolated_ibi):>10}{best_time / duration * 1e6:>8.2f}')
+    return rows
+
+# Create function to measure the wall time and peak memory of a function call
+def measure_call(function, *args, repeats = 3):
+    '''
+    A function to measure a function call. The fastest wall time of several calls is
+    taken with memory tracing off, then one more call is traced with tracemalloc to
+    get the peak memory allocated during the call.
+
+    Parameters
+    ----------
+    function : callable
+        Function to measure
+    *args
+        Arguments passed to the function
+    repeats : integer, optional
+        Number of timed calls. The default is 3.
+
+    Returns
+    -------
+    result : any
+        Result of the function
+    best_time : float
+        Fastest wall time in seconds
+    peak_memory : integer
+        Peak memory in bytes allocated during the call
+
+    '''
+    result, best_time = time_call(function, *args, repeats = repeats)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    function(*args)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best_time, peak_memory
+
+# Create function to run the full analysis on one recording
+def run_pipeline(input_file, duration, fs, threshold, dt, dtype = None):
+    '''
+    A function to run every stage of project3_module on a recording, as the script does.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt file to be analyzed
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float
+        Spacing in seconds of the interpolated IBIs
+    dtype : data type, optional
+        np.float32 or np.float64 to load and filter the signal in. The default is None,
+        which uses p3m.signal_dtype.
+
+    Returns
+    -------
+    hrv : float
+        Standard deviation of the interpolated IBIs
+    ratio : float
+        LF/HF ratio
+
+    '''
+    data_file = p3m.load_data(input_file, duration, fs, dtype = dtype)
+    filtered_signal = p3m.filter_butter(data_file, fs)
+    beat_locations, beat_time = p3m.detect_beats(filtered_signal, threshold, fs)
+    interpolated_ibi, hrv = p3m.calculate_ibis(beat_locations, beat_time, dt)
+    frequency, power, low_freq, low_power, high_freq, high_power = p3m.frequency_filter(interpolated_ibi, dt)
+    ratio = p3m.extract_mean_power(low_power, high_power)
+    return hrv, ratio
+
+# Create function to compare the analysis in float32 with float64
+def benchmark_dtypes(durations = (300, 3600, 24*3600), fs = 500, threshold = 40, dt = 0.1, repeats = 3):
+    '''
+    A function to measure the time and peak memory of the pipeline in float32 and
+    float64 on the bundled recordings, with the relative difference of the HRV and
+    LF/HF ratio, and of filtering synthetic recordings of increasing duration, where
+    the signal arrays take most of the memory. tests/test_module.py checks that the
+    differences stay within 1%.
+
+    Parameters
+    ----------
+    durations : tuple of floats, optional
+        Durations in seconds of the synthetic recordings. The default is 5 minutes,
+        1 hour and 24 hours.
+    fs : integer, optional
+        The sampling frequency in Hz or 1/s. The default is 500.
+    threshold : float, optional
+        Specified value to identify the QRS wave complex. The default is 40.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    repeats : integer, optional
+        Number of times each call is timed. The default is 3.
+
+    Returns
+    -------
+    rows : list of tuples
+        (label, float64 seconds, float32 seconds, float64 peak bytes, float32 peak bytes)
+
+    '''
+    rows = []
+    print(f"{'recording':<18}{'HRV err':>10}{'LF/HF err':>11}{'f64 (ms)':>10}{'f32 (ms)':>10}{'f64 (MB)':>10}{'f32 (MB)':>10}")
+    for label, input_file in bundled_recordings.items():
+        results = {}
+        for dtype in (np.float64, np.float32):
+            results[dtype] = measure_call(lambda: run_pipeline(input_file, 300, fs, threshold, dt, dtype), repeats = repeats)
+        (hrv, ratio), time_64, memory_64 = results[np.float64]
+        (hrv_32, ratio_32), time_32, memory_32 = results[np.float32]
+        hrv_error = abs(hrv_32/hrv - 1)
+        ratio_error = abs(ratio_32/ratio - 1)
+        rows.append((label, time_64, time_32, memory_64, memory_32))
+        print(f'{label:<18}{hrv_error:>10.1e}{ratio_error:>11.1e}{time_64*1e3:>10.2f}{time_32*1e3:>10.2f}'
+              f'{memory_64/2**20:>10.2f}{memory_32/2**20:>10.2f}')
+    for duration in durations:
+        signal = generate_synthetic_ecg(duration, fs)[0]
+        _, time_64, memory_64 = measure_call(p3m.filter_butter, signal.astype(np.float64), fs, repeats = repeats)
+        _, time_32, memory_32 = measure_call(p3m.filter_butter, signal.astype(np.float32), fs, repeats = repeats)
+        label = f'filter {duration}s'
+        rows.append((label, time_64, time_32, memory_64, memory_32))
+        print(f"{label:<18}{'':>21}{time_64*1e3:>10.2f}{time_32*1e3:>10.2f}"
+              f'{memory_64/2**20:>10.2f}{memory_32/2**20:>10.2f}')
+    return rows
+
+# Create function to time a headless analysis in a new Python process
+def benchmark_startup(input_file = bundled_recordings['Rest'], repeats = 3):
+    '''
+    A function to measure the cold start of the analysis: the wall time of a new
+    Python process which imports project3_analyze, and which analyzes one recording
+    with no cache, with an empty cache and with every stage cached. It also checks
+    which heavy libraries each run loads; matplotlib should never be loaded, and
+    scipy should not be loaded by the import or the cached run.
+
+    Parameters
+    ----------
+    input_file : string, optional
+        Recording to analyze. The default is the bundled rest recording.
+    repeats : integer, optional
+        Number of processes started for each run, the fastest is kept. The default is 3.
+
+    Returns
+    -------
+    rows : list of tuples
+        (run, fastest seconds, heavy libraries loaded)
+
+    '''
+    heavy_modules = ('scipy', 'scipy.signal', 'matplotlib')
+    report = f"import sys; print(','.join(m for m in {heavy_modules!r} if m in sys.modules))"
+    rows = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        runs = {'import': 'import project3_analyze',
+                'no cache': f'import project3_analyze as p3a; p3a.Pipeline(use_cache = False).run([{input_file!r}])',
+                'empty cache': 'import shutil; shutil.rmtree({0!r}, ignore_errors = True); import project3_analyze as p3a; '
+                               'p3a.Pipeline(cache_dir = {0!r}).run([{1!r}])'.format(cache_dir, input_file),
+                'cached': f'import project3_analyze as p3a; p3a.Pipeline(cache_dir = {cache_dir!r}).run([{input_file!r}])'}
+        print(f"{'run':<14}{'time (ms)':>10}  libraries loaded")
+        for run, code in runs.items():
+            best_time = np.inf
+            for repeat in range(repeats):
+                start = time.perf_counter()
+                loaded = subprocess.run([sys.executable, '-c', f'{code}; {report}'], capture_output = True, text = True,
+                                        check = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+                best_time = min(best_time, time.perf_counter() - start)
+            assert 'matplotlib' not in loaded, f'{run} loaded matplotlib'
+            if run in ('import', 'cached'):
+                assert 'scipy' not in loaded, f'{run} loaded scipy'
+            rows.append((run, best_time, loaded))
+            print(f'{run:<14}{best_time*1e3:>10.0f}  {loaded or "-"}')
+    return rows
+
+# Create function to measure the write and query speed of the results store
+def benchmark_store(row_count = 100000, batch_sizes = (1, 100, 10000), label_count = 10):
+    '''
+    A function to append rows of random metrics to a new results store with several
+    batch sizes, printing the rows written per second, and then to time selecting the
+    rows of one activity and summarizing a metric by activity.
+
+    Parameters
+    ----------
+    row_count : integer, optional
+        Number of rows appended with the largest batch size. Smaller batch sizes
+        append fewer rows, so each takes about as long. The default is 100000.
+    batch_sizes : tuple of integers, optional
+        Rows written in each transaction. The default is 1, 100 and 10000.
+    label_count : integer, optional
+        Number of activities the rows are split between. The default is 10.
+
+    Returns
+    -------
+    rows : list of tuples
+        (measure, rows, seconds)
+
+    '''
+    rng = np.random.default_rng(0)
+    rows = []
+    with tempfile.TemporaryDirectory() as store_dir:
+        for batch_size in batch_sizes:
+            append_count = min(row_count, 100*batch_size)
+            store_file = os.path.join(store_dir, f'batch_{batch_size}.sqlite')
+            with p3store.ResultsStore(store_file, batch_size) as store:
+                start = time.perf_counter()
+                for row in range(append_count):
+                    store.append(f'recording_{row // 5}', f'label_{row % label_count}',
+                                 {'hrv': rng.random(), 'lf_hf': rng.random(), 'beat_count': 300},
+                                 (row % 5 * 60, row % 5 * 60 + 60), 500, 40, 0.1)
+                store.flush()
+                seconds = time.perf_counter() - start
+            rows.append((f'append, batches of {batch_size}', append_count, seconds))
+        with p3store.ResultsStore(store_file) as store:
+            start = time.perf_counter()
+            selected = store.select(['recording_id', 'hrv'], label = 'label_0')
+            rows.append(('select one label', len(selected), time.perf_counter() - start))
+            start = time.perf_counter()
+            summary = store.summarize('hrv')
+            rows.append(('summarize by label', int(np.sum(summary['count'])), time.perf_counter() - start))
+    print(f"{'measure':<28}{'rows':>10}{'time (ms)':>12}{'rows/s':>12}")
+    for measure, count, seconds in rows:
+        print(f'{measure:<28}{count:>10}{seconds*1e3:>12.1f}{count / seconds:>12.0f}')
+    return rows
+
+# Create function to compare multi-lead processing with processing each lead alone
+def benchmark_channels(duration = 600, fs = 500, threshold = 40, channel_count = 3, artifact_fraction = 0.2,
+                       repeats = 3):
+    '''
+    A function to make a synthetic multi-lead recording, where every lead sees the same
+    beats at a different size and noise and the last lead has bursts of motion
+    artifacts. It times loading, filtering and detecting the beats of each lead from
+    its own text file, and of all leads at once from one text file with a column per
+    lead. The beats of each lead and the beats fused across leads with fuse_beats are
+    scored against the true beats.
+
+    Parameters
+    ----------
+    duration : float, optional
+        Length of the recording in seconds. The default is 600.
+    fs : integer, optional
+        The sampling frequency in Hz or 1/s. The default is 500.
+    threshold : float, optional
+        Specified value to identify the QRS wave complex. The default is 40.
+    channel_count : integer, optional
+        Number of leads. The default is 3.
+    artifact_fraction : float, optional
+        Fraction of the last lead covered by artifacts. The default is 0.2.
+    repeats : integer, optional
+        Number of times each call is timed. The default is 3.
+
+    Returns
+    -------
+    rows : list of tuples
+        (method, seconds, sensitivity, precision)
+
+    '''
+    signal, true_time = generate_synthetic_ecg(duration, fs)
+    rng = np.random.default_rng(1)
+    gains = np.linspace(1, 0.7, channel_count)
+    signals = 300 + (signal - 300)[:, np.newaxis]*gains + 5*rng.standard_normal((len(signal), channel_count))
+    # 2 second bursts of slow swings from movement in the last lead
+    burst_length = 2*fs
+    burst_starts = rng.choice(len(signal) // burst_length, int(artifact_fraction*len(signal) / burst_length), replace = False)
+    burst_time = np.arange(burst_length) / fs
+    for burst_start in burst_starts*burst_length:
+        signals[burst_start:burst_start + burst_length, -1] += 150*np.sin(2*np.pi*rng.uniform(1, 2)*burst_time)
+    signals = np.clip(np.round(signals), 0, 1023).astype(int)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as recording_dir:
+        lead_files = [os.path.join(recording_dir, f'lead_{channel + 1}.txt') for channel in range(channel_count)]
+        for channel, lead_file in enumerate(lead_files):
+            np.savetxt(lead_file, signals[:, channel], fmt = '%d')
+        multi_lead_file = os.path.join(recording_dir, 'leads.txt')
+        np.savetxt(multi_lead_file, signals, fmt = '%d')
+
+        def process_separately():
+            return [p3m.detect_beats(p3m.filter_butter(p3m.load_data(lead_file, duration, fs), fs), threshold, fs)[0]
+                    for lead_file in lead_files]
+
+        def process_together():
+            return p3m.detect_beats(p3m.filter_butter(p3m.load_data(multi_lead_file, duration, fs), fs), threshold, fs)[0]
+
+        separate_locations, separate_time = time_call(process_separately, repeats = repeats)
+        beat_locations, together_time = time_call(process_together, repeats = repeats)
+    assert all(np.array_equal(separate, together) for separate, together in zip(separate_locations, beat_locations)), \
+        'multi-lead beats differ from single-lead beats'
+    rows.append(('leads separately', separate_time, np.nan, np.nan))
+    rows.append(('leads together', together_time, np.nan, np.nan))
+    for channel, channel_locations in enumerate(beat_locations):
+        rows.append((f'lead {channel + 1}', np.nan, *score_beats(channel_locations / fs, true_time)))
+    fused_time = p3m.fuse_beats(beat_locations, fs)[1]
+    rows.append(('fused', np.nan, *score_beats(fused_time, true_time)))
+    print(f"{'method':<22}{'time (ms)':>10}{'sens':>7}{'prec':>7}")
+    for method, seconds, sensitivity, precision in rows:
+        print(f'{method:<22}{seconds*1e3:>10.1f}{sensitivity:>7.3f}{precision:>7.3f}')
+    return rows
+
+# Create function to time sweeping many frequency bands over one IBI spectrum
+def benchmark_band_sweep(durations = (300, 3600, 24*3600), band_count = 500, dt = 0.1, repeats = 3):
+    '''
+    A function to find the mean power of many random frequency bands in the IBI
+    timecourse of synthetic beat series of increasing duration: by transforming the
+    timecourse again for every band as frequency_filter would, by masking one
+    transform for every band, and by querying one Spectrum for each band, for all
+    bands at once, and for all bands after padding to a fast FFT length. The powers
+    must agree to within rounding.
+
+    Parameters
+    ----------
+    durations : tuple of floats, optional
+        Recording durations in seconds. The default is 5 minutes, 1 hour and 24 hours.
+    band_count : integer, optional
+        Number of bands in the sweep. The default is 500.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    repeats : integer, optional
+        Number of times each sweep is timed. The default is 3.
+
+    Returns
+    -------
+    rows : list of tuples
+        (duration, method, seconds for the whole sweep)
+
+    '''
+    rng = np.random.default_rng(0)
+    # bands at least two frequency steps of the shortest recording wide, so each
+    # holds a frequency however short the recordings are
+    min_width = 2 / min(durations)
+    band_low = rng.uniform(0.003, 0.4, band_count)
+    band_edges = np.column_stack((band_low, band_low + rng.uniform(min_width, max(0.15, 2*min_width), band_count)))
+
+    def sweep_refft(ibi_values, bands):
+        band_power = np.empty(len(bands))
+        for band_index, (low, high) in enumerate(bands):
+            frequency, power = p3m.frequency_filter(ibi_values, dt)[:2]
+            band_power[band_index] = np.mean(power[(frequency >= low) & (frequency <= high)])
+        return band_power
+
+    def sweep_masks(ibi_values):
+        frequency, power = p3m.frequency_filter(ibi_values, dt)[:2]
+        return np.array([np.mean(power[(frequency >= low) & (frequency <= high)]) for low, high in band_edges])
+
+    def sweep_queries(ibi_values):
+        spectrum = p3m.Spectrum(ibi_values, dt)
+        return np.array([spectrum.get_band_power(band) for band in band_edges])
+
+    def sweep_vectorized(ibi_values, pad = False):
+        return p3m.Spectrum(ibi_values, dt, pad).get_band_power(band_edges)
+
+    rows = []
+    print(f"{'duration':>10}{'IBIs':>9}{'method':>22}{'sweep (ms)':>12}{'us/band':>10}")
+    for duration in durations:
+        beat_time = np.cumsum(0.85 + 0.05*rng.standard_normal(int(duration / 0.6)))
+        beat_time = beat_time[beat_time < duration]
+        ibi_values = p3m.resample_ibis(beat_time, dt)[1]
+        # transforming again for every band is slow, so only the first 20 bands are
+        # timed and the time is scaled up to the whole sweep
+        results = {'FFT per band': (None, time_call(sweep_refft, ibi_values, band_edges[:20], repeats = 1)[1]
+                                    * band_count / 20)}
+        reference, results['masks per band'] = time_call(sweep_masks, ibi_values, repeats = repeats)
+        results['masks per band'] = (reference, results['masks per band'])
+        results['Spectrum per band'] = time_call(sweep_queries, ibi_values, repeats = repeats)
+        results['Spectrum all bands'] = time_call(sweep_vectorized, ibi_values, repeats = repeats)
+        # padding moves the frequencies, so its powers are not compared
+        results['Spectrum padded'] = (None, time_call(sweep_vectorized, ibi_values, True, repeats = repeats)[1])
+        for method, (band_power, seconds) in results.items():
+            if band_power is not None:
+                assert np.allclose(band_power, reference, rtol = 1e-9, atol = 1e-9*np.nanmax(reference),
+                                   equal_nan = True), \
+                    f'{method} band powers differ from the band masks'
+            rows.append((duration, method, seconds))
+            print(f'{duration:>10}{len(ibi_values):>9}{method:>22}{seconds*1e3:>12.2f}{seconds / band_count * 1e6:>10.2f}')
+    return rows
+
+# Create function to compare analyzing a stack of recordings with analyzing each alone
+def benchmark_batch(row_counts = (4, 16, 64), duration = 300, fs = 500, threshold = 40, dt = 0.1, repeats = 3):
+    '''
+    A function to time project3_batch on stacks of synthetic recordings against running
+    project3_module on each recording in turn, for every IBI interpolation method. Each
+    recording has its own beats, so its IBI timecourse has its own length, which is the
+    case where the batch FFT and the cubic and PCHIP fits still loop over the rows. The
+    beat counts, HRV and LF/HF ratios must agree.
+
+    Parameters
+    ----------
+    row_counts : tuple of integers, optional
+        Numbers of recordings in the stacks. The default is 4, 16 and 64.
+    duration : float, optional
+        Length of each recording in seconds. The default is 300.
+    fs : integer, optional
+        The sampling frequency in Hz or 1/s. The default is 500.
+    threshold : float, optional
+        Specified value to identify the QRS wave complex. The default is 40.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    repeats : integer, optional
+        Number of times each analysis is timed. The default is 3.
+
+    Returns
+    -------
+    rows : list of tuples
+        (row count, method, distinct IBI lengths, seconds per row alone, seconds as a stack)
+
+    '''
+    import project3_batch as p3b
+
+    def analyze_rows(signals, method):
+        results = np.empty((len(signals), 4))
+        for row, signal in enumerate(signals):
+            beat_locations, beat_time = p3m.detect_beats(p3m.filter_butter(signal, fs), threshold, fs)
+            interpolated_ibi, hrv = p3m.calculate_ibis(beat_locations, beat_time, dt, method)
+            low_power, high_power = p3m.frequency_filter(interpolated_ibi, dt)[3::2]
+            results[row] = len(beat_locations), hrv, p3m.extract_mean_power(low_power, high_power), len(interpolated_ibi)
+        return results
+
+    rows = []
+    print(f"{'rows':>6}{'method':>8}{'lengths':>9}{'alone (ms)':>12}{'stack (ms)':>12}{'speedup':>9}")
+    for row_count in row_counts:
+        # a different heart rate and seed for every row, as in a real batch of recordings
+        signals = np.stack([generate_synthetic_ecg(duration, fs, 60 + row % 30, seed = row)[0]
+                            for row in range(row_count)])
+        for method in ('linear', 'cubic', 'pchip'):
+            reference, alone_time = time_call(analyze_rows, signals, method, repeats = repeats)
+            stack_results, stack_time = time_call(p3b.analyze_signal_stack, signals, threshold, fs, dt, method,
+                                                  repeats = repeats)
+            assert np.array_equal(stack_results[0], reference[:, 0]) \
+                and np.allclose(np.column_stack(stack_results[1:]), reference[:, 1:3], rtol = 1e-9), \
+                f'the {method} batch results differ from project3_module'
+            # the batch FFT takes one call for each distinct IBI timecourse length
+            length_count = len(np.unique(reference[:, 3]))
+            rows.append((row_count, method, length_count, alone_time, stack_time))
+            print(f'{row_count:>6}{method:>8}{length_count:>9}{alone_time*1e3:>12.1f}{stack_time*1e3:>12.1f}'
+                  f'{alone_time / stack_time:>9.1f}')
+    return rows
+
+# Create function to benchmark every stage of the module on one recording
+def benchmark_recording(label, input_file, duration, fs = 500, threshold = 40, dt = 0.1, repeats = 3):
+    '''
+    A function to measure each stage of project3_module, and the full pipeline, on
+    one recording. Each stage is given the output of the stage before it.
+
+    Parameters
+    ----------
+    label : string
+        Name of the recording in the results
+    input_file : string
+        Name of the txt file to be analyzed
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer, optional
+        The sampling frequency in Hz or 1/s. The default is 500.
+    threshold : float, optional
+        Specified value to identify the QRS wave complex. The default is 40.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    repeats : integer, optional
+        Number of timed calls of each stage. The default is 3.
+
+    Returns
+    -------
+    results : dictionary
+        For each stage, a dictionary of seconds, peak_memory (bytes) and
+        samples_per_second. The pipeline entry also holds the hrv and ratio.
+
+    '''
+    results = {}
+    def record(stage, function, *args):
+        result, best_time, peak_memory = measure_call(function, *args, repeats = repeats)
+        results[stage] = {'seconds': best_time, 'peak_memory': peak_memory,
+                          'samples_per_second': sample_count / best_time if best_time > 0 else np.inf}
+        return result
+    sample_count = int(duration*fs)
+    data_file = record('load_data', p3m.load_data, input_file, duration, fs)
+    sample_count = len(data_file)
+    filtered_signal = record('filter_butter', p3m.filter_butter, data_file, fs)
+    beat_locations, beat_time = record('detect_beats', p3m.detect_beats, filtered_signal, threshold, fs)
+    interpolated_ibi, hrv = record('calculate_ibis', p3m.calculate_ibis, beat_locations, beat_time, dt)
+    frequency, power, low_freq, low_power, high_freq, high_power = record(
+        'frequency_filter', p3m.frequency_filter, interpolated_ibi, dt)
+    record('extract_mean_power', p3m.extract_mean_power, low_power, high_power)
+    hrv, ratio = record('pipeline', run_pipeline, input_file, duration, fs, threshold, dt)
+    results['pipeline'].update({'hrv': float(hrv), 'ratio': float(ratio)})
+    for index, (stage, entry) in enumerate(results.items()):
+        print(f"{label if index == 0 else '':<18}{stage:>20}{entry['seconds']*1e3:>10.1f}ms"
+              f"{entry['peak_memory']/2**20:>8.1f}MB{entry['samples_per_second']/1e6:>12.1f}")
+    return results
+
+# Create function to benchmark every stage on bundled and synthetic recordings
+def benchmark_stages(durations = (300, 3600, 24*3600), fs = 500, repeats = 3):
+    '''
+    A function to benchmark every stage of project3_module on the bundled recordings
+    and on synthetic recordings of each duration.
+
+    Parameters
+    ----------
+    durations : tuple of integers, optional
+        Durations in seconds of the synthetic recordings. The default is 5 minutes,
+        1 hour and 24 hours.
+    fs : integer, optional
+        The sampling frequency in Hz or 1/s. The default is 500.
+    repeats : integer, optional
+        Number of timed calls of each stage. The default is 3.
+
+    Returns
+    -------
+    results : dictionary
+        Results of benchmark_recording for each recording
+
+    '''
+    results = {}
+    print(f"{'recording':<18}{'stage':>20}{'time':>12}{'memory':>10}{'Msamples/s':>12}")
+    for label, input_file in bundled_recordings.items():
+        results[label] = benchmark_recording(label, input_file, 300, fs, repeats = repeats)
+    with tempfile.TemporaryDirectory() as directory:
+        for duration in durations:
+            input_file = os.path.join(directory, f'synthetic_{duration}s.txt')
+            signal, beat_time = generate_synthetic_ecg(duration, fs)
+            save_synthetic_recording(signal, input_file)
+            del signal
+            label = f'Synthetic {duration}s'
+            results[label] = benchmark_recording(label, input_file, duration, fs, repeats = repeats)
+    return results
+
+# Create function to compare benchmark results against the stored baseline
+def compare_to_baseline(results, baseline, tolerance = 1.5, result_tolerance = 1e-6):
+    '''
+    A function to compare stage benchmark results with a baseline, reporting stages
+    that got slower or used more memory by more than the tolerance factor, and
+    pipeline results that changed.
+
+    Parameters
+    ----------
+    results : dictionary
+        Results of benchmark_stages
+    baseline : dictionary
+        Earlier results of benchmark_stages
+    tolerance : float, optional
+        Allowed factor of slowdown or memory growth. The default is 1.5.
+    result_tolerance : float, optional
+        Allowed relative change of the HRV and LF/HF results. The default is 1e-6.
+
+    Returns
+    -------
+    regressions : list of strings
+        Description of every regression found
+
+    '''
+    regressions = []
+    for label, stages in results.items():
+        for stage, entry in stages.items():
+            if label not in baseline or stage not in baseline[label]:
+                continue
+            old_entry = baseline[label][stage]
+            for measure in ('seconds', 'peak_memory'):
+                # ignore tiny values, where timing noise is larger than the change
+                if old_entry[measure] > 0 and entry[measure] > tolerance*old_entry[measure] \
+                        and entry[measure] - old_entry[measure] > (1e-3 if measure == 'seconds' else 2**20):
+                    regressions.append(f'{label} {stage}: {measure} {old_entry[measure]:.4g} -> {entry[measure]:.4g}')
+            for measure in ('hrv', 'ratio'):
+                if measure in old_entry and not np.isclose(entry[measure], old_entry[measure], rtol = result_tolerance):
+                    regressions.append(f'{label} {stage}: {measure} {old_entry[measure]:.6g} -> {entry[measure]:.6g}')
+    return regressions
+
+# Create function to run the benchmark script
+def main(argv = None):
+    '''
+    A function to parse the command line arguments and run the chosen benchmarks.
+
+    Parameters
+    ----------
+    argv : list of strings, optional
+        Command line arguments. The default is None, which uses sys.argv.
+
+    Returns
+    -------
+    regression_count : integer
+        Number of regressions found against the baseline
+
+    '''
+    parser = argparse.ArgumentParser(description = 'Benchmark the project 3 analysis.')
+    parser.add_argument('--suites', nargs = '+', default = ['stages'],
+                        choices = ['stages', 'detectors', 'spectral', 'ibi', 'dtype', 'startup', 'store', 'channels', 'bands', 'batch'], help = 'benchmarks to run')
+    parser.add_argument('--durations', nargs = '+', type = int, default = [300, 3600, 24*3600],
+                        help = 'durations in seconds of the synthetic recordings')
+    parser.add_argument('--repeats', type = int, default = 3, help = 'timed calls of each stage')
+    parser.add_argument('--baseline', default = baseline_file, help = 'baseline json file')
+    parser.add_argument('--save-baseline', action = 'store_true', help = 'store the results as the new baseline')
+    parser.add_argument('--tolerance', type = float, default = 1.5, help = 'allowed slowdown factor')
+    args = parser.parse_args(argv)
+
+    if 'detectors' in args.suites:
+        benchmark_detectors()
+    if 'spectral' in args.suites:
+        benchmark_spectral_methods()
+    if 'ibi' in args.suites:
+        benchmark_ibi_resampling(tuple(args.durations))
+    if 'dtype' in args.suites:
+        benchmark_dtypes(tuple(args.durations), repeats = args.repeats)
+    if 'startup' in args.suites:
+        benchmark_startup(repeats = args.repeats)
+    if 'store' in args.suites:
+        benchmark_store()
+    if 'channels' in args.suites:
+        benchmark_channels(repeats = args.repeats)
+    if 'bands' in args.suites:
+        benchmark_band_sweep(tuple(args.durations), repeats = args.repeats)
+    if 'batch' in args.suites:
+        benchmark_batch(repeats = args.repeats)
+    if 'stages' not in args.suites:
+        return 0
+
+    results = benchmark_stages(tuple(args.durations), repeats = args.repeats)
+    if args.save_baseline:
+        with open(args.baseline, 'w') as json_file:
+            json.dump(results, json_file, indent = 2)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}, run with --save-baseline to store one')
+        return 0
+    with open(args.baseline) as json_file:
+        baseline = json.load(json_file)
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    print(f'{len(regressions)} regressions against {args.baseline}')
+    return len(regressions)
+
+if __name__ == '__main__':
+    raise SystemExit(1 if main() > 0 else 0)
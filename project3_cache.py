@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Cache
+This module keeps the results of each stage of the analysis on disk so that running
+the analysis again with the same recording and settings does not repeat the work.
+Every stage result is stored as a .npz file named by a hash of the recording's contents
+and the settings of that stage and all the stages before it, so changing a setting
+only invalidates the stages it affects, and editing or replacing a recording
+invalidates all of them. When the cache grows past its size limit, the least recently
+used results are deleted.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import hashlib
+import json
+import os
+import numpy as np
+import project3_module as p3m
+
+# folder the cached results are kept in
+cache_dir = '.hrv_cache'
+# largest total size in bytes of the cached results, 1 GB
+max_cache_bytes = 2**30
+
+# stages of the analysis in order, with the names of the results each one stores
+stage_outputs = {
+    'load': ('data_file',),
+    'filter': ('filtered_signal',),
+    'beats': ('beat_locations', 'beat_time'),
+    'ibis': ('interpolated_ibi', 'hrv'),
+    'spectrum': ('frequency', 'power', 'low_freq', 'low_power', 'high_freq', 'high_power', 'ratio'),
+}
+
+#%% Keys
+# Create function to hash the contents of a file
+def hash_file(input_file):
+    '''
+    A function to calculate the SHA-256 hash of a file's contents, reading it in blocks.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the file to hash
+
+    Returns
+    -------
+    file_hash : string
+        Hexadecimal SHA-256 hash of the file
+
+    '''
+    file_hash = hashlib.sha256()
+    with open(input_file, 'rb') as binary_file:
+        for block in iter(lambda: binary_file.read(2**20), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+# Create function to get the cache key of every stage
+def get_stage_keys(file_hash, duration, fs, threshold, dt, lowcut = 0.5, highcut = 2.5, order = 2, dtype = None):
+    '''
+    A function to get the cache key of each stage. Each key is a hash of the key of
+    the stage before it and the settings of the stage itself.
+
+    Parameters
+    ----------
+    file_hash : string
+        Hash of the recording's contents
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float
+        Spacing in seconds of the interpolated IBIs
+    lowcut, highcut : float, optional
+        Cutoff frequencies of the bandpass filter in Hz. The defaults are 0.5 and 2.5.
+    order : integer, optional
+        Order of the bandpass filter. The default is 2.
+    dtype : data type, optional
+        np.float32 or np.float64 to load and filter the signal in. The default is
+        None, which uses project3_module.signal_dtype.
+
+    Returns
+    -------
+    stage_keys : dictionary
+        Cache key of each stage in stage_outputs
+
+    '''
+    # results computed in float32 and float64 differ, so are cached apart
+    dtype_name = p3m.get_signal_dtype(dtype).name
+    stage_settings = {
+        'load': {'duration': duration, 'fs': fs, 'dtype': dtype_name},
+        'filter': {'lowcut': lowcut, 'highcut': highcut, 'order': order, 'dtype': dtype_name},
+        'beats': {'threshold': threshold},
+        'ibis': {'dt': dt},
+        'spectrum': {},
+    }
+    stage_keys = {}
+    previous_key = file_hash
+    for stage, settings in stage_settings.items():
+        description = json.dumps({'stage': stage, 'previous': previous_key, 'settings': settings}, sort_keys = True)
+        previous_key = hashlib.sha256(description.encode()).hexdigest()
+        stage_keys[stage] = previous_key
+    return stage_keys
+
+#%% Reading and writing
+# Create function to get the file a stage result is stored in
+def get_cache_file(stage, key, directory = None):
+    '''
+    A function to get the name of the .npz file holding a stage result.
+
+    Parameters
+    ----------
+    stage : string
+        Name of the stage
+    key : string
+        Cache key of the stage
+    directory : string, optional
+        Cache folder. The default is None, which uses cache_dir.
+
+    Returns
+    -------
+    cache_file : string
+        Name of the .npz file
+
+    '''
+    if directory is None:
+        directory = cache_dir
+    cache_file = os.path.join(directory, f'{stage}_{key[:32]}.npz')
+    return cache_file
+
+# Create function to read a stage result from the cache
+def read_stage(stage, key, directory = None):
+    '''
+    A function to read a stage result from the cache and mark it as recently used.
+
+    Parameters
+    ----------
+    stage : string
+        Name of the stage
+    key : string
+        Cache key of the stage
+    directory : string, optional
+        Cache folder. The default is None, which uses cache_dir.
+
+    Returns
+    -------
+    outputs : dictionary or None
+        The stored results of the stage, or None if they are not cached
+
+    '''
+    cache_file = get_cache_file(stage, key, directory)
+    if not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as stored:
+            outputs = {name: stored[name] for name in stage_outputs[stage]}
+    except (OSError, ValueError, KeyError):
+        # a damaged file counts as missing and is replaced when the stage is rerun
+        return None
+    # update the modification time, which the eviction uses as the last use time
+    os.utime(cache_file)
+    return outputs
+
+# Create function to write a stage result to the cache
+def write_stage(stage, key, outputs, directory = None, max_bytes = None):
+    '''
+    A function to write a stage result to the cache and then evict old results if
+    the cache is too large. The file is written under a temporary name and renamed
+    into place, so a half-written file is never read.
+
+    Parameters
+    ----------
+    stage : string
+        Name of the stage
+    key : string
+        Cache key of the stage
+    outputs : dictionary
+        Results of the stage, by name
+    directory : string, optional
+        Cache folder. The default is None, which uses cache_dir.
+    max_bytes : integer, optional
+        Size limit of the cache. The default is None, which uses max_cache_bytes.
+
+    Returns
+    -------
+    None.
+
+    '''
+    cache_file = get_cache_file(stage, key, directory)
+    os.makedirs(os.path.dirname(cache_file) or '.', exist_ok = True)
+    temporary_file = cache_file + f'.{os.getpid()}.tmp'
+    with open(temporary_file, 'wb') as binary_file:
+        np.savez(binary_file, **outputs)
+    os.replace(temporary_file, cache_file)
+    evict(directory, max_bytes)
+
+# Create function to delete the least recently used results
+def evict(directory = None, max_bytes = None):
+    '''
+    A function to delete the least recently used cache files until the total size
+    of the cache is within the limit.
+
+    Parameters
+    ----------
+    directory : string, optional
+        Cache folder. The default is None, which uses cache_dir.
+    max_bytes : integer, optional
+        Size limit of the cache. The default is None, which uses max_cache_bytes.
+
+    Returns
+    -------
+    evicted_count : integer
+        Number of files deleted
+
+    '''
+    if directory is None:
+        directory = cache_dir
+    if max_bytes is None:
+        max_bytes = max_cache_bytes
+    entries = []
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith('.npz'):
+            file_stats = entry.stat()
+            entries.append((file_stats.st_mtime, file_stats.st_size, entry.path))
+    total_bytes = sum(size for _, size, _ in entries)
+    evicted_count = 0
+    # delete the oldest files first
+    for _, size, path in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_bytes -= size
+        evicted_count += 1
+    return evicted_count
+
+#%% Cached analysis
+# Create function to run the analysis, reusing cached stage results
+def run_cached_pipeline(input_file, duration, fs, threshold, dt = 0.1, lowcut = 0.5,
+                        highcut = 2.5, order = 2, dtype = None, directory = None, max_bytes = None,
+                        use_cache = True):
+    '''
+    A function to run every stage of project3_module on a recording, resuming from
+    the deepest stage whose result is already cached. Stages before it are read from
+    the cache when they are there, so all results are returned; stages after it are
+    computed and cached.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt file to be analyzed
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    lowcut, highcut : float, optional
+        Cutoff frequencies of the bandpass filter in Hz. The defaults are 0.5 and 2.5.
+    order : integer, optional
+        Order of the bandpass filter. The default is 2.
+    dtype : data type, optional
+        np.float32 or np.float64 to load and filter the signal in. The default is
+        None, which uses project3_module.signal_dtype.
+    directory : string, optional
+        Cache folder. The default is None, which uses cache_dir.
+    max_bytes : integer, optional
+        Size limit of the cache. The default is None, which uses max_cache_bytes.
+    use_cache : bool, optional
+        Whether to read and store cached stage results. False computes every stage
+        and leaves the cache alone, so that a profile measures the stages themselves
+        rather than reads from the cache. The default is True.
+
+    Returns
+    -------
+    results : dictionary
+        Every result named in stage_outputs, such as data_file, filtered_signal,
+        beat_locations, beat_time, interpolated_ibi, hrv and ratio.
+
+    '''
+    if use_cache:
+        stage_keys = get_stage_keys(hash_file(input_file), duration, fs, threshold, dt, lowcut, highcut, order, dtype)
+    results = {}
+    computed = not use_cache
+    for stage in stage_outputs:
+        # once a stage has been computed, every later stage must be computed too
+        outputs = None if computed else read_stage(stage, stage_keys[stage], directory)
+        if outputs is None:
+            outputs = compute_stage(stage, results, input_file, duration, fs, threshold, dt,
+                                    lowcut, highcut, order, dtype)
+            if use_cache:
+                write_stage(stage, stage_keys[stage], outputs, directory, max_bytes)
+            computed = True
+        results.update(outputs)
+    # return single values as floats rather than 0-d arrays
+    for name in ('hrv', 'ratio'):
+        results[name] = float(results[name])
+    return results
+
+# Create function to compute one stage from the results of the stages before it
+def compute_stage(stage, results, input_file, duration, fs, threshold, dt, lowcut, highcut, order, dtype = None):
+    '''
+    A function to compute the results of one stage of the analysis.
+
+    Parameters
+    ----------
+    stage : string
+        Name of the stage, a key of stage_outputs
+    results : dictionary
+        Results of the earlier stages
+    input_file, duration, fs, threshold, dt, lowcut, highcut, order, dtype
+        Settings of the analysis, see run_cached_pipeline
+
+    Returns
+    -------
+    outputs : dictionary
+        Results of the stage, by name
+
+    '''
+    if stage == 'load':
+        return {'data_file': p3m.load_data(input_file, duration, fs, dtype = dtype)}
+    if stage == 'filter':
+        return {'filtered_signal': p3m.filter_butter(results['data_file'], fs, lowcut, highcut, order, dtype = dtype)}
+    if stage == 'beats':
+        beat_locations, beat_time = p3m.detect_beats(results['filtered_signal'], threshold, fs)
+        return {'beat_locations': beat_locations, 'beat_time': beat_time}
+    if stage == 'ibis':
+        interpolated_ibi, hrv = p3m.calculate_ibis(results['beat_locations'], results['beat_time'], dt)
+        return {'interpolated_ibi': interpolated_ibi, 'hrv': hrv}
+    frequency, power, low_freq, low_power, high_freq, high_power = p3m.frequency_filter(results['interpolated_ibi'], dt)
+    return {'frequency': frequency, 'power': power, 'low_freq': low_freq, 'low_power': low_power,
+            'high_freq': high_freq, 'high_power': high_power,
+            'ratio': p3m.extract_mean_power(low_power, high_power)}
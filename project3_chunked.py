@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Chunked
+This module analyzes recordings too long to hold in memory, such as a 24 hour Holter
+recording of 43 million samples, in fixed-size chunks. Each chunk is filtered with
+filter_butter together with some padding from its neighbours; the zero-phase filter's
+response to the chunk edges dies out inside the padding, so the part of each chunk
+that is kept matches filtering the whole recording at once. Beats crossing the
+threshold at a chunk edge are found by carrying over the last filtered sample, and the
+IBIs and interpolated IBIs are continued from the last beat and IBI of the previous chunk.
+
+The filtered signal, beat locations, beat times, IBIs and interpolated IBIs are written
+to .npy files in an output folder as they are made, and the HRV is kept as running
+sums, so memory use stays the same however long the recording is. Any format load_data
+reads can be processed: a text recording, a .ecg recording or a .npy sidecar.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import os
+import numpy as np
+import project3_module as p3m
+import project3_recording as p3r
+
+#%% Reading in chunks
+# Create function to find the file a recording is read from, as load_data would
+def get_recording_source(input_file, use_sidecar = True):
+    '''
+    A function to choose which copy of a recording to read, in the same order as
+    load_data: a .ecg recording, then a .npy sidecar, then the text file. Binary copies
+    are only used if they are newer than the text file.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt, .ecg or .npy file
+    use_sidecar : bool, optional
+        Whether to read a binary copy of a txt file when one is available.
+        The default is True.
+
+    Returns
+    -------
+    source_type : string
+        'ecg', 'npy' or 'txt'
+    source_file : string
+        Name of the file to read
+
+    '''
+    extension = os.path.splitext(input_file)[1]
+    if extension == p3r.recording_extension:
+        return 'ecg', input_file
+    if extension == '.npy':
+        return 'npy', input_file
+    if use_sidecar:
+        for source_type, source_file in (('ecg', p3r.get_recording_file(input_file)),
+                                         ('npy', p3m.get_sidecar_file(input_file))):
+            if os.path.exists(source_file) and os.path.getmtime(source_file) >= os.path.getmtime(input_file):
+                return source_type, source_file
+    return 'txt', input_file
+
+# Create function to count the samples of a recording
+def get_sample_count(source_type, source_file):
+    '''
+    A function to count the samples of a recording without loading it.
+
+    Parameters
+    ----------
+    source_type, source_file : string
+        Returned by get_recording_source
+
+    Returns
+    -------
+    sample_count : integer
+        Number of samples in the recording
+
+    '''
+    if source_type == 'ecg':
+        return p3r.read_header(source_file)['sample_count']
+    if source_type == 'npy':
+        return len(np.load(source_file, mmap_mode = 'r'))
+    with open(source_file, 'rb') as text_file:
+        return sum(1 for line in text_file if line.strip())
+
+# Create function to check that a recording has a single lead
+def check_single_lead(samples, source_file):
+    '''
+    A function to raise a clear error for a multi-lead recording, which chunked
+    analysis and .ecg recordings cannot hold.
+
+    Parameters
+    ----------
+    samples : array of floats size (x,) or (x, c) where c is the # of leads
+        Samples of the recording
+    source_file : string
+        Name of the file the samples were read from
+
+    Raises
+    ------
+    ValueError
+        If samples has more than one lead.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if np.ndim(samples) > 1:
+        raise ValueError(f'{source_file} has {np.shape(samples)[1]} leads, but chunked analysis and .ecg '
+                         'recordings read a single lead; analyze it with project3_module.load_data instead')
+
+# Create function to read a recording one piece at a time
+def iterate_recording(source_type, source_file, read_size = p3m.chunk_size):
+    '''
+    A generator which reads the samples of a recording in order, at most read_size
+    samples at a time.
+
+    Parameters
+    ----------
+    source_type, source_file : string
+        Returned by get_recording_source
+    read_size : integer, optional
+        Largest number of samples read at once. The default is chunk_size.
+
+    Yields
+    ------
+    samples : array of floats size (x,) where x is at most read_size
+        The next samples of the recording
+
+    Raises
+    ------
+    ValueError
+        If the recording has more than one lead. Chunked analysis, like .ecg
+        recordings, reads a single lead.
+
+    '''
+    if source_type == 'txt':
+        with open(source_file, 'r') as text_file:
+            for samples in p3m.iterate_text_chunks(text_file, dtype = float):
+                check_single_lead(samples, source_file)
+                yield samples
+        return
+    sample_count = get_sample_count(source_type, source_file)
+    samples = np.load(source_file, mmap_mode = 'r') if source_type == 'npy' else None
+    if samples is not None:
+        check_single_lead(samples, source_file)
+    for read_start in range(0, sample_count, read_size):
+        if source_type == 'npy':
+            yield np.array(samples[read_start:read_start + read_size], dtype = float)
+        else:
+            yield p3r.read_window(source_file, read_start, read_size)
+
+#%% Writing results
+# Create function to copy a raw binary file of values into a .npy file
+def copy_raw_to_npy(raw_file, npy_file, dtype):
+    '''
+    A function to turn a file of values written one after another with tofile into a
+    .npy file, copying it a chunk at a time, and delete the raw file.
+
+    Parameters
+    ----------
+    raw_file : string
+        Name of the raw binary file
+    npy_file : string
+        Name of the .npy file to write
+    dtype : data type
+        Data type of the values
+
+    Returns
+    -------
+    None.
+
+    '''
+    value_count = os.path.getsize(raw_file) // np.dtype(dtype).itemsize
+    output = np.lib.format.open_memmap(npy_file, mode = 'w+', dtype = dtype, shape = (value_count,))
+    if value_count > 0:
+        values = np.memmap(raw_file, dtype = dtype, mode = 'r')
+        for copy_start in range(0, value_count, p3m.chunk_size):
+            output[copy_start:copy_start + p3m.chunk_size] = values[copy_start:copy_start + p3m.chunk_size]
+        del values
+    output.flush()
+    del output
+    os.remove(raw_file)
+
+#%% Chunked analysis
+# Create function to analyze a recording of any length in chunks
+def process_recording_chunked(input_file, output_dir, fs, threshold, dt = 0.1, chunk_duration = 300,
+                              pad_duration = 20, lowcut = 0.5, highcut = 2.5, order = 2, use_sidecar = True):
+    '''
+    A function to filter a recording, detect its beats, and calculate its IBIs,
+    interpolated IBIs and HRV a chunk at a time, writing the results to disk. The
+    results match running load_data, filter_butter, detect_beats and calculate_ibis
+    on the whole recording, to within the filter's edge effects left after pad_duration.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt, .ecg or .npy file to analyze
+    output_dir : string
+        Folder the results are written to, created if needed
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    chunk_duration : float, optional
+        Length in seconds of the part of each chunk that is kept. The default is 300.
+    pad_duration : float, optional
+        Length in seconds of the padding on each side of a chunk. The filter's
+        response to an edge must die out within it; for the default 0.5 Hz cutoff it
+        falls by about e^-40 over 20 s. The default is 20.
+    lowcut, highcut : float, optional
+        Cutoff frequencies of the bandpass filter in Hz. The defaults are 0.5 and 2.5.
+    order : integer, optional
+        Order of the bandpass filter. The default is 2.
+    use_sidecar : bool, optional
+        Whether to read a binary copy of a txt file when one is available.
+        The default is True.
+
+    Returns
+    -------
+    results : dictionary
+        sample_count, beat_count and hrv of the recording, and the names of the .npy
+        files written: filtered_signal, beat_locations, beat_time, ibi_values and
+        interpolated_ibi
+
+    '''
+    os.makedirs(output_dir, exist_ok = True)
+    output_files = {name: os.path.join(output_dir, f'{name}.npy') for name in
+                    ('filtered_signal', 'beat_locations', 'beat_time', 'ibi_values', 'interpolated_ibi')}
+    source_type, source_file = get_recording_source(input_file, use_sidecar)
+    sample_count = get_sample_count(source_type, source_file)
+    chunk_length = max(int(chunk_duration*fs), 1)
+    pad_length = int(pad_duration*fs)
+
+    # the filtered signal has a known length, so it is written into a memory-mapped file;
+    # the other results are appended to raw files and turned into .npy files at the end
+    filtered_output = np.lib.format.open_memmap(output_files['filtered_signal'], mode = 'w+',
+                                                dtype = float, shape = (sample_count,))
+    raw_files = {name: output_files[name] + '.raw' for name in output_files if name != 'filtered_signal'}
+    raw_outputs = {name: open(raw_file, 'wb') for name, raw_file in raw_files.items()}
+
+    # samples read but not yet dropped, starting at sample buffer_start
+    buffer = np.empty(0)
+    buffer_start = 0
+    # first sample not yet filtered and kept
+    next_output = 0
+    # state carried from one chunk to the next
+    last_filtered = None
+    last_beat_time = None
+    last_ibi = None
+    # the interpolated IBIs are every dt seconds from the second beat
+    first_ibi_time = None
+    interpolated_count = 0
+    # running sums of the interpolated IBIs, about the first one, for the HRV
+    ibi_shift = None
+    ibi_sum = 0
+    ibi_square_sum = 0
+    beat_count = 0
+
+    try:
+        samples = iterate_recording(source_type, source_file)
+        exhausted = False
+        while next_output < sample_count:
+            # read until the buffer holds this chunk and its padding on the right
+            chunk_end = min(next_output + chunk_length, sample_count)
+            needed_end = min(chunk_end + pad_length, sample_count)
+            while buffer_start + len(buffer) < needed_end and not exhausted:
+                try:
+                    buffer = np.concatenate((buffer, next(samples)))
+                except StopIteration:
+                    exhausted = True
+            # filter the chunk with padding on both sides and keep the middle
+            segment_start = max(next_output - pad_length, buffer_start)
+            segment = buffer[segment_start - buffer_start:needed_end - buffer_start]
+            filtered_segment = p3m.filter_butter(segment, fs, lowcut, highcut, order)
+            filtered_chunk = filtered_segment[next_output - segment_start:chunk_end - segment_start]
+            filtered_output[next_output:chunk_end] = filtered_chunk
+
+            # detect beats, putting the last sample of the previous chunk in front so
+            # a crossing at the edge is found and a run continuing over it is not
+            if last_filtered is None:
+                chunk_beats, _ = p3m.detect_beats(filtered_chunk, threshold, fs)
+            else:
+                chunk_beats, _ = p3m.detect_beats(np.insert(filtered_chunk, 0, last_filtered), threshold, fs)
+                chunk_beats = chunk_beats[chunk_beats > 0] - 1
+            last_filtered = filtered_chunk[-1]
+            beat_locations = chunk_beats + next_output
+            beat_time = beat_locations / fs
+            beat_locations.astype(np.int64).tofile(raw_outputs['beat_locations'])
+            beat_time.tofile(raw_outputs['beat_time'])
+            beat_count += len(beat_locations)
+
+            # IBIs, continuing from the last beat of the previous chunk
+            if last_beat_time is not None:
+                beat_time = np.insert(beat_time, 0, last_beat_time)
+            if len(beat_time) > 0:
+                last_beat_time = beat_time[-1]
+            ibi_values = np.diff(beat_time)
+            ibi_time = beat_time[1:]
+            ibi_values.tofile(raw_outputs['ibi_values'])
+
+            # interpolate the IBIs every dt seconds up to the last beat so far, as
+            # resample_ibis does for the whole recording
+            if len(ibi_values) > 0:
+                if first_ibi_time is None:
+                    first_ibi_time = ibi_time[0]
+                    ibi_shift = ibi_values[0]
+                # the previous chunk's last IBI is the left end of this chunk's interpolation
+                if last_ibi is not None:
+                    ibi_time = np.insert(ibi_time, 0, last_ibi[0])
+                    ibi_values = np.insert(ibi_values, 0, last_ibi[1])
+                last_ibi = (ibi_time[-1], ibi_values[-1])
+                interpolated_end = int(np.ceil((ibi_time[-1] - first_ibi_time) / dt))
+                interpolated_time = first_ibi_time + np.arange(interpolated_count, interpolated_end)*dt
+                interpolated_ibi = np.interp(interpolated_time, ibi_time, ibi_values)
+                interpolated_ibi.tofile(raw_outputs['interpolated_ibi'])
+                interpolated_count = max(interpolated_end, interpolated_count)
+                ibi_sum += np.sum(interpolated_ibi - ibi_shift)
+                ibi_square_sum += np.sum(np.square(interpolated_ibi - ibi_shift))
+
+            # drop the samples no later chunk needs
+            next_output = chunk_end
+            keep_start = max(next_output - pad_length, buffer_start)
+            buffer = buffer[keep_start - buffer_start:]
+            buffer_start = keep_start
+    finally:
+        for raw_output in raw_outputs.values():
+            raw_output.close()
+        filtered_output.flush()
+        del filtered_output
+
+    for name, raw_file in raw_files.items():
+        copy_raw_to_npy(raw_file, output_files[name], np.int64 if name == 'beat_locations' else float)
+
+    # standard deviation of the interpolated IBIs from their running sums
+    if interpolated_count > 0:
+        mean_shifted = ibi_sum / interpolated_count
+        hrv = np.sqrt(max(ibi_square_sum/interpolated_count - mean_shifted**2, 0))
+    else:
+        hrv = np.nan
+    results = dict(output_files, sample_count = sample_count, beat_count = beat_count, hrv = hrv)
+    return results
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Detectors
+This module contains several heartbeat (R-peak) detectors which can be used in place
+of detect_beats from project3_module. Every detector takes a filtered ECG signal and
+its sampling frequency and returns the beat locations and beat times in the same form
+as detect_beats, so they can be swapped with the detect function below. All of them
+make a single pass over the signal, with any loop running over candidate beats rather
+than samples, and all except the plain threshold detector enforce a refractory period
+so that noise around a peak is not counted as extra beats.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import numpy as np
+from scipy import signal as sps
+import project3_module as p3m
+
+#%% Detectors
+# Create function which wraps the original threshold detector
+def detect_beats_threshold(signal, fs, threshold = 40):
+    '''
+    A function to detect beats with the fixed threshold rule of detect_beats: the
+    first sample of every run of samples at or above the threshold is a beat.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) where x is the number of samples
+        1D array containing the filtered ecg voltage data
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float, optional
+        Specified value to identify the QRS wave complex. The default is 40.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (x,) where x is the # of beats detected
+        Samples where a beat was detected
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which a beat was detected
+
+    '''
+    return p3m.detect_beats(signal, threshold, fs)
+
+# Create function to drop beats which come too soon after the previous beat
+def apply_refractory_period(beat_locations, fs, refractory = 0.25, strength = None):
+    '''
+    A function to remove beats that fall within the refractory period of an earlier
+    accepted beat. When strength is given, the stronger beat of a close pair is kept
+    instead of the earlier one.
+
+    Parameters
+    ----------
+    beat_locations : Array of integers size (x,) where x is the # of candidate beats
+        Samples of the candidate beats, in increasing order
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    refractory : float, optional
+        Shortest allowed time in seconds between beats. The default is 0.25 (240 bpm).
+    strength : Array of floats size (x,), optional
+        Size of each candidate beat, such as its peak voltage. The default is None.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (y,) where y is the # of beats kept
+        Samples of the beats that were kept
+
+    '''
+    refractory_samples = refractory*fs
+    # quick exit when no two candidates are too close together
+    if len(beat_locations) < 2 or np.min(np.diff(beat_locations)) >= refractory_samples:
+        return beat_locations
+    kept = [0]
+    for index in range(1, len(beat_locations)):
+        if beat_locations[index] - beat_locations[kept[-1]] >= refractory_samples:
+            kept.append(index)
+        elif strength is not None and strength[index] > strength[kept[-1]]:
+            # the new candidate is the stronger beat of the pair, replace the last one
+            kept[-1] = index
+    return beat_locations[np.array(kept)]
+
+# Create function to detect beats with a threshold and a refractory period
+def detect_beats_refractory(signal, fs, threshold = 40, refractory = 0.25):
+    '''
+    A function to detect beats with the fixed threshold rule of detect_beats, but
+    ignoring threshold crossings that fall within the refractory period of the last beat.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) where x is the number of samples
+        1D array containing the filtered ecg voltage data
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float, optional
+        Specified value to identify the QRS wave complex. The default is 40.
+    refractory : float, optional
+        Shortest allowed time in seconds between beats. The default is 0.25.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (x,) where x is the # of beats detected
+        Samples where a beat was detected
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which a beat was detected
+
+    '''
+    beat_locations, beat_time = p3m.detect_beats(signal, threshold, fs)
+    beat_locations = apply_refractory_period(beat_locations, fs, refractory)
+    beat_time = beat_locations / fs
+    return beat_locations, beat_time
+
+# Create function to detect beats as prominent local peaks
+def detect_beats_find_peaks(signal, fs, refractory = 0.25, prominence = None):
+    '''
+    A function to detect beats as the local maxima of the signal that are at least
+    the refractory period apart and stand out from their surroundings by at least
+    the given prominence. Since prominence is measured from the neighbouring minima,
+    a slow baseline drift does not move the detected beats in or out of range.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) where x is the number of samples
+        1D array containing the filtered ecg voltage data
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    refractory : float, optional
+        Shortest allowed time in seconds between beats. The default is 0.25.
+    prominence : float, optional
+        Smallest prominence of a beat. The default is None, which uses 1.5 times the
+        standard deviation of the signal.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (x,) where x is the # of beats detected
+        Samples where a beat was detected
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which a beat was detected
+
+    '''
+    if prominence is None:
+        prominence = 1.5*np.std(signal)
+    beat_locations, _ = sps.find_peaks(signal, distance = max(int(refractory*fs), 1),
+                                       prominence = prominence)
+    beat_time = beat_locations / fs
+    return beat_locations, beat_time
+
+# Create function to detect beats with a Pan-Tompkins style adaptive threshold
+def detect_beats_pan_tompkins(signal, fs, refractory = 0.25, integration_window = 0.15):
+    '''
+    A function to detect beats with the adaptive threshold of the Pan-Tompkins
+    algorithm. The signal is differentiated, squared and integrated over a moving
+    window, then each peak of the result is classed as a beat or noise. Running
+    estimates of the beat and noise peak sizes set the threshold, so it follows
+    changes in signal amplitude. If no beat is found for 1.66 times the average
+    beat interval, the largest skipped peak above half the threshold is added back.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) where x is the number of samples
+        1D array containing the filtered ecg voltage data
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    refractory : float, optional
+        Shortest allowed time in seconds between beats. The default is 0.25.
+    integration_window : float, optional
+        Length in seconds of the moving integration window. The default is 0.15.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (x,) where x is the # of beats detected
+        Samples where a beat was detected
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which a beat was detected
+
+    '''
+    # get the energy of the signal slope, smoothed over the integration window
+    window = max(int(integration_window*fs), 1)
+    squared = np.square(np.gradient(signal))
+    integrated = np.convolve(squared, np.ones(window)/window, mode = 'same')
+    refractory_samples = max(int(refractory*fs), 1)
+    peaks, _ = sps.find_peaks(integrated, distance = refractory_samples)
+    if len(peaks) == 0:
+        return np.empty(0, dtype = int), np.empty(0)
+
+    # initialize the beat and noise peak estimates from the first 2 seconds
+    learning = integrated[:int(2*fs)]
+    signal_peak = 0.25*np.max(learning)
+    noise_peak = 0.5*np.mean(learning)
+    threshold = noise_peak + 0.25*(signal_peak - noise_peak)
+    rr_average = None
+    beats = []
+    skipped = []
+    for peak in peaks:
+        value = integrated[peak]
+        # search back for a missed beat if it has been too long since the last one
+        if rr_average is not None and len(skipped) > 0 and peak - beats[-1] > 1.66*rr_average:
+            best = max(skipped, key = lambda candidate: integrated[candidate])
+            if integrated[best] > 0.5*threshold and best - beats[-1] >= refractory_samples:
+                beats.append(best)
+                signal_peak = 0.25*integrated[best] + 0.75*signal_peak
+            skipped = []
+        if value > threshold and (len(beats) == 0 or peak - beats[-1] >= refractory_samples):
+            # update the average of the last 8 beat intervals
+            if len(beats) > 0:
+                rr_average = np.mean(np.diff(beats[-8:] + [peak]))
+            beats.append(peak)
+            signal_peak = 0.125*value + 0.875*signal_peak
+            skipped = []
+        else:
+            noise_peak = 0.125*value + 0.875*noise_peak
+            skipped.append(peak)
+        threshold = noise_peak + 0.25*(signal_peak - noise_peak)
+
+    # move each beat to the largest sample of the signal near the energy peak
+    beats = np.array(beats)
+    offsets = np.arange(-window, window + 1)
+    search = np.clip(beats[:, np.newaxis] + offsets, 0, len(signal) - 1)
+    beat_locations = np.unique(search[np.arange(len(beats)), np.argmax(signal[search], axis = 1)])
+    beat_locations = apply_refractory_period(beat_locations, fs, refractory, signal[beat_locations])
+    beat_time = beat_locations / fs
+    return beat_locations, beat_time
+
+#%% Choosing a detector
+# detectors which can be selected by name in detect
+detectors = {
+    'threshold': detect_beats_threshold,
+    'refractory': detect_beats_refractory,
+    'find_peaks': detect_beats_find_peaks,
+    'pan_tompkins': detect_beats_pan_tompkins,
+}
+
+# Create function to run a detector chosen by name
+def detect(signal, fs, method = 'threshold', **kwargs):
+    '''
+    A function to detect beats with one of the detectors in the detectors dictionary.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) where x is the number of samples
+        1D array containing the filtered ecg voltage data
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    method : string, optional
+        Name of the detector to use, a key of detectors. The default is 'threshold'.
+    **kwargs
+        Settings passed on to the detector, such as threshold or refractory.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (x,) where x is the # of beats detected
+        Samples where a beat was detected
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which a beat was detected
+
+    '''
+    if method not in detectors:
+        raise ValueError(f"Unknown detector '{method}', choose from {sorted(detectors)}")
+    return detectors[method](signal, fs, **kwargs)
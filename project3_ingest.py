@@ -0,0 +1,476 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Ingest
+This module records several subjects at once by reading many live ECG streams
+concurrently with asyncio. Each stream sends one sample per line, as the Arduino
+prints them, over a TCP socket or a serial port. The samples of each stream are
+collected in a NumPy ring buffer and handed in blocks to a StreamingProcessor from
+project3_streaming, which filters them and detects beats. The filtering runs in an
+executor so the event loop keeps reading the other streams in the meantime. When a
+stream's ring buffer is full its reader stops reading until there is space, which
+pushes back on the sender, and the time spent waiting is reported as backpressure
+alongside each stream's throughput.
+
+For testing without hardware, replay_recordings serves the bundled .txt files over
+local TCP sockets at the sampling frequency, or faster with speed > 1.
+
+Example:
+    python project3_ingest.py --replay *.txt --speed 10
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import argparse
+import asyncio
+import os
+import time
+import numpy as np
+import project3_streaming as p3st
+
+#%% Ring buffer
+class RingBuffer:
+    '''
+    A class which holds samples in a fixed-size NumPy array, first in first out.
+    Writing to a full buffer writes only as many samples as fit, so nothing already
+    in the buffer is overwritten.
+
+    Parameters
+    ----------
+    capacity : integer
+        Largest number of samples the buffer holds
+
+    '''
+    def __init__(self, capacity):
+        self.buffer = np.empty(capacity)
+        self.capacity = capacity
+        # position of the oldest sample and number of samples held
+        self.start = 0
+        self.count = 0
+
+    def get_space(self):
+        '''
+        A function to get the number of samples that can still be written.
+
+        Returns
+        -------
+        space : integer
+            Free space in samples
+
+        '''
+        return self.capacity - self.count
+
+    def write(self, samples):
+        '''
+        A function to add samples to the end of the buffer, as many as fit.
+
+        Parameters
+        ----------
+        samples : array of floats size (x,)
+            Samples to add
+
+        Returns
+        -------
+        written_count : integer
+            Number of samples written, the first written_count of samples
+
+        '''
+        written_count = min(len(samples), self.get_space())
+        end = (self.start + self.count) % self.capacity
+        # write up to the end of the array, then wrap around to the beginning
+        first_count = min(written_count, self.capacity - end)
+        self.buffer[end:end + first_count] = samples[:first_count]
+        self.buffer[:written_count - first_count] = samples[first_count:written_count]
+        self.count += written_count
+        return written_count
+
+    def read(self, max_count = None):
+        '''
+        A function to remove the oldest samples from the buffer.
+
+        Parameters
+        ----------
+        max_count : integer, optional
+            Largest number of samples to read. The default is None, which reads all of them.
+
+        Returns
+        -------
+        samples : array of floats size (x,)
+            The samples removed, oldest first
+
+        '''
+        read_count = self.count if max_count is None else min(max_count, self.count)
+        first_count = min(read_count, self.capacity - self.start)
+        samples = np.concatenate((self.buffer[self.start:self.start + first_count],
+                                  self.buffer[:read_count - first_count]))
+        self.start = (self.start + read_count) % self.capacity
+        self.count -= read_count
+        return samples
+
+#%% Stream statistics
+class StreamStats:
+    '''
+    A class which counts the work done for one stream, to report its throughput
+    and backpressure.
+
+    Parameters
+    ----------
+    name : string
+        Name of the stream
+
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.bytes_received = 0
+        self.samples_received = 0
+        self.samples_processed = 0
+        self.blocks_processed = 0
+        self.beat_count = 0
+        # time the reader spent waiting for space in the ring buffer
+        self.backpressure_time = 0
+        self.backpressure_count = 0
+        # largest number of samples waiting in the ring buffer
+        self.max_buffered = 0
+        # time spent filtering and detecting beats in the executor
+        self.processing_time = 0
+        self.hrv = np.nan
+        self.ratio = np.nan
+
+    def get_summary(self):
+        '''
+        A function to summarize the statistics of the stream.
+
+        Returns
+        -------
+        summary : dictionary
+            The counts above, plus the elapsed time, the throughput in samples per
+            second and the fraction of the elapsed time spent in backpressure
+
+        '''
+        end_time = time.perf_counter() if self.end_time is None else self.end_time
+        elapsed = max(end_time - self.start_time, 1e-9)
+        summary = {key: value for key, value in vars(self).items() if key not in ('start_time', 'end_time')}
+        summary['elapsed'] = elapsed
+        summary['throughput'] = self.samples_processed / elapsed
+        summary['backpressure_fraction'] = self.backpressure_time / elapsed
+        return summary
+
+#%% Ingestion service
+class IngestionService:
+    '''
+    A class which reads many ECG streams at once, filtering each stream and
+    detecting its beats with its own StreamingProcessor.
+
+    Parameters
+    ----------
+    threshold : float
+        Specified value to identify the QRS wave complex, as in detect_beats.
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    block_size : integer, optional
+        Number of samples processed at once, 250 is half a second at 500 Hz.
+        The default is 250.
+    buffer_duration : float, optional
+        Time in seconds of samples each ring buffer holds before backpressure starts.
+        The default is 10.
+    executor : concurrent.futures.Executor, optional
+        Executor the filtering runs in. The default is None, which uses the event
+        loop's default thread pool.
+
+    '''
+    def __init__(self, threshold, fs, block_size = 250, buffer_duration = 10, executor = None):
+        self.threshold = threshold
+        self.fs = fs
+        self.block_size = block_size
+        self.buffer_capacity = max(int(buffer_duration*fs), 2*block_size)
+        self.executor = executor
+        # statistics and detected beat times of each stream, by name
+        self.stats = {}
+        self.beat_times = {}
+
+    async def ingest(self, name, reader):
+        '''
+        A function to read one stream until it ends, processing it in blocks.
+
+        Parameters
+        ----------
+        name : string
+            Name of the stream, used in the statistics
+        reader : asyncio.StreamReader
+            Stream of samples, one per line
+
+        Returns
+        -------
+        beat_time : Array of floats size (x,) where x is the # of beats detected
+            Times in seconds, from the start of the stream, at which the beats occur
+
+        '''
+        stats = StreamStats(name)
+        self.stats[name] = stats
+        self.beat_times[name] = []
+        ring = RingBuffer(self.buffer_capacity)
+        # events which wake the reader when there is space and the processor when there are samples
+        space_available = asyncio.Event()
+        samples_available = asyncio.Event()
+        finished = False
+
+        async def read_samples():
+            nonlocal finished
+            # part of a line left over at the end of the last read
+            leftover = b''
+            try:
+                while True:
+                    data = await reader.read(65536)
+                    if not data:
+                        break
+                    stats.bytes_received += len(data)
+                    lines = (leftover + data).split(b'\n')
+                    leftover = lines.pop()
+                    samples = np.array(b' '.join(lines).split(), dtype = float)
+                    stats.samples_received += len(samples)
+                    await write_samples(samples)
+                # a last line without a line ending
+                await write_samples(np.array(leftover.split(), dtype = float))
+            finally:
+                finished = True
+                samples_available.set()
+
+        async def write_samples(samples):
+            while len(samples) > 0:
+                written_count = ring.write(samples)
+                samples = samples[written_count:]
+                stats.max_buffered = max(stats.max_buffered, ring.count)
+                samples_available.set()
+                # wait for the processor to make space, and stop reading meanwhile
+                if len(samples) > 0:
+                    space_available.clear()
+                    wait_start = time.perf_counter()
+                    await space_available.wait()
+                    stats.backpressure_time += time.perf_counter() - wait_start
+                    stats.backpressure_count += 1
+
+        async def process_samples():
+            loop = asyncio.get_running_loop()
+            processor = p3st.StreamingProcessor(self.threshold, self.fs)
+            while True:
+                if ring.count < self.block_size and not finished:
+                    samples_available.clear()
+                    await samples_available.wait()
+                    continue
+                if ring.count == 0:
+                    # emit the beats still held back by the look-ahead of the filter
+                    _, beat_time, stats.hrv, stats.ratio = processor.flush()
+                    stats.beat_count += len(beat_time)
+                    self.beat_times[name].append(beat_time)
+                    break
+                # take every whole block waiting, so a processor which falls behind catches up
+                block = ring.read(max(ring.count // self.block_size, 1)*self.block_size)
+                space_available.set()
+                process_start = time.perf_counter()
+                _, beat_time, stats.hrv, stats.ratio = await loop.run_in_executor(
+                    self.executor, processor.process_block, block)
+                stats.processing_time += time.perf_counter() - process_start
+                stats.samples_processed += len(block)
+                stats.blocks_processed += 1
+                stats.beat_count += len(beat_time)
+                self.beat_times[name].append(beat_time)
+
+        await asyncio.gather(read_samples(), process_samples())
+        stats.end_time = time.perf_counter()
+        beat_time = np.concatenate(self.beat_times[name]) if self.beat_times[name] else np.empty(0)
+        self.beat_times[name] = [beat_time]
+        return beat_time
+
+    async def run(self, sources):
+        '''
+        A function to connect to every source and ingest them all at once.
+
+        Parameters
+        ----------
+        sources : dictionary
+            Name of each stream and its source, see open_stream
+
+        Returns
+        -------
+        beat_times : dictionary
+            Detected beat times of each stream, by name
+
+        '''
+        async def connect_and_ingest(name, source):
+            reader, writer = await open_stream(source)
+            try:
+                return await self.ingest(name, reader)
+            finally:
+                writer.close()
+
+        beat_times = await asyncio.gather(*(connect_and_ingest(name, source) for name, source in sources.items()))
+        return dict(zip(sources, beat_times))
+
+    def get_stats(self):
+        '''
+        A function to summarize the statistics of every stream.
+
+        Returns
+        -------
+        summaries : dictionary
+            StreamStats.get_summary of each stream, by name
+
+        '''
+        return {name: stats.get_summary() for name, stats in self.stats.items()}
+
+# Create function to open a serial port or TCP socket
+async def open_stream(source, baudrate = 115200):
+    '''
+    A function to open the connection to a stream of samples.
+
+    Parameters
+    ----------
+    source : string
+        'host:port' for a TCP socket, or 'serial:<port>' for a serial port such as
+        'serial:/dev/ttyACM0', which needs the pyserial-asyncio package.
+    baudrate : integer, optional
+        Baud rate of a serial port. The default is 115200.
+
+    Returns
+    -------
+    reader : asyncio.StreamReader
+        Stream the samples are read from
+    writer : asyncio.StreamWriter
+        Writer for the same connection, closed when the stream is finished
+
+    '''
+    if source.startswith('serial:'):
+        # serial support is optional, so it is only imported when it is used
+        try:
+            import serial_asyncio
+        except ImportError as error:
+            raise ImportError('Reading serial ports needs the pyserial-asyncio package') from error
+        return await serial_asyncio.open_serial_connection(url = source[len('serial:'):], baudrate = baudrate)
+    host, port = source.rsplit(':', 1)
+    return await asyncio.open_connection(host, int(port))
+
+#%% Replay server for testing
+# Create function to serve recordings over TCP at their sampling frequency
+async def replay_recordings(input_files, fs, host = '127.0.0.1', speed = 1, block_size = 25):
+    '''
+    A function to start a TCP server for each text recording. Every client which
+    connects is sent the recording one sample per line, paced to the sampling
+    frequency times speed, and the connection is closed at the end of the file.
+
+    Parameters
+    ----------
+    input_files : list of strings
+        Names of the txt files to replay
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    host : string, optional
+        Address to listen on. The default is '127.0.0.1'.
+    speed : float, optional
+        How many times faster than real time to send. The default is 1.
+    block_size : integer, optional
+        Number of samples sent at once. The default is 25, 50 ms at 500 Hz.
+
+    Returns
+    -------
+    servers : list of asyncio.Server
+        Running servers, in the order of input_files
+    sources : list of strings
+        'host:port' of each server, to pass to IngestionService.run
+
+    '''
+    async def send_recording(input_file, writer):
+        try:
+            # send the lines of the recording as they were printed by the Arduino
+            with open(input_file, 'rb') as binary_file:
+                lines = binary_file.read().splitlines(keepends = True)
+            loop = asyncio.get_running_loop()
+            send_start = loop.time()
+            for block_start in range(0, len(lines), block_size):
+                # sleep until this block is due, timed from the start so delays do not add up
+                due = send_start + block_start / (fs*speed)
+                await asyncio.sleep(max(due - loop.time(), 0))
+                writer.write(b''.join(lines[block_start:block_start + block_size]))
+                # wait while the client is not keeping up
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    servers = []
+    sources = []
+    for input_file in input_files:
+        server = await asyncio.start_server(
+            lambda reader, writer, input_file = input_file: send_recording(input_file, writer), host, 0)
+        servers.append(server)
+        sources.append(f'{host}:{server.sockets[0].getsockname()[1]}')
+    return servers, sources
+
+#%% Command line
+# Create function to ingest streams from the command line
+async def run_from_arguments(args):
+    '''
+    A function to start any replay servers, ingest every stream and print the
+    statistics of each one.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Parsed command line arguments, see main
+
+    Returns
+    -------
+    summaries : dictionary
+        Statistics of each stream, see IngestionService.get_stats
+
+    '''
+    sources = {source: source for source in args.connect}
+    servers, replay_sources = await replay_recordings(args.replay, args.fs, speed = args.speed)
+    sources.update({os.path.basename(input_file): source for input_file, source in zip(args.replay, replay_sources)})
+    service = IngestionService(args.threshold, args.fs, args.block_size, args.buffer_duration)
+    try:
+        await service.run(sources)
+    finally:
+        for server in servers:
+            server.close()
+    summaries = service.get_stats()
+    for name, summary in summaries.items():
+        print(f"{name}: {summary['samples_processed']} samples in {summary['elapsed']:.1f} s "
+              f"({summary['throughput']:.0f} samples/s), {summary['beat_count']} beats, "
+              f"backpressure {summary['backpressure_fraction']:.1%}, "
+              f"most buffered {summary['max_buffered']} samples, HRV {summary['hrv']:.3f}")
+    return summaries
+
+# Create function to parse the command line
+def main(argv = None):
+    '''
+    A function to parse the command line arguments and ingest the streams.
+
+    Parameters
+    ----------
+    argv : list of strings, optional
+        Command line arguments. The default is None, which uses sys.argv.
+
+    Returns
+    -------
+    None.
+
+    '''
+    parser = argparse.ArgumentParser(description = 'Ingest several live ECG streams at once.')
+    parser.add_argument('--connect', nargs = '*', default = [], help = "sources to read, 'host:port' or 'serial:<port>'")
+    parser.add_argument('--replay', nargs = '*', default = [], help = 'text recordings to replay over local TCP')
+    parser.add_argument('--speed', type = float, default = 1, help = 'replay speed relative to real time')
+    parser.add_argument('--fs', type = int, default = 500, help = 'sampling frequency in Hz')
+    parser.add_argument('--threshold', type = float, default = 40, help = 'beat detection threshold')
+    parser.add_argument('--block-size', type = int, default = 250, help = 'samples processed at once')
+    parser.add_argument('--buffer-duration', type = float, default = 10, help = 'seconds of samples buffered per stream')
+    args = parser.parse_args(argv)
+    if not args.connect and not args.replay:
+        parser.error('give at least one source with --connect or --replay')
+    asyncio.run(run_from_arguments(args))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Metrics
+This module calculates the standard HRV metrics of a recording from its beat times in
+one call, alongside the single HRV value from calculate_ibis and the LF/HF ratio from
+extract_mean_power:
+    time domain   - mean NN interval, mean heart rate, SDNN, RMSSD and pNN50
+    frequency     - total, VLF, LF and HF power, LF and HF in normalized units, and
+                    LF/HF, integrated from a PSD made by project3_spectral
+    nonlinear     - Poincare SD1 and SD2, sample entropy and DFA alpha 1
+The metrics are returned as a NumPy structured record with the fields of metrics_dtype,
+and calculate_metrics_batch stacks the records of many recordings into one array.
+
+Sample entropy compares every pair of short IBI patterns, which takes O(n^2) time if
+done directly. Here the patterns are put in k-d trees (scipy.spatial.cKDTree), which
+count the matching pairs while skipping whole groups of patterns that are too far
+apart to match, so a 24 hour recording takes seconds.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import numpy as np
+from scipy import spatial
+import project3_spectral as p3s
+
+# fields of the result, the number of beats and then floats, times in seconds and powers in s^2
+metrics_dtype = [('beat_count', int), ('mean_nn', float), ('mean_hr', float), ('sdnn', float),
+                 ('rmssd', float), ('pnn50', float), ('total_power', float), ('vlf_power', float),
+                 ('lf_power', float), ('hf_power', float), ('lf_nu', float), ('hf_nu', float),
+                 ('lf_hf', float), ('sd1', float), ('sd2', float), ('sample_entropy', float),
+                 ('dfa_alpha1', float)]
+
+#%% Nonlinear metrics
+# Create function to calculate the sample entropy of a series
+def calculate_sample_entropy(values, m = 2, r = 0.2):
+    '''
+    A function to calculate the sample entropy of a series, the negative log of the
+    chance that two patterns of m values which match within a tolerance still match
+    when one more value is added. Regular series have low sample entropy. Matching
+    pairs are counted with k-d trees, see the module description.
+
+    Parameters
+    ----------
+    values : array of floats size (n,)
+        Series, such as the NN intervals
+    m : integer, optional
+        Length of the patterns compared. The default is 2.
+    r : float, optional
+        Tolerance as a fraction of the standard deviation of values. The default is 0.2.
+
+    Returns
+    -------
+    sample_entropy : float
+        Sample entropy, nan if no patterns match
+
+    '''
+    values = np.asarray(values, dtype = float)
+    pattern_count = len(values) - m
+    if pattern_count < 2:
+        return np.nan
+    tolerance = r*np.std(values)
+    # patterns of m + 1 values starting at each of the first n - m values, the first
+    # m values of each are the patterns of length m
+    patterns = np.lib.stride_tricks.sliding_window_view(values, m + 1)[:pattern_count]
+    match_counts = []
+    for length in (m, m + 1):
+        tree = spatial.cKDTree(patterns[:, :length])
+        # pairs within the tolerance in every value, counted in both orders and
+        # including each pattern with itself
+        pair_count = tree.count_neighbors(tree, tolerance, p = np.inf)
+        match_counts.append((pair_count - pattern_count) // 2)
+    if match_counts[0] == 0 or match_counts[1] == 0:
+        return np.nan
+    sample_entropy = -np.log(match_counts[1] / match_counts[0])
+    return sample_entropy
+
+# Create function to calculate the short-term DFA scaling exponent
+def calculate_dfa_alpha(values, min_scale = 4, max_scale = 16):
+    '''
+    A function to calculate the detrended fluctuation analysis (DFA) scaling
+    exponent of a series. The integrated series is split into windows of each scale,
+    a straight line is fitted to each window, and the RMS of what is left is the
+    fluctuation at that scale. The exponent is the slope of log fluctuation against
+    log scale; alpha 1 uses scales of 4 to 16 beats.
+
+    Parameters
+    ----------
+    values : array of floats size (n,)
+        Series, such as the NN intervals
+    min_scale, max_scale : integer, optional
+        Smallest and largest window length in values. The defaults are 4 and 16.
+
+    Returns
+    -------
+    alpha : float
+        Scaling exponent, nan if the series is shorter than two windows of max_scale
+
+    '''
+    values = np.asarray(values, dtype = float)
+    if len(values) < 2*max_scale:
+        return np.nan
+    profile = np.cumsum(values - np.mean(values))
+    scales = np.arange(min_scale, max_scale + 1)
+    fluctuation = np.empty(len(scales))
+    for scale_index, scale in enumerate(scales):
+        window_count = len(profile) // scale
+        windows = profile[:window_count*scale].reshape(window_count, scale)
+        # least-squares line through every window at once
+        position = np.arange(scale) - (scale - 1)/2
+        slope = windows @ position / np.sum(position**2)
+        trend = np.mean(windows, axis = 1, keepdims = True) + slope[:, np.newaxis]*position
+        fluctuation[scale_index] = np.sqrt(np.mean((windows - trend)**2))
+    alpha = np.polyfit(np.log(scales), np.log(fluctuation), 1)[0]
+    return alpha
+
+#%% All metrics
+# Create function to calculate every HRV metric of a recording
+def calculate_metrics(beat_time, valid_ibis = None, spectral_method = 'welch', **spectral_settings):
+    '''
+    A function to calculate every HRV metric from the beat times of a recording.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    valid_ibis : Array of bools size (x-1,), optional
+        True for each IBI to use, see project3_quality.find_valid_ibis. Successive
+        differences are only taken between neighbouring valid IBIs. The default is
+        None, which uses every IBI.
+    spectral_method : string, optional
+        'fft', 'welch' or 'lomb', see project3_spectral. The default is 'welch'.
+    **spectral_settings
+        Settings passed on to the spectral method, such as dt.
+
+    Returns
+    -------
+    metrics : numpy.void
+        Structured record with the fields of metrics_dtype, nan where a metric
+        needs more beats than there are
+
+    '''
+    metrics = np.zeros((), dtype = metrics_dtype)
+    for name in metrics.dtype.names[1:]:
+        metrics[name] = np.nan
+    beat_time = np.asarray(beat_time, dtype = float)
+    metrics['beat_count'] = len(beat_time)
+    nn_intervals = np.diff(beat_time)
+    if valid_ibis is None:
+        valid_ibis = np.ones(len(nn_intervals), dtype = bool)
+    # successive differences between neighbouring valid IBIs only
+    successive_differences = np.diff(nn_intervals)[valid_ibis[1:] & valid_ibis[:-1]]
+    nn_intervals = nn_intervals[valid_ibis]
+    if len(nn_intervals) < 2:
+        return metrics[()]
+
+    # time domain
+    metrics['mean_nn'] = np.mean(nn_intervals)
+    metrics['mean_hr'] = 60 / metrics['mean_nn']
+    metrics['sdnn'] = np.std(nn_intervals, ddof = 1)
+    if len(successive_differences) > 0:
+        metrics['rmssd'] = np.sqrt(np.mean(successive_differences**2))
+        metrics['pnn50'] = 100*np.mean(np.abs(successive_differences) > 0.05)
+        # Poincare plot widths across and along the line of identity
+        metrics['sd1'] = np.std(successive_differences, ddof = 1) / np.sqrt(2) if len(successive_differences) > 1 else np.nan
+        metrics['sd2'] = np.sqrt(max(2*metrics['sdnn']**2 - metrics['sd1']**2, 0))
+
+    # frequency domain, total power is all the power below the top of the HF band
+    if len(nn_intervals) >= 3:
+        bands = dict(p3s.frequency_bands, total = (0, p3s.frequency_bands['hf'][1]))
+        frequency, power = p3s.estimate_spectrum(beat_time, spectral_method, valid_ibis = valid_ibis, **spectral_settings)
+        for name, band in bands.items():
+            metrics[f'{name}_power'] = p3s.band_power(frequency, power, band)
+        metrics['lf_nu'] = 100*metrics['lf_power'] / (metrics['lf_power'] + metrics['hf_power'])
+        metrics['hf_nu'] = 100*metrics['hf_power'] / (metrics['lf_power'] + metrics['hf_power'])
+        metrics['lf_hf'] = metrics['lf_power'] / metrics['hf_power']
+
+    # nonlinear
+    metrics['sample_entropy'] = calculate_sample_entropy(nn_intervals)
+    metrics['dfa_alpha1'] = calculate_dfa_alpha(nn_intervals)
+    return metrics[()]
+
+# Create function to calculate the HRV metrics of many recordings
+def calculate_metrics_batch(beat_times, valid_ibis = None, spectral_method = 'welch', **spectral_settings):
+    '''
+    A function to calculate every HRV metric for many recordings or windows.
+
+    Parameters
+    ----------
+    beat_times : list of arrays of floats
+        Beat times in seconds of each recording
+    valid_ibis : list of arrays of bools, optional
+        Valid IBIs of each recording, see calculate_metrics. The default is None,
+        which uses every IBI.
+    spectral_method : string, optional
+        'fft', 'welch' or 'lomb'. The default is 'welch'.
+    **spectral_settings
+        Settings passed on to the spectral method.
+
+    Returns
+    -------
+    metrics : structured array size (r,) where r is the # of recordings
+        One record with the fields of metrics_dtype for each recording
+
+    '''
+    if valid_ibis is None:
+        valid_ibis = [None]*len(beat_times)
+    metrics = np.array([calculate_metrics(beat_time, valid, spectral_method, **spectral_settings)
+                        for beat_time, valid in zip(beat_times, valid_ibis)], dtype = metrics_dtype)
+    return metrics
@@ -8,10 +8,11 @@ This module contains functions which manipulate ECG data recorded using Arduino
 wearable ECG sensors. The data is loaded into an array of a specified length, and filtered
 using a bandpass butterworth filter. There are then functions which detect when heartbeats
 occur, calculate a set of IBIs at evenly spaced intervals, and then calculate heart rate
-variability. The interpolated IBIs are then tranformed into the frequency domain and plotted
-in units of power with specified high and low frequency bands. Finally, the mean power
+variability. The interpolated IBIs are then tranformed into the frequency domain in units
+of power with specified high and low frequency bands. Finally, the mean power
 in these bands is extracted and used to calculate the LF/HF ratio, which will ultimately be 
-used to estimate ANS activity.
+used to estimate ANS activity. These functions only compute, the plots of their results
+are made by the functions in project3_plotting.
 
 Sources used:https://www.youtube.com/watch?v=juYqcck_GfU
 Used video as guidance on how to construct the bandpass filter in part 2.
@@ -20,140 +21,533 @@ Used video as guidance on how to construct the bandpass filter in part 2.
 """
 
 # Import libraries
+# scipy's submodules take most of a second to import, so each is imported inside the
+# functions which use it and importing this module only loads numpy
+import os
+import itertools
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy import fft
-import scipy 
-from scipy.signal import filtfilt
+from functools import lru_cache
 
 #%% Part 1: Collect and Load Data
+# number of text lines parsed at once when streaming a recording, keeps memory bounded
+chunk_size = 65536
+# data type of the signal arrays from load_data and filter_butter, set it to np.float32
+# to halve their memory; beat times, IBIs and spectra stay float64 whatever it is set to,
+# since float32 times lose milliseconds after a few hours of recording
+signal_dtype = np.float64
+
+# Create function to check the data type signal arrays are computed in
+def get_signal_dtype(dtype = None):
+    '''
+    A function to get the data type to compute signal arrays in, allowing only the
+    float types the filter is accurate in.
+
+    Parameters
+    ----------
+    dtype : data type, optional
+        np.float32 or np.float64. The default is None, which uses signal_dtype.
+
+    Raises
+    ------
+    ValueError
+        If dtype is not np.float32 or np.float64.
+
+    Returns
+    -------
+    dtype : numpy.dtype
+        The data type to use
+
+    '''
+    dtype = np.dtype(signal_dtype if dtype is None else dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError(f'Signals can only be computed as float32 or float64, not {dtype}')
+    return dtype
+
+# Create function to get the name of the binary copy of a recording
+def get_sidecar_file(input_file):
+    '''
+    A function to get the name of the binary .npy "sidecar" file which is stored 
+    next to a text recording and holds the same samples.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt file containing the recording
+
+    Returns
+    -------
+    sidecar_file : string
+        Name of the .npy file with the same samples in binary form
+
+    '''
+    # swap the .txt extension for .npy
+    sidecar_file = os.path.splitext(input_file)[0] + '.npy'
+    return sidecar_file
+
+# Create function to parse an open text recording a chunk at a time
+def iterate_text_chunks(text_file, sample_count = None, dtype = float):
+    '''
+    A generator which parses the lines of an open text recording (one sample per 
+    line) at most chunk_size lines at a time, so the whole file is never held in memory.
+    A recording of several leads has one column per lead, separated by whitespace.
+
+    Parameters
+    ----------
+    text_file : file object
+        Text recording opened for reading, positioned at the first line to parse
+    sample_count : integer, optional
+        Number of lines to parse before stopping. The default is None, which parses
+        until the end of the file.
+    dtype : data type, optional
+        Data type of the parsed samples. The default is float.
+
+    Yields
+    ------
+    chunk : array size (x,) or (x, c) where x is at most chunk_size and c is the # of leads
+        Array containing the next chunk of samples, 1D for a single lead
+
+    '''
+    remaining = sample_count
+    while remaining is None or remaining > 0:
+        #read at most chunk_size lines, or fewer at the end of the window
+        lines_to_read = chunk_size if remaining is None else min(chunk_size, remaining)
+        lines = list(itertools.islice(text_file, lines_to_read))
+        # stop once the file runs out of lines
+        if len(lines) == 0:
+            return
+        if remaining is not None:
+            remaining -= len(lines)
+        # always parse a 2D array, so a single line of several leads keeps its shape
+        chunk = np.loadtxt(lines, dtype = dtype, ndmin = 2)
+        yield chunk[:, 0] if chunk.shape[1] == 1 else chunk
+
+# Create function to convert a text recording to a binary sidecar file once
+def convert_to_sidecar(input_file, sidecar_file = None, dtype = np.int16):
+    '''
+    A function to convert a text recording into a binary .npy file, so later calls to
+    load_data can open it with np.memmap instead of parsing the text again. The text
+    is streamed straight into the memory-mapped output one chunk at a time.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt file to be converted
+    sidecar_file : string, optional
+        Name of the .npy file to write. The default is None, which stores it next to
+        input_file with a .npy extension.
+    dtype : data type, optional
+        Data type the samples are stored as. The default is np.int16, which holds the
+        10-bit Arduino ADC values exactly; use np.float32 for non-integer recordings.
+
+    Returns
+    -------
+    sidecar_file : string
+        Name of the .npy file that was written
+
+    '''
+    if sidecar_file is None:
+        sidecar_file = get_sidecar_file(input_file)
+    # count the samples and leads first so the output file can be sized up front
+    sample_count = 0
+    channel_count = 1
+    with open(input_file, 'rb') as text_file:
+        for line in text_file:
+            if line.strip():
+                if sample_count == 0:
+                    channel_count = len(line.split())
+                sample_count += 1
+    # create the .npy file and map it into memory
+    sidecar = np.lib.format.open_memmap(sidecar_file, mode = 'w+', dtype = dtype,
+                                        shape = (sample_count,) if channel_count == 1 else (sample_count, channel_count))
+    #copy each parsed chunk into the file
+    sample_index = 0
+    with open(input_file, 'r') as text_file:
+        for chunk in iterate_text_chunks(text_file, dtype = dtype):
+            sidecar[sample_index:sample_index + len(chunk)] = chunk
+            sample_index += len(chunk)
+    # write everything to disk and close the memory map
+    sidecar.flush()
+    del sidecar
+    return sidecar_file
+
 # Create function to load data for 4 different activity categories
-def load_data(input_file, duration, fs):
+def load_data(input_file, duration, fs, start = 0, use_sidecar = True, dtype = None):
     '''
     A function to load the data file and clip it so that for a given duration &
-   sampling frequency, each data file contains the same number of samples. 
+   sampling frequency, each data file contains the same number of samples. Only the
+   requested window of samples is read. A binary .ecg recording made by
+   project3_recording, either given directly or stored next to the text file and newer
+   than it, is read by decoding only the blocks which overlap the window. Otherwise if a
+   binary sidecar made by convert_to_sidecar exists and is newer than the text file, it
+   is opened with np.memmap without copying. In both cases loading takes the same time
+   whatever the length of the recording. Otherwise the text is parsed in chunks and
+   parsing stops at the end of the window. A text or sidecar recording of several leads
+   is loaded as one array with a column per lead.
 
     Parameters
     ----------
     input_file : string
-        Name of the txt file to be loaded
+        Name of the txt or .ecg file to be loaded
     duration : integer
         The time in seconds that the data should be collected for
     fs : integer
         The sampling frequency in Hz or 1/s
+    start : integer, optional
+        The time in seconds at which the data starts to be collected. The default is 0.
+    use_sidecar : bool, optional
+        Whether to read from a binary .ecg or sidecar copy of a txt file when one is
+        available. The default is True.
+    dtype : data type, optional
+        np.float32 or np.float64. The default is None, which uses signal_dtype.
 
     Returns
     -------
-    data_file : array of floats size (x,) where x is the number of samples
-        1D array containing the ecg voltage data at a given sampling frequency
+    data_file : array of floats size (x,) or (x, c) where x is the number of samples and c the # of leads
+        Array containing the ecg voltage data at a given sampling frequency, 1D for
+        a single lead
 
     '''
-    # load the .txt file into an array
-    data_file = np.loadtxt(input_file, dtype = float)
-    # clip data file so that it is a constant length
-    data_file = data_file[0:duration*fs]
+    dtype = get_signal_dtype(dtype)
+    # get the first sample and number of samples in the window
+    start_sample = int(start*fs)
+    sample_count = int(duration*fs)
+    
+    # read only the blocks of a binary .ecg recording which overlap the window,
+    # imported here since project3_recording itself uses this module
+    import project3_recording as p3r
+    recording_file = p3r.get_recording_file(input_file)
+    if input_file == recording_file or (use_sidecar and os.path.exists(recording_file) \
+            and os.path.getmtime(recording_file) >= os.path.getmtime(input_file)):
+        data_file = p3r.read_window(recording_file, start_sample, sample_count).astype(dtype, copy = False)
+        return data_file
+
+    # use the binary sidecar if it is up to date with the text file
+    sidecar_file = get_sidecar_file(input_file)
+    if use_sidecar and os.path.exists(sidecar_file) \
+            and os.path.getmtime(sidecar_file) >= os.path.getmtime(input_file):
+        #map the file into memory, nothing is read from disk yet
+        samples = np.load(sidecar_file, mmap_mode = 'r')
+        # only the clipped window is read and converted to floats
+        data_file = np.array(samples[start_sample:start_sample + sample_count], dtype = dtype)
+        return data_file
+    
+    # otherwise parse the .txt file in chunks, stopping at the end of the window
+    with open(input_file, 'r') as text_file:
+        # skip the lines before the window without parsing them
+        for line in itertools.islice(text_file, start_sample):
+            pass
+        chunks = list(iterate_text_chunks(text_file, sample_count, dtype = dtype))
+    # join the chunks so the data file is a constant length
+    data_file = np.concatenate(chunks) if len(chunks) > 0 else np.empty(0, dtype = dtype)
     #return the trimmed array of data
     return data_file
     
 #%% Part 2: Filter Your Data
-# Create a function to apply bandpass butterworth filter to each dataset
-def filter_butter(signal):
+# Create function to design the bandpass butterworth filter, remembering every design
+@lru_cache(maxsize = 32)
+def design_filter(lowcut, highcut, order, fs):
     '''
-    A function to create a bandpass filter which removes noise and artifacts from
-    a given signal. 
+    A function to design a bandpass butterworth filter in second-order sections (SOS)
+    form, which stays numerically stable at high orders and sampling frequencies where
+    the (b, a) form does not. The result is cached, so each combination of band, order
+    and sampling frequency is only designed once.
 
     Parameters
     ----------
-    signal : array of floats size (x,) where x is the number of samples
-        1D array containing the ecg voltage data at a given sampling frequency
+    lowcut : float
+        Low cutoff frequency in Hz
+    highcut : float
+        High cutoff frequency in Hz
+    order : integer
+        Order of the butterworth filter
+    fs : float
+        The sampling frequency in Hz or 1/s
 
     Returns
     -------
-    filtered_signal : array of floats size (x,) where x is the number of samples
-        1D array containing the filtered ECG data 
+    sos : array of floats size (x, 6) where x is the # of second-order sections
+        Second-order sections of the filter. The same array is returned to every
+        caller, so it must not be changed.
 
     '''
-    # define lowcut freq, highcut freq, and sampling freq
-    lowcut = 0.5 #30bpm in bps, very low range of a heartrate
-    highcut = 2.5 #150bpm in bps, high range of a heartrate
-    fs = 500 #arduino sampling frequency
-    
     #get values for frequency band cutoff values
     nyq = fs * 0.5 #nyquist frequncy is half of the sampling frequency
     low = lowcut / nyq #low cutoff frequency
     high = highcut / nyq #high cutoff frequency
-    
-    #set order
-    order = 2 #order or 2 used in many examples online
-    
-    #get coefficients to input into butterworth bandpass filter
-    b, a = scipy.signal.butter(order, (low,high), 'bandpass', analog=False)
-    filtered_signal = scipy.signal.filtfilt(b, a, signal, axis=0)
+    import scipy.signal
+    sos = scipy.signal.butter(order, (low,high), 'bandpass', analog=False, output='sos')
+    return sos
+
+# Create a function to apply bandpass butterworth filter to each dataset
+def filter_butter(signal, fs = 500, lowcut = 0.5, highcut = 2.5, order = 2, axis = 0, dtype = None):
+    '''
+    A function to create a bandpass filter which removes noise and artifacts from
+    a given signal. Every lead of a multi-lead signal is filtered in the same call.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) or (x, c) where x is the number of samples and c the # of leads
+        Array containing the ecg voltage data at a given sampling frequency
+    fs : float, optional
+        The sampling frequency in Hz or 1/s. The default is 500, the arduino
+        sampling frequency.
+    lowcut : float, optional
+        Low cutoff frequency in Hz. The default is 0.5, 30bpm in bps, very low range
+        of a heartrate.
+    highcut : float, optional
+        High cutoff frequency in Hz. The default is 2.5, 150bpm in bps, high range
+        of a heartrate.
+    order : integer, optional
+        Order of the butterworth filter. The default is 2, used in many examples online.
+    axis : integer, optional
+        Axis of signal along which to filter, so a stack of recordings can be
+        filtered in a single call. The default is 0.
+    dtype : data type, optional
+        np.float32 or np.float64 to filter in. The filter coefficients are rounded to
+        it too, which for float32 changes the output by about 0.2% of its size. The
+        default is None, which keeps the type of a float32 or float64 signal and
+        otherwise uses signal_dtype.
+
+    Returns
+    -------
+    filtered_signal : array of floats size (x,) where x is the number of samples
+        1D array containing the filtered ECG data 
+
+    '''
+    #get second-order sections for the butterworth bandpass filter, designed once per setting
+    if dtype is None and getattr(signal, 'dtype', None) in (np.float32, np.float64):
+        dtype = signal.dtype
+    dtype = get_signal_dtype(dtype)
+    sos = design_filter(lowcut, highcut, order, fs).astype(dtype, copy = False)
+    import scipy.signal
+    filtered_signal = scipy.signal.sosfiltfilt(sos, np.asarray(signal, dtype = dtype), axis=axis)
     # return filtered signal with less noise and artifacts
     return filtered_signal
     
 #%% Part 3: Detect Heartbeats
 # Create function to detect heartbeats in each dataset
-def detect_beats(signal, threshold, fs):
+def detect_beats(signal, threshold, fs, mask = None):
     '''
     A function to detect when beats occur in a signal by determining if the
-    sample voltage passes a certain threshold. 
+    sample voltage passes a certain threshold. Beats in samples marked bad by a
+    signal quality mask (see project3_quality) are left out. The beats of every lead
+    of a multi-lead signal are found in one pass, see fuse_beats to combine them.
 
     Parameters
     ----------
-    signal : array of floats size (x,) where x is the number of samples
-        1D array containing the ecg voltage data at a given sampling frequency
-    threshold : Integer.
-        Specified value to identify the QRS wave complex.
+    signal : array of floats size (x,) or (x, c) where x is the number of samples and c the # of leads
+        Array containing the ecg voltage data at a given sampling frequency
+    threshold : Integer, or array of floats size (c,)
+        Specified value to identify the QRS wave complex, or one value per lead.
     fs : integer
         The sampling frequency in Hz or 1/s
+    mask : array of bools size (x,) or (x, c), optional
+        True for the samples which are good enough to detect beats in, for all leads
+        or for each lead. The default is None, which uses every sample.
 
     Returns
     -------
     beat_locations : Array of integers size (x,) where x is the # of beats detected
         Contains the samples where the voltage exceeds the threshold, 
-        marking the location of the QRS waves in the signal.
+        marking the location of the QRS waves in the signal. For a multi-lead signal,
+        a list with the array of each lead.
     beat_time : Array of floats size (x,) where x is the # of beats detected
         Representing the times at which the beat exceeded the specified threshold.
+        For a multi-lead signal, a list with the array of each lead.
 
     '''
+    if np.ndim(signal) == 2:
+        above = signal >= threshold
+        # a beat starts where a sample is at or above the threshold and the one before it is not
+        starts = above.copy()
+        starts[1:] &= ~above[:-1]
+        if mask is not None:
+            starts &= mask if np.ndim(mask) == 2 else mask[:, np.newaxis]
+        # nonzero of the transpose lists the beats lead by lead, each in time order
+        beat_channel, locations = np.nonzero(starts.T)
+        split_index = np.cumsum(np.bincount(beat_channel, minlength = signal.shape[1]))[:-1]
+        beat_locations = np.split(locations, split_index)
+        beat_time = [channel_locations / fs for channel_locations in beat_locations]
+        return beat_locations, beat_time
+
     # get the samples where the voltage value is greater than or equal to a threshold value
     potential_beat_index = np.where(signal >= threshold)[0] 
-    #Get indicies of every first value above the threshold, insert a 0 at the start because first value in potential beat is a beat
-    beat_locations = potential_beat_index[np.insert(np.diff(potential_beat_index) > 1, 0, True)] 
+    #Get indicies of every first value above the threshold, the first value in potential beat is always a beat
+    #(prepending -2 keeps this working when no sample is above the threshold)
+    beat_locations = potential_beat_index[np.diff(potential_beat_index, prepend = -2) > 1]
+    # skip beats in masked spans
+    if mask is not None:
+        beat_locations = beat_locations[mask[beat_locations]]
     
-    #create a time array the same length as the signal voltage data
-    time_general = np.arange(len(signal))/fs
     # calculate the times at each location where a beat occurs
-    beat_time = time_general[beat_locations]
-    
-    #plot the signal in time domain with the beat locations specified as dots
-    plt.plot(time_general, signal)
-    plt.scatter(beat_time, signal[beat_locations], c='green')
-    plt.ylabel("Voltage (mV)")
-    plt.xlabel("Time (s)")
-    plt.tight_layout(pad = 3)
+    beat_time = beat_locations / fs
     
     #return array containing the samples (voltages) and times at which a beat occurs 
     return beat_locations, beat_time
 
+# Create function to combine the beats detected in several leads into one beat train
+def fuse_beats(beat_locations, fs, tolerance = 0.05, min_leads = None):
+    '''
+    A function to combine the beats of several leads of one recording. Beats of
+    different leads less than tolerance apart are grouped as the same heartbeat, and
+    a heartbeat is kept if at least min_leads leads detected it, so noise in one lead
+    neither adds beats nor, while the other leads are clean, loses them. Each kept
+    heartbeat is placed at the mean sample of its group.
+
+    Parameters
+    ----------
+    beat_locations : list of arrays of integers
+        Samples of the beats of each lead, from detect_beats
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    tolerance : float, optional
+        Largest time in seconds between the beats of one heartbeat in different
+        leads. It must be shorter than the shortest IBI. The default is 0.05.
+    min_leads : integer, optional
+        Number of leads which must detect a heartbeat. The default is None, which
+        uses a majority of the leads.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (x,) where x is the # of beats kept
+        Samples of the fused beats
+    beat_time : Array of floats size (x,)
+        Times in seconds of the fused beats
+
+    '''
+    if min_leads is None:
+        min_leads = len(beat_locations) // 2 + 1
+    locations = np.concatenate([np.asarray(channel_locations, dtype = np.int64) for channel_locations in beat_locations])
+    channels = np.repeat(np.arange(len(beat_locations)), [len(channel_locations) for channel_locations in beat_locations])
+    order = np.argsort(locations, kind = 'stable')
+    locations = locations[order]
+    channels = channels[order]
+    if len(locations) == 0:
+        return locations, locations / fs
+    # a new group starts wherever the gap to the previous beat is over the tolerance
+    starts_group = np.diff(locations, prepend = locations[0] - tolerance*fs - 1) > tolerance*fs
+    group_starts = np.flatnonzero(starts_group)
+    group = np.cumsum(starts_group) - 1
+    # count each lead once per group, in case one lead has two beats in it
+    first_of_lead = np.unique(group*len(beat_locations) + channels, return_index = True)[1]
+    lead_count = np.bincount(group[first_of_lead], minlength = len(group_starts))
+    group_size = np.diff(np.append(group_starts, len(locations)))
+    fused_locations = np.round(np.add.reduceat(locations, group_starts) / group_size).astype(np.int64)
+    fused_locations = fused_locations[lead_count >= min_leads]
+    fused_time = fused_locations / fs
+    return fused_locations, fused_time
+
 
 #%% Part 4: Calculate Heart Rate Variability
+# Create function to interpolate IBIs known at the beat times onto other times
+def interpolate_ibis(beat_time, interpolated_time, method = 'linear', valid_ibis = None):
+    '''
+    A function to calculate the inter-beat intervals from the beat times, and
+    interpolate them at the given times. Each IBI is known at the time of the beat
+    which ends it. Times before the first or after the last IBI take the first or
+    last IBI value. IBIs which are not valid, such as those spanning an artifact,
+    are left out and the interpolation bridges the gap they leave.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur, at least 2 beats
+    interpolated_time : Array of floats size (y,) where y is the # of interpolated IBIs
+        Times in seconds at which to estimate the IBIs
+    method : string, optional
+        'linear', 'cubic' (cubic spline) or 'pchip' (shape-preserving cubic, which
+        does not overshoot between beats). The default is 'linear'.
+    valid_ibis : Array of bools size (x-1,), optional
+        True for each IBI to use, see project3_quality.find_valid_ibis. The default
+        is None, which uses every IBI.
+
+    Returns
+    -------
+    interpolated_ibi : Array of floats size (y,)
+        IBIs interpolated at interpolated_time, nan if no IBI is valid
+
+    '''
+    # calculate inter-beat-intervals from detected heartbeats
+    ibi_values = np.diff(beat_time) #difference between the times of each beat
+    ibi_time = beat_time[1:]
+    if valid_ibis is not None:
+        ibi_values = ibi_values[valid_ibis]
+        ibi_time = ibi_time[valid_ibis]
+        if len(ibi_values) == 0:
+            return np.full(len(interpolated_time), np.nan)
+    if method == 'linear' or len(ibi_values) < 3:
+        # np.interp already holds the end values outside the known times
+        interpolated_ibi = np.interp(interpolated_time, ibi_time, ibi_values)
+    elif method in ('cubic', 'pchip'):
+        from scipy import interpolate
+        interpolator = interpolate.CubicSpline if method == 'cubic' else interpolate.PchipInterpolator
+        # hold the end values outside the known times instead of extrapolating the curve
+        clipped_time = np.clip(interpolated_time, ibi_time[0], ibi_time[-1])
+        interpolated_ibi = interpolator(ibi_time, ibi_values)(clipped_time)
+    else:
+        raise ValueError(f"Unknown interpolation method '{method}', choose 'linear', 'cubic' or 'pchip'")
+    return interpolated_ibi
+
+# Create function to resample the IBIs of a recording at an even rate
+def resample_ibis(beat_time, dt = 0.1, method = 'linear', valid_ibis = None):
+    '''
+    A function to interpolate the inter-beat intervals at evenly spaced times, every
+    dt seconds from the second beat (when the first IBI is known) to the last beat,
+    so the number of IBIs grows with the length of the recording.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    method : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+    valid_ibis : Array of bools size (x-1,), optional
+        True for each IBI to use, see interpolate_ibis. The default is None, which
+        uses every IBI.
+
+    Returns
+    -------
+    interpolated_time : Array of floats size (y,) where y is the # of interpolated IBIs
+        Evenly spaced times in seconds
+    interpolated_ibi : Array of floats size (y,)
+        IBIs interpolated at interpolated_time
+
+    '''
+    beat_time = np.asarray(beat_time, dtype = float)
+    # need at least 2 beats for one IBI
+    if len(beat_time) < 2:
+        return np.empty(0), np.empty(0)
+    # create time array in seconds to interpolate IBIs
+    interpolated_time = np.arange(beat_time[1], beat_time[-1], dt)
+    interpolated_ibi = interpolate_ibis(beat_time, interpolated_time, method, valid_ibis)
+    return interpolated_time, interpolated_ibi
+
 # Create function to calculate the inter-beat intervals from detected heartbeats, interpolate the IBIs, and calculate HRV
-def calculate_ibis(beat_locations, beat_time):
+def calculate_ibis(beat_locations, beat_time, dt = 0.1, method = 'linear', valid_ibis = None):
     '''
     A function to calculate the inter-beat intervals from detected heartbeats, then 
     interpolate the IBIs at times of known heartbeats to estimate the IBIs at unknown,
     evenly spaced times, and finally calculate the HRV or the difference between the 
-    interpolated IBI timecourse values. 
+    interpolated IBI timecourse values. The interpolation is done in seconds from
+    beat_time, see resample_ibis.
 
     Parameters
     ----------
     beat_locations : Array of integers size (x,) where x is the # of beats detected
         Contains the samples where the voltage exceeds the threshold, 
-        marking the location of the QRS waves in the signal.
+        marking the location of the QRS waves in the signal. Only beat_time is
+        needed to calculate the IBIs; this is kept so existing calls still work.
     beat_time : Array of floats size (x,) where x is the # of beats detected
         Representing the times at which the beat exceeded the specified threshold.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    method : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+    valid_ibis : Array of bools size (x-1,), optional
+        True for each IBI to use, see interpolate_ibis. The default is None, which
+        uses every IBI.
 
     Returns
     -------
@@ -164,16 +558,8 @@ def calculate_ibis(beat_locations, beat_time):
         of the specified signal
 
     '''
-    dt = 0.1 #interpolated time array should be evenly spaced at intervals of .1 second
-    fs = 10 #fs = 1/dt
-    # create time array to interpolate IBIs
-    interpolated_time = np.arange(0, beat_locations.max(), dt)
-    # calculate inter-beat-intervals from detected heartbeats
-    ibi_values = np.diff(beat_time, axis = 0) #difference between the times of each beat
-    #beat times corresponding to the detected beats at a sampling frequency of 10Hz
-    beat_times = beat_locations[1:] / fs 
-    # interpolation using IBIs at known (heartbeat) times to estimate the IBIs at unknown (regularly spaced) times
-    interpolated_ibi = np.interp(interpolated_time, beat_times, ibi_values)
+    # interpolate the IBIs at evenly spaced times between the beats
+    interpolated_time, interpolated_ibi = resample_ibis(beat_time, dt, method, valid_ibis)
     
     # calculate heart rate variability, the difference in times between beats
     hrv = np.std(interpolated_ibi) #standard deviation of interpolated interbeat intervals
@@ -183,12 +569,144 @@ def calculate_ibis(beat_locations, beat_time):
     
 
 #%% Part 5: Get HRV Frequency Band Power
+# LF and HF bands in Hz of the LF/HF ratio; each band includes both of its edges, so a
+# frequency of exactly 0.15 Hz counts in both, unlike the half-open bands of
+# project3_spectral.frequency_bands, which are integrated rather than averaged
+ratio_bands = {'lf': (0.04, 0.15), 'hf': (0.15, 0.4)}
+
+class Spectrum:
+    '''
+    A class which holds the power spectrum of an IBI timecourse, so the power of any
+    number of frequency bands can be found from one FFT. The frequencies are sorted, so
+    the ends of a band are found by binary search, and the power in a band is the
+    difference of two values of the cumulative sum of the power, which is only made on
+    the first query. Each query takes O(log n) time however wide the band is.
+
+    Parameters
+    ----------
+    ibi_values : Array of floats size (x,) where x is the # of IBIs after interpolation
+        The time between each beat at an evenly spaced interval of dt
+    dt : float, optional
+        The amount of time between each IBI value. The default is 0.1.
+    pad : bool, optional
+        Whether to zero-pad the timecourse to the next length scipy.fft transforms
+        quickly (scipy.fft.next_fast_len), which also makes the frequency steps a
+        little finer. Each band then holds slightly different frequencies, which
+        moves the LF/HF ratio of the bundled recordings by up to about 15%. The
+        default is False, which transforms the x values as they are.
+
+    '''
+    def __init__(self, ibi_values, dt = 0.1, pad = False):
+        from scipy import fft
+        ibi_values = np.asarray(ibi_values, dtype = float)
+        self.dt = dt
+        self.fft_length = fft.next_fast_len(len(ibi_values), real = True) if pad else len(ibi_values)
+        #subtract mean of the signal to account for high freq sin wave fluctuations around dc offset
+        frequency_fft = fft.rfft(ibi_values - np.mean(ibi_values), n = self.fft_length)
+        # convert to units of power, square the absolute value of the frequency
+        self.power = np.square(np.abs(frequency_fft))
+        self.frequency = fft.rfftfreq(self.fft_length, dt)
+        # cumulative sum of the power with a leading 0, made on the first band query
+        self.cumulative_power = None
+
+    def get_band_index(self, bands):
+        '''
+        A function to find the first and one past the last frequency inside each band,
+        including frequencies equal to either end.
+
+        Parameters
+        ----------
+        bands : tuple of floats, or array of floats size (b, 2)
+            Low and high ends of a band in Hz, or of b bands
+
+        Returns
+        -------
+        start, stop : integer or array of integers size (b,)
+            Index of the first frequency in each band and one past its last
+
+        '''
+        bands = np.asarray(bands, dtype = float)
+        start = np.searchsorted(self.frequency, bands[..., 0], side = 'left')
+        stop = np.searchsorted(self.frequency, bands[..., 1], side = 'right')
+        return start, np.maximum(stop, start)
+
+    def get_band(self, band):
+        '''
+        A function to get the frequencies and powers inside a band, as views of the
+        whole spectrum.
+
+        Parameters
+        ----------
+        band : tuple of floats
+            Low and high ends of the band in Hz
+
+        Returns
+        -------
+        band_freq : Array of floats size (x,) where x is # of freq values within the band
+            Frequency values within the band
+        band_power : Array of floats size (x,)
+            Corresponding power values within the band
+
+        '''
+        start, stop = self.get_band_index(band)
+        return self.frequency[start:stop], self.power[start:stop]
+
+    def get_band_power(self, bands, statistic = 'mean'):
+        '''
+        A function to get the total or mean power of any number of bands at once.
+
+        Parameters
+        ----------
+        bands : tuple of floats, or array of floats size (b, 2)
+            Low and high ends of a band in Hz, or of b bands
+        statistic : string, optional
+            'mean' for the mean power of the frequencies in each band, as
+            extract_mean_power uses, or 'sum' for their total. The default is 'mean'.
+
+        Returns
+        -------
+        band_power : float or array of floats size (b,)
+            Power of each band, nan for the mean of a band holding no frequencies
+
+        '''
+        if statistic not in ('mean', 'sum'):
+            raise ValueError(f"Unknown statistic '{statistic}', choose 'mean' or 'sum'")
+        if self.cumulative_power is None:
+            self.cumulative_power = np.concatenate(([0], np.cumsum(self.power)))
+        start, stop = self.get_band_index(bands)
+        band_power = self.cumulative_power[stop] - self.cumulative_power[start]
+        if statistic == 'mean':
+            with np.errstate(divide = 'ignore', invalid = 'ignore'):
+                band_power = band_power / (stop - start)
+        return band_power
+
+    def get_ratio(self, low_band = ratio_bands['lf'], high_band = ratio_bands['hf']):
+        '''
+        A function to get the ratio of the mean power of two bands, the LF/HF ratio
+        by default, which matches extract_mean_power on the powers of frequency_filter.
+
+        Parameters
+        ----------
+        low_band, high_band : tuple of floats, optional
+            Ends of the bands in Hz. The defaults are the LF and HF bands of ratio_bands.
+
+        Returns
+        -------
+        ratio : float
+            Mean power of low_band over mean power of high_band
+
+        '''
+        low_power, high_power = self.get_band_power([low_band, high_band])
+        ratio = low_power / high_power
+        return ratio
+
 # Create function to calculate the frequency domain magnitude of each activity’s IBI timecourse signal
-def frequency_filter(ibi_values, dt = 0.1):
+def frequency_filter(ibi_values, dt = 0.1, pad = False):
     '''
     A function to calculate the magnitude of an IBI timecourse (units of power) in the 
     frequency domain using a fast fourier transform, then filter the data to obtain
-    high and low frequency bands. 
+    high and low frequency bands. Use a Spectrum directly to query other bands without
+    repeating the transform.
     
     Parameters
     ----------
@@ -196,6 +714,9 @@ def frequency_filter(ibi_values, dt = 0.1):
         The time between each beat at an evenly spaced interval of dt = .1
     dt : float, optional
         The amount of time between each IBI value. The default is 0.1.
+    pad : bool, optional
+        Whether to zero-pad the timecourse to a fast FFT length, see Spectrum.
+        The default is False.
 
     Returns
     -------
@@ -218,48 +739,16 @@ def frequency_filter(ibi_values, dt = 0.1):
 
     '''
     # calculate IBI timecourse in frequency domain
-    #subtract mean of the signal to account for high freq sin wave fluctuations around dc offset
-    frequency_fft = fft.rfft(ibi_values - np.mean(ibi_values)) 
-    # convert to units of power, square the absolute value of the frequency
-    power = np.square(np.abs(frequency_fft))
-    # calculate corresponding frequency values 
-    frequency = fft.rfftfreq(len(ibi_values), dt)
+    spectrum = Spectrum(ibi_values, dt, pad)
+    frequency = spectrum.frequency
+    power = spectrum.power
     
-    #initialize array for low frequency band 
-    low_freq_index = np.zeros(len(frequency))
-    # set array values where frequency is within .04-.15 Hz equal to one, used for bool indexing
-    low_freq_index[(frequency >= 0.04) & (frequency <= 0.15)] = 1
-    low_freq_index = low_freq_index.astype(int) #index values must be integers
-    # get low frequency band frequency values
-    low_freq = frequency[(frequency >= 0.04) & (frequency <= 0.15)]
-    # keep power values that fall within the low freq range
-    low_power_index = power * low_freq_index
-    #get low frequency band power values
-    low_power = low_power_index[low_power_index >0]
-   
-    #initialize array for low frequency band 
-    high_freq_index = np.zeros(len(frequency))
-    # set array values where frequency is within .15-.4 Hz equal to one
-    high_freq_index[(frequency >= 0.15) & (frequency <= 0.4)] = 1
-    high_freq_index = high_freq_index.astype(int)
-    # get high frequency band frequency values
-    high_freq = frequency[(frequency >= 0.15) & (frequency <= 0.4)]
-    # keep power values that fall within the high freq range
-    high_power_index = power * high_freq_index
-    #get high frequency band power values
-    high_power = high_power_index[high_power_index >0]
+    # get low frequency band (.04-.15 Hz) frequency and power values, the frequencies
+    # are sorted so the band is one slice and every power lines up with its frequency
+    low_freq, low_power = spectrum.get_band(ratio_bands['lf'])
+    # get high frequency band (.15-.4 Hz) frequency and power values
+    high_freq, high_power = spectrum.get_band(ratio_bands['hf'])
     
-    #plot frequency domain magnitude in units of power for given IBI timecourse
-    plt.plot(frequency, power)
-    #plot low frequency band
-    plt.plot(low_freq, low_power, alpha = 0.7, color='y', label = 'LF Band')
-    plt.fill_between(low_freq, low_power, alpha = 0.5, color='y') #shade below line
-    # plot high frequency band
-    plt.plot(high_freq, high_power, alpha = 0.7, color='g', label="HF Band")
-    plt.fill_between(high_freq, high_power, alpha = 0.5, color='g') #shade below line
-    #zoom in on frequency bands
-    plt.xlim(0,0.4)
-    plt.legend()
     #return arrays containing frequency, power, as well as freq and power data for LF and Hf bands
     return frequency, power, low_freq, low_power, high_freq, high_power
     
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Parallel
+This module is a command line tool which analyzes a whole directory of ECG recordings
+using every core. The recordings are split into chunks, and each chunk is sent to a
+worker process which analyzes it with project3_analyze.Pipeline, the same analysis
+hrv-analyze runs, so both tools give the same results for a file. Workers read their
+own files from disk, so only file names go to the workers and only the small
+per-recording results come back; no signal arrays are pickled between processes. A
+recording which fails is reported in the error column of the output instead of
+stopping the run.
+
+Example:
+    python project3_parallel.py recordings/ --workers 4 --output results.csv
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import argparse
+import glob
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import project3_analyze as p3a
+
+# columns of the results table, the same as hrv-analyze, with an error message
+results_dtype = p3a.results_dtype
+
+#%% Worker
+# Create function which analyzes one chunk of files inside a worker process
+def analyze_chunk(input_files, duration, fs, threshold, dt = 0.1):
+    '''
+    A function to analyze a chunk of recordings in a worker process with
+    project3_analyze.Pipeline, without the stage cache, which workers would share.
+    A file which fails only fails its own row.
+
+    Parameters
+    ----------
+    input_files : list of strings
+        Names of the txt files in the chunk
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBI timecourse. The default is 0.1.
+
+    Returns
+    -------
+    rows : list of tuples
+        One row of the results table for each file in the chunk
+
+    '''
+    pipeline = p3a.Pipeline(duration = duration, fs = fs, threshold = threshold, dt = dt, use_cache = False)
+    rows = pipeline.run(input_files).tolist()
+    return rows
+
+#%% Parallel runner
+# Create function to find the recordings named on the command line
+def find_recordings(paths, pattern = '*.txt'):
+    '''
+    A function to expand a list of files, directories and glob patterns into a sorted
+    list of recording files.
+
+    Parameters
+    ----------
+    paths : list of strings
+        Files, directories or glob patterns
+    pattern : string, optional
+        Pattern used to find recordings inside directories. The default is '*.txt'.
+
+    Returns
+    -------
+    input_files : list of strings
+        Sorted names of the recording files, without duplicates
+
+    '''
+    input_files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            input_files.update(glob.glob(os.path.join(path, pattern)))
+        else:
+            input_files.update(glob.glob(path))
+    return sorted(input_files)
+
+# Create function to analyze many recordings across a pool of worker processes
+def analyze_in_parallel(input_files, duration, fs, threshold, dt = 0.1, workers = None,
+                        files_per_chunk = 8):
+    '''
+    A function to split a list of recordings into chunks and analyze the chunks in
+    parallel with a ProcessPoolExecutor.
+
+    Parameters
+    ----------
+    input_files : list of strings
+        Names of the txt files to be analyzed
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBI timecourse. The default is 0.1.
+    workers : integer, optional
+        Number of worker processes. The default is None, which uses every core.
+    files_per_chunk : integer, optional
+        Number of files sent to a worker at once. The default is 8.
+
+    Returns
+    -------
+    results : structured array size (n,) where n is the # of input files
+        One row per recording, in the order of input_files, with the fields of
+        results_dtype and an error message which is empty on success.
+
+    '''
+    chunks = [input_files[index:index + files_per_chunk]
+              for index in range(0, len(input_files), files_per_chunk)]
+    rows = []
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(analyze_chunk, chunk, duration, fs, threshold, dt)
+                   for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            try:
+                rows.extend(future.result())
+            except Exception as error:
+                # the worker itself died, mark every file in its chunk as failed
+                rows.extend((input_file, 0, 0, np.nan, np.nan, f'{type(error).__name__}: {error}')
+                            for input_file in chunk)
+    results = np.array(rows, dtype = results_dtype)
+    return results
+
+# Create function to write the results table to csv or parquet
+def save_results(results, output_file):
+    '''
+    A function to write the results table to a csv file, or to a parquet file if
+    output_file ends in .parquet (this needs pyarrow to be installed).
+
+    Parameters
+    ----------
+    results : structured array size (n,)
+        Results table with one row per recording
+    output_file : string
+        Name of the file to write
+
+    Returns
+    -------
+    None.
+
+    '''
+    p3a.write_results(results, 'parquet' if output_file.endswith('.parquet') else 'csv', output_file)
+
+# Create function to run the command line tool
+def main(argv = None):
+    '''
+    A function to parse the command line arguments, analyze the recordings in parallel
+    and write the results table.
+
+    Parameters
+    ----------
+    argv : list of strings, optional
+        Command line arguments. The default is None, which uses sys.argv.
+
+    Returns
+    -------
+    failure_count : integer
+        Number of recordings which could not be analyzed
+
+    '''
+    parser = argparse.ArgumentParser(description = 'Calculate HRV and LF/HF ratios for many ECG recordings in parallel.')
+    parser.add_argument('paths', nargs = '+', help = 'recording files, directories or glob patterns')
+    parser.add_argument('--pattern', default = '*.txt', help = 'pattern for recordings inside directories')
+    parser.add_argument('--duration', type = int, default = 300, help = 'seconds of data to analyze')
+    parser.add_argument('--fs', type = int, default = 500, help = 'sampling frequency in Hz')
+    parser.add_argument('--threshold', type = float, default = 40, help = 'beat detection threshold')
+    parser.add_argument('--dt', type = float, default = 0.1, help = 'spacing of the interpolated IBIs in seconds')
+    parser.add_argument('--workers', type = int, default = None, help = 'number of worker processes')
+    parser.add_argument('--files-per-chunk', type = int, default = 8, help = 'files sent to a worker at once')
+    parser.add_argument('--output', default = 'hrv_results.csv', help = 'output .csv or .parquet file')
+    args = parser.parse_args(argv)
+
+    input_files = find_recordings(args.paths, args.pattern)
+    results = analyze_in_parallel(input_files, args.duration, args.fs, args.threshold, args.dt,
+                                  args.workers, args.files_per_chunk)
+    save_results(results, args.output)
+    # report the files that failed
+    failed = results[results['error'] != '']
+    for row in failed:
+        print(f"{row['input_file']}: {row['error']}")
+    print(f'Analyzed {len(results) - len(failed)} of {len(results)} recordings, results saved to {args.output}')
+    return len(failed)
+
+if __name__ == '__main__':
+    raise SystemExit(1 if main() > 0 else 0)
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Plotting
+This module draws the results of the functions in project3_module. It is kept
+separate so the analysis can run without matplotlib. Long signals are decimated
+before they are drawn: each pixel column of the axes keeps only the minimum and
+maximum sample that falls in it, which draws the same picture as the full signal
+while costing about as much as the width of the screen.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import numpy as np
+import matplotlib.pyplot as plt
+
+#%% Decimation
+# Create function to reduce a signal to a min/max envelope for plotting
+def decimate_for_plot(x, y, width):
+    '''
+    A function to reduce a signal to the minimum and maximum sample in each of width
+    equal bins, keeping the samples in their original order so the envelope looks
+    the same as the full signal when drawn as a line.
+
+    Parameters
+    ----------
+    x : array of floats size (x,) where x is the number of samples
+        Values on the x axis, such as times or frequencies
+    y : array of floats size (x,)
+        Values on the y axis
+    width : integer
+        Number of bins, usually the width of the axes in pixels
+
+    Returns
+    -------
+    x_decimated : array of floats size (d,) where d is at most 2*width
+        x values of the samples that were kept
+    y_decimated : array of floats size (d,)
+        y values of the samples that were kept
+
+    '''
+    x = np.asarray(x)
+    y = np.asarray(y)
+    # short signals are drawn as they are
+    if len(y) <= 2*width:
+        return x, y
+    # split the samples into width bins, padding the last bin with its last sample
+    bin_size = int(np.ceil(len(y) / width))
+    padded_y = np.pad(y, (0, bin_size*width - len(y)), mode = 'edge').reshape(width, bin_size)
+    #index of the min and max sample in each bin, in the order they occur
+    bin_start = np.arange(width)*bin_size
+    min_index = bin_start + np.argmin(padded_y, axis = 1)
+    max_index = bin_start + np.argmax(padded_y, axis = 1)
+    keep = np.sort(np.stack((min_index, max_index), axis = 1), axis = 1).ravel()
+    keep = np.minimum(keep, len(y) - 1)
+    return x[keep], y[keep]
+
+# Create function to get the width of the current axes in pixels
+def get_axes_width(ax = None):
+    '''
+    A function to get the width in pixels of a set of axes.
+
+    Parameters
+    ----------
+    ax : matplotlib Axes, optional
+        Axes to measure. The default is None, which uses the current axes.
+
+    Returns
+    -------
+    width : integer
+        Width of the axes in pixels, at least 1
+
+    '''
+    if ax is None:
+        ax = plt.gca()
+    width = max(int(ax.get_window_extent().width), 1)
+    return width
+
+# Create function to plot a long signal after decimating it
+def plot_decimated(x, y, ax = None, xlim = None, **kwargs):
+    '''
+    A function to plot a signal as a line after reducing it to a min/max envelope
+    with one bin per pixel column of the axes. If only part of the signal will be
+    shown, pass xlim so the pixel columns are spent on that part.
+
+    Parameters
+    ----------
+    x : array of floats size (x,) where x is the number of samples
+        Values on the x axis
+    y : array of floats size (x,)
+        Values on the y axis
+    ax : matplotlib Axes, optional
+        Axes to plot on. The default is None, which uses the current axes.
+    xlim : tuple of floats, optional
+        Range of x values to show. The default is None, which shows the whole signal.
+    **kwargs
+        Passed on to plot.
+
+    Returns
+    -------
+    lines : list of matplotlib Line2D
+        The lines that were drawn
+
+    '''
+    if ax is None:
+        ax = plt.gca()
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if xlim is not None:
+        # keep the samples in the shown range plus one on either side so the line reaches the edges
+        first, last = np.searchsorted(x, xlim)
+        x = x[max(first - 1, 0):last + 1]
+        y = y[max(first - 1, 0):last + 1]
+        ax.set_xlim(xlim)
+    x_decimated, y_decimated = decimate_for_plot(x, y, get_axes_width(ax))
+    lines = ax.plot(x_decimated, y_decimated, **kwargs)
+    return lines
+
+#%% Plots of the module results
+# Create function to plot a signal with its detected beats
+def plot_beats(signal, beat_locations, fs, ax = None, xlim = None):
+    '''
+    A function to plot the signal in the time domain with the detected beat
+    locations from detect_beats shown as dots.
+
+    Parameters
+    ----------
+    signal : array of floats size (x,) where x is the number of samples
+        1D array containing the ecg voltage data at a given sampling frequency
+    beat_locations : Array of integers size (x,) where x is the # of beats detected
+        Samples where a beat was detected
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    ax : matplotlib Axes, optional
+        Axes to plot on. The default is None, which uses the current axes.
+    xlim : tuple of floats, optional
+        Range of times in seconds to show. The default is None, which shows the whole signal.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if ax is None:
+        ax = plt.gca()
+    time_general = np.arange(len(signal))/fs
+    plot_decimated(time_general, signal, ax, xlim)
+    ax.scatter(beat_locations/fs, signal[beat_locations], c='green')
+    ax.set_ylabel("Voltage (mV)")
+    ax.set_xlabel("Time (s)")
+    plt.tight_layout(pad = 3)
+
+# Create function to plot the IBI spectrum with its LF and HF bands
+def plot_spectrum(frequency, power, low_freq, low_power, high_freq, high_power, ax = None):
+    '''
+    A function to plot the power spectrum of an IBI timecourse from frequency_filter
+    with the low and high frequency bands shaded.
+
+    Parameters
+    ----------
+    frequency : Array of floats size (x,)
+        Frequency values of the spectrum
+    power : Array of floats size (x,)
+        Power values of the spectrum
+    low_freq : Array of floats size (x,) where x is # of freq values within LF band
+        Frequency values within the low frequency band
+    low_power : Array of floats size (x,) where x is # of freq values within LF band
+        Power values within the low frequency band
+    high_freq : Array of floats size (x,) where x is # of freq values within HF band
+        Frequency values within the high frequency band
+    high_power : Array of floats size (x,) where x is # of freq values within HF band
+        Power values within the high frequency band
+    ax : matplotlib Axes, optional
+        Axes to plot on. The default is None, which uses the current axes.
+
+    Returns
+    -------
+    None.
+
+    '''
+    if ax is None:
+        ax = plt.gca()
+    #plot frequency domain magnitude in units of power, zoomed in on the frequency bands
+    plot_decimated(frequency, power, ax, xlim = (0,0.4))
+    #plot low frequency band
+    ax.plot(low_freq, low_power, alpha = 0.7, color='y', label = 'LF Band')
+    ax.fill_between(low_freq, low_power, alpha = 0.5, color='y') #shade below line
+    # plot high frequency band
+    ax.plot(high_freq, high_power, alpha = 0.7, color='g', label="HF Band")
+    ax.fill_between(high_freq, high_power, alpha = 0.5, color='g') #shade below line
+    ax.legend()
@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Profiling
+This module measures where the analysis spends its time. A Tracer replaces the
+functions of the chosen modules (project3_module by default) with wrappers which
+record the wall and CPU time, the size of the arrays going in and out, the memory
+allocated (with tracemalloc) and the number of calls of each function. Because other
+modules call these functions through the module, for example p3m.filter_butter, the
+wrappers see every call, including calls from one function of the module to another.
+The original functions are put back when the tracer stops, so when it is not running
+nothing is wrapped and profiling costs nothing.
+
+The recorded calls can be summarized per function, saved as JSON, or saved in the
+Chrome trace format to view as a timeline in chrome://tracing or ui.perfetto.dev.
+
+Example:
+    with p3prof.Tracer() as tracer:
+        p3m.load_data('rest_data (1).txt', 300, 500)
+    tracer.print_summary()
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+import tracemalloc
+import numpy as np
+import project3_module as p3m
+
+#%% Array sizes
+# Create function to count the bytes of the arrays in a value
+def get_array_bytes(value):
+    '''
+    A function to add up the sizes of the NumPy arrays in a value, looking inside
+    tuples, lists and dictionaries.
+
+    Parameters
+    ----------
+    value : object
+        Argument or result of a function
+
+    Returns
+    -------
+    array_bytes : integer
+        Total size in bytes of the arrays found
+
+    '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(get_array_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(get_array_bytes(item) for item in value.values())
+    return 0
+
+#%% Tracer
+class Tracer:
+    '''
+    A class which records every call to the functions of some modules while it is
+    running. Start it with start() and stop it with stop(), or use it in a with block.
+
+    Parameters
+    ----------
+    modules : list of modules, optional
+        Modules whose functions are recorded. The default is None, which records
+        project3_module.
+    trace_memory : bool, optional
+        Whether to record the memory each call allocates with tracemalloc, which
+        slows allocations down while the tracer runs. The default is True.
+
+    '''
+    def __init__(self, modules = None, trace_memory = True):
+        self.modules = [p3m] if modules is None else list(modules)
+        self.trace_memory = trace_memory
+        # one dictionary per recorded call, in the order the calls finished
+        self.events = []
+        # the calls in progress in each thread, innermost last
+        self.local = threading.local()
+        # the original functions, by module and name, while they are replaced
+        self.originals = {}
+        self.started_tracemalloc = False
+        self.start_time = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        '''
+        A function to replace the functions of the modules with recording wrappers.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if self.originals:
+            return
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracemalloc = True
+        self.start_time = time.perf_counter()
+        for module in self.modules:
+            for name, function in list(vars(module).items()):
+                # only functions defined in the module itself, not classes or imports
+                if name.startswith('_') or isinstance(function, type) or not callable(function) \
+                        or getattr(function, '__module__', None) != module.__name__:
+                    continue
+                label = f"{module.__name__}.{name}"
+                self.originals[(module, name)] = function
+                setattr(module, name, self.wrap(function, label))
+
+    def stop(self):
+        '''
+        A function to put the original functions back.
+
+        Returns
+        -------
+        None.
+
+        '''
+        for (module, name), function in self.originals.items():
+            setattr(module, name, function)
+        self.originals = {}
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+            self.started_tracemalloc = False
+
+    def wrap(self, function, label):
+        '''
+        A function to make a wrapper which records each call of a function.
+        Generators are recorded once for every item they produce.
+
+        Parameters
+        ----------
+        function : function
+            Function to wrap
+        label : string
+            Name the calls are recorded under
+
+        Returns
+        -------
+        wrapper : function
+            Function which calls function and records the call
+
+        '''
+        if inspect.isgeneratorfunction(function):
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                generator = function(*args, **kwargs)
+                while True:
+                    frame = self.begin_call(label, args, kwargs)
+                    try:
+                        item = next(generator)
+                    except StopIteration:
+                        self.end_call(frame, None)
+                        return
+                    self.end_call(frame, item)
+                    yield item
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            frame = self.begin_call(label, args, kwargs)
+            result = None
+            try:
+                result = function(*args, **kwargs)
+                return result
+            finally:
+                self.end_call(frame, result)
+        return wrapper
+
+    def begin_call(self, label, args, kwargs):
+        '''
+        A function to note the start of a call.
+
+        Parameters
+        ----------
+        label : string
+            Name of the function
+        args, kwargs
+            Arguments of the call
+
+        Returns
+        -------
+        frame : dictionary
+            Start times and memory of the call, passed to end_call
+
+        '''
+        stack = self.get_stack()
+        frame = {'name': label, 'depth': len(stack), 'input_bytes': get_array_bytes(args) + get_array_bytes(kwargs)}
+        if self.trace_memory:
+            current_memory, peak_memory = tracemalloc.get_traced_memory()
+            # keep the caller's peak so far before resetting the peak for this call
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak_memory)
+            tracemalloc.reset_peak()
+            frame['start_memory'] = current_memory
+            frame['child_peak'] = current_memory
+        stack.append(frame)
+        frame['start_cpu'] = time.process_time()
+        frame['start_wall'] = time.perf_counter()
+        return frame
+
+    def end_call(self, frame, result):
+        '''
+        A function to note the end of a call and record it in events.
+
+        Parameters
+        ----------
+        frame : dictionary
+            Returned by begin_call
+        result : object
+            Value returned by the call
+
+        Returns
+        -------
+        None.
+
+        '''
+        end_wall = time.perf_counter()
+        end_cpu = time.process_time()
+        stack = self.get_stack()
+        stack.pop()
+        event = {'name': frame['name'], 'depth': frame['depth'], 'thread': threading.get_ident(),
+                 'start': frame['start_wall'] - self.start_time, 'wall': end_wall - frame['start_wall'],
+                 'cpu': end_cpu - frame['start_cpu'], 'input_bytes': frame['input_bytes'],
+                 'output_bytes': get_array_bytes(result)}
+        if self.trace_memory:
+            current_memory, peak_memory = tracemalloc.get_traced_memory()
+            peak_memory = max(peak_memory, frame['child_peak'])
+            event['peak_memory'] = peak_memory - frame['start_memory']
+            event['net_memory'] = current_memory - frame['start_memory']
+            # the caller's peak includes this call's peak
+            if stack:
+                stack[-1]['child_peak'] = max(stack[-1]['child_peak'], peak_memory)
+        self.events.append(event)
+
+    def get_stack(self):
+        '''
+        A function to get the calls in progress in the current thread.
+
+        Returns
+        -------
+        stack : list of dictionaries
+            Frames of the calls in progress, innermost last
+
+        '''
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def get_summary(self):
+        '''
+        A function to total the recorded calls of each function.
+
+        Returns
+        -------
+        summary : dictionary
+            For each function name, its number of calls, total wall and CPU time in
+            seconds, total bytes of arrays in and out, and largest peak memory in bytes,
+            sorted from the most to the least total wall time
+
+        '''
+        summary = {}
+        for event in self.events:
+            totals = summary.setdefault(event['name'], {'calls': 0, 'wall': 0, 'cpu': 0, 'input_bytes': 0,
+                                                        'output_bytes': 0, 'peak_memory': 0})
+            totals['calls'] += 1
+            for key in ('wall', 'cpu', 'input_bytes', 'output_bytes'):
+                totals[key] += event[key]
+            totals['peak_memory'] = max(totals['peak_memory'], event.get('peak_memory', 0))
+        return dict(sorted(summary.items(), key = lambda item: -item[1]['wall']))
+
+    def print_summary(self):
+        '''
+        A function to print the totals of each function as a table.
+
+        Returns
+        -------
+        None.
+
+        '''
+        print(f"{'function':<45}{'calls':>7}{'wall (s)':>11}{'cpu (s)':>11}{'in (MB)':>10}{'out (MB)':>10}{'peak (MB)':>11}")
+        for name, totals in self.get_summary().items():
+            print(f"{name:<45}{totals['calls']:>7}{totals['wall']:>11.4f}{totals['cpu']:>11.4f}"
+                  f"{totals['input_bytes']/2**20:>10.2f}{totals['output_bytes']/2**20:>10.2f}"
+                  f"{totals['peak_memory']/2**20:>11.2f}")
+
+    def save_json(self, output_file):
+        '''
+        A function to save the summary and every recorded call as JSON.
+
+        Parameters
+        ----------
+        output_file : string
+            Name of the .json file
+
+        Returns
+        -------
+        None.
+
+        '''
+        with open(output_file, 'w') as json_file:
+            json.dump({'summary': self.get_summary(), 'events': self.events}, json_file, indent = 1)
+
+    def save_chrome_trace(self, output_file):
+        '''
+        A function to save the recorded calls in the Chrome trace event format, with
+        one complete ('X') event per call and times in microseconds.
+
+        Parameters
+        ----------
+        output_file : string
+            Name of the .json file
+
+        Returns
+        -------
+        None.
+
+        '''
+        trace_events = []
+        for event in sorted(self.events, key = lambda event: event['start']):
+            arguments = {key: event[key] for key in ('cpu', 'input_bytes', 'output_bytes', 'peak_memory', 'net_memory')
+                         if key in event}
+            trace_events.append({'name': event['name'].rsplit('.', 1)[-1], 'cat': event['name'].rsplit('.', 1)[0],
+                                 'ph': 'X', 'ts': event['start']*1e6, 'dur': event['wall']*1e6,
+                                 'pid': os.getpid(), 'tid': event['thread'], 'args': arguments})
+        with open(output_file, 'w') as json_file:
+            json.dump({'traceEvents': trace_events, 'displayTimeUnit': 'ms'}, json_file)
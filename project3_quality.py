@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Quality
+This module finds the parts of a recording which are too corrupted to analyze, such
+as the motion artifacts and saturation in the wall-sit recording, so they can be
+skipped instead of producing false beats. It sits between filter_butter and
+detect_beats:
+    1. The recording is split into fixed windows and each window is scored by the
+       kurtosis of the raw signal (a clean ECG is peaky because of its QRS complexes),
+       the fraction of samples clipped at the ADC limits, the fraction of samples
+       which do not change (a flat line from a loose lead), and the fraction of its
+       power inside the filter's band.
+    2. Windows failing any score are masked, and detect_beats skips beats in them.
+    3. IBIs which span a masked window, fall outside a plausible range, or differ too
+       much from their neighbours (ectopic beats and missed or extra detections) are
+       marked invalid, and the IBI interpolation bridges over them.
+The scores of every window are computed together with running sums over the whole
+recording, so the stage takes one pass through the samples.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import numpy as np
+import project3_module as p3m
+
+# lowest and highest values of the 10-bit Arduino ADC, where a saturated signal clips
+adc_levels = (0, 1023)
+
+#%% Window scores
+# Create function to score the quality of each window of a recording
+def score_windows(raw_signal, filtered_signal, fs, window_duration = 2, clip_levels = None):
+    '''
+    A function to score the signal quality of fixed windows of a recording. The last
+    window may be shorter than the others.
+
+    Parameters
+    ----------
+    raw_signal : array of floats size (x,) where x is the number of samples
+        1D array containing the ecg voltage data before filtering
+    filtered_signal : array of floats size (x,)
+        The same data after filter_butter
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    window_duration : float, optional
+        Length of each window in seconds. The default is 2.
+    clip_levels : tuple of floats, optional
+        Lowest and highest value the ADC can record. The default is None, which uses
+        adc_levels.
+
+    Returns
+    -------
+    scores : dictionary
+        Arrays with one value per window:
+            window_start - first sample of the window
+            kurtosis     - excess kurtosis of the raw signal, 0 for Gaussian noise
+            clipping     - fraction of samples at the clip levels
+            flatline     - fraction of samples equal to the sample before them
+            power_ratio  - variance of the filtered signal over variance of the raw signal
+
+    '''
+    raw_signal = np.asarray(raw_signal, dtype = float)
+    filtered_signal = np.asarray(filtered_signal, dtype = float)
+    window_length = max(int(window_duration*fs), 2)
+    window_start = np.arange(0, len(raw_signal), window_length)
+    sample_count = np.diff(np.append(window_start, len(raw_signal)))
+    if clip_levels is None:
+        clip_levels = adc_levels
+
+    # sums of powers of the samples in each window, taken about the overall mean so they stay small
+    centered = raw_signal - np.mean(raw_signal)
+    sums = [np.add.reduceat(centered**power, window_start) for power in (1, 2, 3, 4)]
+    mean = sums[0] / sample_count
+    # central moments of each window from its raw moments
+    variance = sums[1]/sample_count - mean**2
+    fourth_moment = sums[3]/sample_count - 4*mean*sums[2]/sample_count + 6*mean**2*sums[1]/sample_count - 3*mean**4
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        kurtosis = np.where(variance > 0, fourth_moment / variance**2 - 3, 0)
+        filtered_mean = np.add.reduceat(filtered_signal, window_start) / sample_count
+        filtered_variance = np.add.reduceat(filtered_signal**2, window_start)/sample_count - filtered_mean**2
+        power_ratio = np.where(variance > 0, filtered_variance / variance, 0)
+
+    clipped = (raw_signal <= clip_levels[0]) | (raw_signal >= clip_levels[1])
+    clipping = np.add.reduceat(clipped, window_start) / sample_count
+    # a sample is flat when it equals the one before it, the first sample never is
+    flat = np.insert(np.diff(raw_signal) == 0, 0, False)
+    flatline = np.add.reduceat(flat, window_start) / sample_count
+
+    scores = {'window_start': window_start, 'kurtosis': kurtosis, 'clipping': clipping,
+              'flatline': flatline, 'power_ratio': power_ratio}
+    return scores
+
+# Create function to mask the samples of windows with poor quality
+def get_quality_mask(raw_signal, filtered_signal, fs, window_duration = 2, min_kurtosis = 0,
+                     max_clipping = 0.005, max_flatline = 0.8, min_power_ratio = 0.1, clip_levels = None):
+    '''
+    A function to mark the samples of every window which fails a quality score as bad.
+
+    Parameters
+    ----------
+    raw_signal : array of floats size (x,) where x is the number of samples
+        1D array containing the ecg voltage data before filtering
+    filtered_signal : array of floats size (x,)
+        The same data after filter_butter
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    window_duration : float, optional
+        Length of each window in seconds. The default is 2.
+    min_kurtosis : float, optional
+        Lowest excess kurtosis of a good window. The default is 0.
+    max_clipping : float, optional
+        Highest fraction of clipped samples in a good window. The default is 0.005.
+    max_flatline : float, optional
+        Highest fraction of unchanging samples in a good window. The default is 0.8.
+    min_power_ratio : float, optional
+        Lowest fraction of the power inside the filter band in a good window.
+        The default is 0.1.
+    clip_levels : tuple of floats, optional
+        Lowest and highest value the ADC can record. The default is None, which uses
+        adc_levels.
+
+    Returns
+    -------
+    mask : array of bools size (x,)
+        True for the samples in good windows, to pass to detect_beats
+    window_good : array of bools size (w,) where w is the # of windows
+        True for the good windows
+
+    '''
+    scores = score_windows(raw_signal, filtered_signal, fs, window_duration, clip_levels)
+    window_good = (scores['kurtosis'] >= min_kurtosis) & (scores['clipping'] <= max_clipping) \
+        & (scores['flatline'] <= max_flatline) & (scores['power_ratio'] >= min_power_ratio)
+    # give every sample the result of its window
+    window_length = np.diff(np.append(scores['window_start'], len(raw_signal)))
+    mask = np.repeat(window_good, window_length)
+    return mask, window_good
+
+#%% IBI filtering
+# Create function to find the IBIs which can be trusted
+def find_valid_ibis(beat_time, fs, mask = None, min_ibi = 0.3, max_ibi = 2, max_change = 0.2,
+                    neighbour_count = 5):
+    '''
+    A function to mark the IBIs which are plausible. An IBI is left out if it spans a
+    masked sample, since beats in the masked span were not detected; if it is shorter
+    than min_ibi or longer than max_ibi; or if it differs from the median of the
+    neighbour_count IBIs around it by more than max_change, which happens around
+    ectopic beats and missed or extra detections.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    mask : array of bools size (n,) where n is the number of samples, optional
+        True for the good samples, see get_quality_mask. The default is None.
+    min_ibi, max_ibi : float, optional
+        Shortest and longest plausible IBI in seconds. The defaults are 0.3 and 2.
+    max_change : float, optional
+        Largest fraction an IBI can differ from its neighbours' median. The default is 0.2.
+    neighbour_count : integer, optional
+        Odd number of IBIs the median is taken over. The default is 5.
+
+    Returns
+    -------
+    valid_ibis : Array of bools size (x-1,)
+        True for each valid IBI, to pass to calculate_ibis
+
+    '''
+    beat_time = np.asarray(beat_time, dtype = float)
+    ibi_values = np.diff(beat_time)
+    valid_ibis = (ibi_values >= min_ibi) & (ibi_values <= max_ibi)
+    if mask is not None:
+        # count the bad samples between the beats at the ends of each IBI
+        bad_count = np.concatenate(([0], np.cumsum(~mask)))
+        beat_locations = np.clip(np.round(beat_time*fs).astype(int), 0, len(mask))
+        valid_ibis &= bad_count[beat_locations[1:]] == bad_count[beat_locations[:-1]]
+    if len(ibi_values) >= neighbour_count:
+        # median of the IBIs around each IBI, repeating the end values at the edges
+        half_width = neighbour_count // 2
+        padded = np.pad(ibi_values, half_width, mode = 'edge')
+        neighbour_median = np.median(np.lib.stride_tricks.sliding_window_view(padded, neighbour_count), axis = -1)
+        valid_ibis &= np.abs(ibi_values - neighbour_median) <= max_change*neighbour_median
+    return valid_ibis
+
+#%% Quality-checked analysis
+# Create function to detect beats and find valid IBIs, skipping poor quality spans
+def detect_clean_beats(raw_signal, filtered_signal, threshold, fs, **quality_settings):
+    '''
+    A function to run the quality stage between filter_butter and calculate_ibis:
+    mask the poor quality windows, detect beats outside them, and mark the valid IBIs.
+
+    Parameters
+    ----------
+    raw_signal : array of floats size (x,) where x is the number of samples
+        1D array containing the ecg voltage data before filtering
+    filtered_signal : array of floats size (x,)
+        The same data after filter_butter
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    **quality_settings
+        Settings passed on to get_quality_mask, such as window_duration or max_clipping.
+
+    Returns
+    -------
+    beat_locations : Array of integers size (x,) where x is the # of beats detected
+        Samples of the beats in good windows
+    beat_time : Array of floats size (x,)
+        Times in seconds of those beats
+    valid_ibis : Array of bools size (x-1,)
+        True for each valid IBI, to pass to calculate_ibis
+    mask : array of bools size (n,) where n is the number of samples
+        True for the samples in good windows
+
+    '''
+    mask = get_quality_mask(raw_signal, filtered_signal, fs, **quality_settings)[0]
+    beat_locations, beat_time = p3m.detect_beats(filtered_signal, threshold, fs, mask)
+    valid_ibis = find_valid_ibis(beat_time, fs, mask)
+    return beat_locations, beat_time, valid_ibis, mask
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Recording
+This module stores ECG recordings in a compact binary .ecg file instead of text with
+one sample per line. The file starts with a header holding the sampling frequency,
+duration, number of samples and activity label. The samples follow in blocks of a fixed
+number of samples, stored as int16 or float32 and optionally compressed with zlib
+(compressed int16 blocks store the differences between neighbouring samples, which
+compress much better than the samples themselves). An index at the end of the file
+gives the position of every block, so any time window can be read by decoding only
+the blocks it overlaps. load_data in project3_module reads these files directly.
+
+File layout:
+    header - header_format, followed by the label in UTF-8
+    blocks - block_size samples each, the last one may be shorter
+    index  - one (offset, length) entry in bytes for every block
+
+Example:
+    python project3_recording.py "rest_data (1).txt" --fs 500 --label rest
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import argparse
+import os
+import struct
+import zlib
+import numpy as np
+import project3_module as p3m
+
+# extension of the binary recordings
+recording_extension = '.ecg'
+# first bytes of every recording file, which include the format version
+magic = b'P3ECG\x00\x01\x00'
+# magic, data type code, compression flag, sampling frequency, duration, sample count,
+# block size, label length and position of the block index
+header_format = '<8sBBddQIHQ'
+header_size = struct.calcsize(header_format)
+# data types that samples can be stored as, by their code in the header
+sample_dtypes = {0: np.dtype('<i2'), 1: np.dtype('<f4')}
+# one entry of the block index
+index_dtype = np.dtype([('offset', '<u8'), ('length', '<u4')])
+# number of samples in each block, about 8 seconds at 500 Hz
+default_block_size = 4096
+
+#%% Writing
+# Create function to get the name of the binary copy of a recording
+def get_recording_file(input_file):
+    '''
+    A function to get the name of the .ecg file which is stored next to a text
+    recording and holds the same samples.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt file containing the recording
+
+    Returns
+    -------
+    recording_file : string
+        Name of the .ecg file
+
+    '''
+    recording_file = os.path.splitext(input_file)[0] + recording_extension
+    return recording_file
+
+# Create function to encode one block of samples
+def encode_block(block, compress):
+    '''
+    A function to turn a block of samples into the bytes stored in the file.
+
+    Parameters
+    ----------
+    block : array size (x,) where x is at most the block size
+        Samples of the block, already in the stored data type
+    compress : bool
+        Whether to compress the block
+
+    Returns
+    -------
+    block_bytes : bytes
+        Encoded block
+
+    '''
+    if not compress:
+        return block.tobytes()
+    if block.dtype.kind == 'i':
+        # store the first sample and then the differences, which wrap around in int16
+        # and are undone exactly by a cumulative sum that wraps the same way
+        block = np.diff(block, prepend = block.dtype.type(0))
+    return zlib.compress(block.tobytes(), 6)
+
+# Create function to convert a text recording into a binary recording
+def convert_to_recording(input_file, fs, recording_file = None, label = '', dtype = np.int16,
+                         compress = True, block_size = default_block_size):
+    '''
+    A function to convert a text recording into a .ecg file. The text is parsed in
+    chunks and written one block at a time, so the recording is never held in memory.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt file to be converted
+    fs : float
+        The sampling frequency in Hz or 1/s
+    recording_file : string, optional
+        Name of the .ecg file to write. The default is None, which stores it next to
+        input_file with a .ecg extension.
+    label : string, optional
+        Activity recorded, such as 'rest'. The default is ''.
+    dtype : data type, optional
+        np.int16, which holds the 10-bit Arduino ADC values exactly, or np.float32 for
+        non-integer recordings. The default is np.int16.
+    compress : bool, optional
+        Whether to compress each block with zlib. The default is True.
+    block_size : integer, optional
+        Number of samples in each block. Smaller blocks make short windows cheaper to
+        read but compress less well. The default is default_block_size.
+
+    Raises
+    ------
+    ValueError
+        If dtype is not supported, a sample cannot be stored exactly as int16, or
+        the recording has more than one lead, as .ecg recordings hold a single lead.
+
+    Returns
+    -------
+    recording_file : string
+        Name of the .ecg file that was written
+
+    '''
+    dtype = np.dtype(dtype).newbyteorder('<')
+    dtype_codes = {stored: code for code, stored in sample_dtypes.items()}
+    if dtype not in dtype_codes:
+        raise ValueError(f'Samples can only be stored as int16 or float32, not {dtype}')
+    if recording_file is None:
+        recording_file = get_recording_file(input_file)
+    label_bytes = label.encode('utf-8')
+    sample_count = 0
+    index = []
+    # samples parsed but not yet written because they do not fill a block
+    pending = np.empty(0, dtype = dtype)
+    # write under a temporary name and rename it into place, so a recording which
+    # fails to convert never leaves a half-written file for load_data to read
+    temporary_file = recording_file + f'.{os.getpid()}.tmp'
+    try:
+        with open(input_file, 'r') as text_file, open(temporary_file, 'wb') as binary_file:
+            # leave room for the header, which is written once the sample count is known
+            binary_file.write(bytes(header_size) + label_bytes)
+            for chunk in p3m.iterate_text_chunks(text_file):
+                if chunk.ndim > 1:
+                    raise ValueError(f'{input_file} has {chunk.shape[1]} leads, but .ecg recordings hold a single lead; '
+                                     'use convert_to_sidecar to store a multi-lead recording')
+                if dtype.kind == 'i':
+                    limits = np.iinfo(dtype)
+                    if np.any(chunk != np.round(chunk)) or np.any(chunk < limits.min) or np.any(chunk > limits.max):
+                        raise ValueError(f'{input_file} has samples which are not int16 values, use dtype = np.float32')
+                pending = np.concatenate((pending, chunk.astype(dtype)))
+                sample_count += len(chunk)
+                # write every full block
+                block_count = len(pending) // block_size
+                for block_index in range(block_count):
+                    block_bytes = encode_block(pending[block_index*block_size:(block_index + 1)*block_size], compress)
+                    index.append((binary_file.tell(), len(block_bytes)))
+                    binary_file.write(block_bytes)
+                pending = pending[block_count*block_size:]
+            # write the last, shorter block
+            if len(pending) > 0:
+                block_bytes = encode_block(pending, compress)
+                index.append((binary_file.tell(), len(block_bytes)))
+                binary_file.write(block_bytes)
+            index_offset = binary_file.tell()
+            binary_file.write(np.array(index, dtype = index_dtype).tobytes())
+            # go back and fill in the header
+            binary_file.seek(0)
+            binary_file.write(struct.pack(header_format, magic, dtype_codes[dtype], int(compress), fs,
+                                          sample_count / fs, sample_count, block_size,
+                                          len(label_bytes), index_offset))
+        os.replace(temporary_file, recording_file)
+    finally:
+        if os.path.exists(temporary_file):
+            os.remove(temporary_file)
+    return recording_file
+
+#%% Reading
+# Create function to read the header of a binary recording
+def read_header(recording_file):
+    '''
+    A function to read the header and block index of a .ecg file.
+
+    Parameters
+    ----------
+    recording_file : string
+        Name of the .ecg file
+
+    Raises
+    ------
+    ValueError
+        If the file is not a .ecg recording of a supported version.
+
+    Returns
+    -------
+    header : dictionary
+        fs, duration, sample_count, label, dtype, compress and block_size of the
+        recording, and index, its array of (offset, length) block entries
+
+    '''
+    with open(recording_file, 'rb') as binary_file:
+        header_bytes = binary_file.read(header_size)
+        if len(header_bytes) < header_size:
+            raise ValueError(f'{recording_file} is too short to be a {recording_extension} recording')
+        fields = struct.unpack(header_format, header_bytes)
+        file_magic, dtype_code, compress, fs, duration, sample_count, block_size, label_length, index_offset = fields
+        if file_magic != magic or dtype_code not in sample_dtypes:
+            raise ValueError(f'{recording_file} is not a supported {recording_extension} recording')
+        label = binary_file.read(label_length).decode('utf-8')
+        block_count = -(-sample_count // block_size)
+        binary_file.seek(index_offset)
+        index = np.frombuffer(binary_file.read(block_count*index_dtype.itemsize), dtype = index_dtype)
+    header = {'fs': fs, 'duration': duration, 'sample_count': sample_count, 'label': label,
+              'dtype': sample_dtypes[dtype_code], 'compress': bool(compress),
+              'block_size': block_size, 'index': index}
+    return header
+
+# Create function to decode one block of samples
+def decode_block(block_bytes, dtype, compress):
+    '''
+    A function to turn the stored bytes of a block back into samples, undoing encode_block.
+
+    Parameters
+    ----------
+    block_bytes : bytes
+        Encoded block
+    dtype : data type
+        Data type the samples are stored as
+    compress : bool
+        Whether the block is compressed
+
+    Returns
+    -------
+    block : array size (x,) where x is at most the block size
+        Samples of the block
+
+    '''
+    if not compress:
+        return np.frombuffer(block_bytes, dtype = dtype)
+    block = np.frombuffer(zlib.decompress(block_bytes), dtype = dtype)
+    if dtype.kind == 'i':
+        block = np.cumsum(block, dtype = dtype)
+    return block
+
+# Create function to read a window of samples from a binary recording
+def read_window(recording_file, start_sample = 0, sample_count = None):
+    '''
+    A function to read a window of samples from a .ecg file. Only the blocks which
+    overlap the window are read from disk and decoded.
+
+    Parameters
+    ----------
+    recording_file : string
+        Name of the .ecg file
+    start_sample : integer, optional
+        Index of the first sample of the window. The default is 0.
+    sample_count : integer, optional
+        Number of samples in the window. The default is None, which reads to the end.
+
+    Returns
+    -------
+    samples : array of floats size (x,) where x is the number of samples in the window
+        1D array containing the samples, shorter than sample_count if the recording
+        ends inside the window
+
+    '''
+    header = read_header(recording_file)
+    block_size = header['block_size']
+    end_sample = header['sample_count']
+    if sample_count is not None:
+        end_sample = min(start_sample + sample_count, end_sample)
+    if end_sample <= start_sample:
+        return np.empty(0)
+    first_block = start_sample // block_size
+    last_block = (end_sample - 1) // block_size
+    samples = np.empty(end_sample - start_sample)
+    with open(recording_file, 'rb') as binary_file:
+        for block_index in range(first_block, last_block + 1):
+            offset, length = header['index'][block_index]
+            binary_file.seek(offset)
+            block = decode_block(binary_file.read(length), header['dtype'], header['compress'])
+            # copy the part of the block inside the window
+            block_start = block_index*block_size
+            window_start = max(start_sample, block_start)
+            window_end = min(end_sample, block_start + len(block))
+            samples[window_start - start_sample:window_end - start_sample] = \
+                block[window_start - block_start:window_end - block_start]
+    return samples
+
+#%% Conversion tool
+# Create function to run the conversion from the command line
+def main(argv = None):
+    '''
+    A function to parse the command line arguments and convert each text recording
+    into a .ecg file next to it.
+
+    Parameters
+    ----------
+    argv : list of strings, optional
+        Command line arguments. The default is None, which uses sys.argv.
+
+    Returns
+    -------
+    None.
+
+    '''
+    parser = argparse.ArgumentParser(description = 'Convert text ECG recordings into compact binary .ecg files.')
+    parser.add_argument('input_files', nargs = '+', help = 'text recordings with one sample per line')
+    parser.add_argument('--fs', type = float, default = 500, help = 'sampling frequency in Hz')
+    parser.add_argument('--label', default = '', help = 'activity recorded, such as rest')
+    parser.add_argument('--dtype', choices = ['int16', 'float32'], default = 'int16', help = 'data type the samples are stored as')
+    parser.add_argument('--no-compress', action = 'store_true', help = 'store the blocks uncompressed')
+    parser.add_argument('--block-size', type = int, default = default_block_size, help = 'samples in each block')
+    args = parser.parse_args(argv)
+
+    for input_file in args.input_files:
+        recording_file = convert_to_recording(input_file, args.fs, label = args.label, dtype = args.dtype,
+                                              compress = not args.no_compress, block_size = args.block_size)
+        print(f'{input_file}: {os.path.getsize(input_file)} bytes -> {recording_file}: {os.path.getsize(recording_file)} bytes')
+
+if __name__ == '__main__':
+    main()
@@ -19,23 +19,49 @@ affects the ANS.
 """
 
 # Import libraries
+import argparse
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy import fft
 import project3_module as p3m
+import project3_cache as p3c
+import project3_plotting as p3plt
+import project3_profiling as p3prof
 from scipy import signal
 
+# run with --profile to print the time, memory and calls of each function used
+parser = argparse.ArgumentParser(description = 'Analyze and plot the ECG recordings of the four activities.')
+parser.add_argument('--profile', action = 'store_true', help = 'print a breakdown of where the time goes')
+parser.add_argument('--profile-output', default = None, help = 'also save the profile as a Chrome trace .json file')
+#ignore arguments added by IPython or Spyder
+args, unknown_args = parser.parse_known_args()
+if args.profile:
+    tracer = p3prof.Tracer([p3m, p3c, p3plt])
+    tracer.start()
+
 #%% Part 1: Collect and Load Data
 # define values for duration, fs, and dt so that files can be clipped to 5 minutes
 duration = 300 #seconds data counted for (5minutes*60seconds)
 fs = 500 #sampling frequency for arduino
 dt = 1/fs
-
-#Call the load data function for each activity
-rest_data_file = p3m.load_data('rest_data (1).txt', duration, fs)
-relaxing_data_file = p3m.load_data('on_phone_data (1).txt', duration, fs)
-stress_rest_data_file = p3m.load_data('stressful_rest (1).txt', duration, fs)
-physical_data_file = p3m.load_data('wallsit_data (1).txt', duration, fs)
+threshold = 40 #voltage which identifies the QRS complex
+# spacing in seconds of the interpolated IBI timecourses
+ibi_dt = 0.1
+
+#Run every stage of the analysis for each activity. The results of each stage are
+#cached on disk, so running the script again only recomputes stages whose settings changed.
+#A profile bypasses the cache, so it shows the time of every stage rather than cache reads
+use_cache = not args.profile
+rest_results = p3c.run_cached_pipeline('rest_data (1).txt', duration, fs, threshold, ibi_dt, use_cache = use_cache)
+relaxing_results = p3c.run_cached_pipeline('on_phone_data (1).txt', duration, fs, threshold, ibi_dt, use_cache = use_cache)
+stress_rest_results = p3c.run_cached_pipeline('stressful_rest (1).txt', duration, fs, threshold, ibi_dt, use_cache = use_cache)
+physical_results = p3c.run_cached_pipeline('wallsit_data (1).txt', duration, fs, threshold, ibi_dt, use_cache = use_cache)
+
+#Get the loaded data for each activity
+rest_data_file = rest_results['data_file']
+relaxing_data_file = relaxing_results['data_file']
+stress_rest_data_file = stress_rest_results['data_file']
+physical_data_file = physical_results['data_file']
 
 #get time arrays for x-axis of plots
 #since all data files are the same length, this time variable can be used for all data.
@@ -103,18 +129,18 @@ plt.tight_layout(pad = 3) #add more space between plots
 plt.savefig('Concatenated Signal')    
 
 #%% Part 2: Filter Your Data
-# Call function to apply bandpass filter to each activity data file
-rest_data_filtered = p3m.filter_butter(rest_data_file)
-relaxing_data_filtered = p3m.filter_butter(relaxing_data_file)
-stress_rest_data_filtered = p3m.filter_butter(stress_rest_data_file)
-physical_data_filtered = p3m.filter_butter(physical_data_file)
+# Get each activity data file with the bandpass filter applied
+rest_data_filtered = rest_results['filtered_signal']
+relaxing_data_filtered = relaxing_results['filtered_signal']
+stress_rest_data_filtered = stress_rest_results['filtered_signal']
+physical_data_filtered = physical_results['filtered_signal']
 
 #Plot filter's impulse response and frequency response
 #create unit impulse using scipy function
 #input is the # of samples we want in the output, which is the length of time array
 unit_impulse = signal.unit_impulse(len(t)) 
 #get impulse response by sending unit impulse through filter
-impulse_response = p3m.filter_butter(unit_impulse)
+impulse_response = p3m.filter_butter(unit_impulse, fs)
 
 #plot impulse response
 plt.figure('Impulse & Frequency Response', clear = True)
@@ -180,45 +206,45 @@ plt.savefig('Rest ECG Data Filtered')
 # plot rest data with heartbeat times
 plt.figure('ECG Data with Heartbeat Times', clear = True)
 plt.subplot(4,1,1) #create subplot with 4 rows
-# call function to get rest heartbeat locations and heartbeat times, then plot them
-rest_heartbeat, rest_heartbeat_time = p3m.detect_beats(rest_data_filtered, 40, fs) #threshold = 40
+# get rest heartbeat locations and heartbeat times, then plot them
+rest_heartbeat, rest_heartbeat_time = rest_results['beat_locations'], rest_results['beat_time']
+p3plt.plot_beats(rest_data_filtered, rest_heartbeat, fs, xlim = (0,5)) #zoom in on 5 seconds
 plt.title('Restful Activity Filtered\n w/ Heartbeat Times')
-plt.xlim(0,5) #zoom in on 5 seconds
 plt.grid()
 
 #detect heart beats for relaxing activity
 plt.subplot(4,1,2)
-# call function to get relaxing heartbeat locations and heartbeat times, then plot them
-relaxing_heartbeat, relaxing_heartbeat_time = p3m.detect_beats(relaxing_data_filtered, 40, fs) #threshold = 40
+# get relaxing heartbeat locations and heartbeat times, then plot them
+relaxing_heartbeat, relaxing_heartbeat_time = relaxing_results['beat_locations'], relaxing_results['beat_time']
+p3plt.plot_beats(relaxing_data_filtered, relaxing_heartbeat, fs, xlim = (9,14)) #zoom in on 5 seconds
 plt.title('Relaxing Activity Filtered\n w/ Heartbeat Times')
-plt.xlim(9,14) #zoom in on 5 seconds
 plt.grid()
 
 #detect heart beats for stressful rest activity
 plt.subplot(4,1,3)
-# call function to get mental stress heartbeat locations and heartbeat times, then plot them
-stress_rest_heartbeat, stress_rest_heartbeat_time = p3m.detect_beats(stress_rest_data_filtered,40, fs) #threshold = 40
+# get mental stress heartbeat locations and heartbeat times, then plot them
+stress_rest_heartbeat, stress_rest_heartbeat_time = stress_rest_results['beat_locations'], stress_rest_results['beat_time']
+p3plt.plot_beats(stress_rest_data_filtered, stress_rest_heartbeat, fs, xlim = (0,5)) #zoom in on 5 seconds
 plt.title('Mentally Stressful Activity Filtered\n w/ Heartbeat Times')
-plt.xlim(0,5) #zoom in on 5 seconds
 plt.grid()
 
 # detect heart beats for physical activity
 plt.subplot(4,1,4)
-# call function to get physical stres heartbeat locations and heartbeat times, then plot them
-physical_heartbeat, physical_heartbeat_time = p3m.detect_beats(physical_data_filtered, 40, fs) #threshold = 40
+# get physical stres heartbeat locations and heartbeat times, then plot them
+physical_heartbeat, physical_heartbeat_time = physical_results['beat_locations'], physical_results['beat_time']
+p3plt.plot_beats(physical_data_filtered, physical_heartbeat, fs, xlim = (47,52)) #zoom in on 5 seconds
 plt.title('Physical Activity Filtered\n w/ Heartbeat Times')
-plt.xlim(47,52) #zoom in on 5 seconds
 plt.grid()
 #save figure
 plt.savefig('Filtered ECG Data with Heartbeats')
 
 
 #%% Part 4: Calculate Heart Rate Variability
-# call HRV values and interpolated ibi timecourses for all data (will only use HRV in this part)
-interpolated_rest, rest_hrv = p3m.calculate_ibis(rest_heartbeat, rest_heartbeat_time)
-interpolated_relaxing, relaxing_hrv = p3m.calculate_ibis(relaxing_heartbeat, relaxing_heartbeat_time)
-interpolated_stress_rest, stress_rest_hrv = p3m.calculate_ibis(stress_rest_heartbeat, stress_rest_heartbeat_time)
-interpolated_physical, physical_hrv = p3m.calculate_ibis(physical_heartbeat, physical_heartbeat_time)
+# get HRV values and interpolated ibi timecourses for all data (will only use HRV in this part)
+interpolated_rest, rest_hrv = rest_results['interpolated_ibi'], rest_results['hrv']
+interpolated_relaxing, relaxing_hrv = relaxing_results['interpolated_ibi'], relaxing_results['hrv']
+interpolated_stress_rest, stress_rest_hrv = stress_rest_results['interpolated_ibi'], stress_rest_results['hrv']
+interpolated_physical, physical_hrv = physical_results['interpolated_ibi'], physical_results['hrv']
 
 # Plot HRV measure for each activity in a bar graph (activity on x axis, HRV on y axis)
 x = np.array(['Rest', 'Relaxing', 'Mental Stress', 'Physical Activity'])
@@ -237,9 +263,9 @@ plt.savefig('HRV Bar Graph')
 plt.figure('FFT Spectrum', clear = True)
 # plot rest data
 plt.subplot(4,1,1) #create subplot with 4 rows
-#call function to plot frequency domain magnitude w/ LF & HF bands for rest data
-rest_frequency, rest_power, rest_low_frequency, rest_low_power, rest_high_frequency, rest_high_power = p3m.frequency_filter(interpolated_rest, dt)
-plt.ylim(0,0.25*(10**9))
+#get frequency domain magnitude w/ LF & HF bands for rest data
+rest_frequency, rest_power, rest_low_frequency, rest_low_power, rest_high_frequency, rest_high_power = (rest_results['frequency'], rest_results['power'], rest_results['low_freq'], rest_results['low_power'], rest_results['high_freq'], rest_results['high_power'])
+p3plt.plot_spectrum(rest_frequency, rest_power, rest_low_frequency, rest_low_power, rest_high_frequency, rest_high_power)
 plt.title('FFT Spectrum - Rest')
 plt.ylabel('Power (s^2/Hz)')
 plt.xlabel('Frequency(Hz)')
@@ -247,8 +273,9 @@ plt.tight_layout()
 
 #plot relaxing data
 plt.subplot(4,1,2)
-#call function to plot frequency domain magnitude w/ LF & HF bands for relaxing data
-relaxing_frequency, relaxing_power, relaxing_low_frequency, relaxing_low_power, relaxing_high_frequency, relaxing_high_power = p3m.frequency_filter(interpolated_relaxing, dt)
+#get frequency domain magnitude w/ LF & HF bands for relaxing data
+relaxing_frequency, relaxing_power, relaxing_low_frequency, relaxing_low_power, relaxing_high_frequency, relaxing_high_power = (relaxing_results['frequency'], relaxing_results['power'], relaxing_results['low_freq'], relaxing_results['low_power'], relaxing_results['high_freq'], relaxing_results['high_power'])
+p3plt.plot_spectrum(relaxing_frequency, relaxing_power, relaxing_low_frequency, relaxing_low_power, relaxing_high_frequency, relaxing_high_power)
 plt.title('FFT Spectrum - Relax')
 plt.ylabel('Power (s^2/Hz)')
 plt.xlabel('Frequency(Hz)')
@@ -256,9 +283,9 @@ plt.tight_layout()
 
 #plot mental stress data
 plt.subplot(4,1,3)
-#call function to plot frequency domain magnitude w/ LF & HF bands for mental stress data
-stress_rest_frequency, stress_rest_power, stress_rest_low_frequency, stress_rest_low_power, stress_rest_high_frequency, stress_rest_high_power = p3m.frequency_filter(interpolated_stress_rest, dt)
-plt.ylim(0,0.25*(10**8))
+#get frequency domain magnitude w/ LF & HF bands for mental stress data
+stress_rest_frequency, stress_rest_power, stress_rest_low_frequency, stress_rest_low_power, stress_rest_high_frequency, stress_rest_high_power = (stress_rest_results['frequency'], stress_rest_results['power'], stress_rest_results['low_freq'], stress_rest_results['low_power'], stress_rest_results['high_freq'], stress_rest_results['high_power'])
+p3plt.plot_spectrum(stress_rest_frequency, stress_rest_power, stress_rest_low_frequency, stress_rest_low_power, stress_rest_high_frequency, stress_rest_high_power)
 plt.title('FFT Spectrum - Stress Rest')
 plt.ylabel('Power (s^2/Hz)')
 plt.xlabel('Frequency(Hz)')
@@ -266,9 +293,9 @@ plt.tight_layout()
 
 #plot physical stress data
 plt.subplot(4,1,4)
-#call function to plot frequency domain magnitude w/ LF & HF bands for physical stress data
-physical_frequency, physical_power, physical_low_frequency, physical_low_power, physical_high_frequency, physical_high_power = p3m.frequency_filter(interpolated_physical, dt)
-plt.ylim(0,1*(10**9))
+#get frequency domain magnitude w/ LF & HF bands for physical stress data
+physical_frequency, physical_power, physical_low_frequency, physical_low_power, physical_high_frequency, physical_high_power = (physical_results['frequency'], physical_results['power'], physical_results['low_freq'], physical_results['low_power'], physical_results['high_freq'], physical_results['high_power'])
+p3plt.plot_spectrum(physical_frequency, physical_power, physical_low_frequency, physical_low_power, physical_high_frequency, physical_high_power)
 plt.title('FFT Spectrum - Physical Stress')
 plt.ylabel('Power (s^2/Hz)')
 plt.xlabel('Frequency(Hz)')
@@ -277,11 +304,11 @@ plt.tight_layout()
 plt.savefig('FFT Spectrum')
 
 # Plot ratios of LF/HF in a bar graph
-# call function to retrieve ratios of mean LF/HF for each activity
-rest_ratio = p3m.extract_mean_power(rest_low_power, rest_high_power)
-relaxing_ratio = p3m.extract_mean_power(relaxing_low_power, relaxing_high_power)
-stress_rest_ratio = p3m.extract_mean_power(stress_rest_low_power, stress_rest_high_power)
-physical_ratio = p3m.extract_mean_power(physical_low_power, physical_high_power)
+# retrieve ratios of mean LF/HF for each activity
+rest_ratio = rest_results['ratio']
+relaxing_ratio = relaxing_results['ratio']
+stress_rest_ratio = stress_rest_results['ratio']
+physical_ratio = physical_results['ratio']
 
 #plot hrv ratios on bar graph
 x = np.array(['Rest', 'Relaxing', 'Mental Stress', 'Physical Activity'])
@@ -293,5 +320,10 @@ plt.title('LF/HF Ratio for various activities')
 #Save figure
 plt.savefig('HRV Ratio Bar Graph')
 
-
-
+#%% Profile
+# print where the time went when run with --profile
+if args.profile:
+    tracer.stop()
+    tracer.print_summary()
+    if args.profile_output is not None:
+        tracer.save_chrome_trace(args.profile_output)
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Spectral
+This module estimates the power spectral density (PSD) of an IBI timecourse in three
+ways which all share the same inputs and outputs, so their cost and variance can be
+compared directly:
+    fft   - a single periodogram of the interpolated IBIs, as in frequency_filter
+    welch - Welch's method, averaging windowed periodograms of overlapping segments,
+            which gives a steadier estimate for less work
+    lomb  - the Lomb-Scargle periodogram, computed directly on the uneven beat times
+            so the IBIs never need to be interpolated
+The power in each HRV frequency band is then found by integrating the PSD over the band.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import numpy as np
+from scipy import signal as sps
+import project3_module as p3m
+
+# HRV frequency bands in Hz, each band includes its low edge but not its high edge, so
+# band_power never counts a frequency in two bands; the LF/HF ratio of project3_module
+# averages the bands of project3_module.ratio_bands instead, which include both edges
+frequency_bands = {
+    'vlf': (0.0033, 0.04),
+    'lf': (0.04, 0.15),
+    'hf': (0.15, 0.4),
+}
+
+#%% Spectral estimates
+# Create function to estimate the PSD with a single periodogram
+def spectrum_fft(beat_time, dt = 0.1, interpolation = 'linear', valid_ibis = None):
+    '''
+    A function to estimate the PSD of the IBI timecourse with one periodogram of the
+    whole interpolated series, the same estimate frequency_filter makes but scaled
+    to units of s^2/Hz.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    interpolation : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+    valid_ibis : Array of bools size (x-1,), optional
+        True for each IBI to use, see interpolate_ibis. The default is None, which
+        uses every IBI.
+
+    Returns
+    -------
+    frequency : Array of floats size (f,) where f is the # of frequencies
+        Evenly spaced frequencies in Hz
+    power : Array of floats size (f,)
+        Power spectral density in s^2/Hz at each frequency
+
+    '''
+    interpolated_ibi = p3m.resample_ibis(beat_time, dt, interpolation, valid_ibis)[1]
+    frequency, power = sps.periodogram(interpolated_ibi, fs = 1/dt, detrend = 'constant')
+    return frequency, power
+
+# Create function to estimate the PSD with Welch's method
+def spectrum_welch(beat_time, dt = 0.1, segment_duration = 120, overlap = 0.5,
+                   interpolation = 'linear', valid_ibis = None):
+    '''
+    A function to estimate the PSD of the IBI timecourse with Welch's method: the
+    interpolated series is split into overlapping segments, each segment is windowed
+    and transformed, and the periodograms are averaged.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    segment_duration : float, optional
+        Length of each segment in seconds. Segments must be long enough to resolve
+        the LF band, so at least 50 s. The default is 120.
+    overlap : float, optional
+        Fraction of each segment shared with the next. The default is 0.5.
+    interpolation : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+    valid_ibis : Array of bools size (x-1,), optional
+        True for each IBI to use, see interpolate_ibis. The default is None, which
+        uses every IBI.
+
+    Returns
+    -------
+    frequency : Array of floats size (f,) where f is the # of frequencies
+        Evenly spaced frequencies in Hz
+    power : Array of floats size (f,)
+        Power spectral density in s^2/Hz at each frequency
+
+    '''
+    interpolated_ibi = p3m.resample_ibis(beat_time, dt, interpolation, valid_ibis)[1]
+    # use one segment when the series is shorter than segment_duration
+    segment_length = min(int(segment_duration / dt), len(interpolated_ibi))
+    frequency, power = sps.welch(interpolated_ibi, fs = 1/dt, nperseg = segment_length,
+                                 noverlap = int(overlap*segment_length), detrend = 'constant')
+    return frequency, power
+
+# Create function to estimate the PSD with the Lomb-Scargle periodogram
+def spectrum_lomb(beat_time, max_frequency = 0.5, oversample = 4, valid_ibis = None):
+    '''
+    A function to estimate the PSD of the IBIs with the Lomb-Scargle periodogram,
+    which fits sinusoids directly to the IBIs at the uneven beat times, so no
+    interpolation is needed. The result is scaled so that, like the other methods,
+    integrating it over frequency gives the variance of the IBIs.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    max_frequency : float, optional
+        Highest frequency in Hz to evaluate. The default is 0.5.
+    oversample : integer, optional
+        Number of frequencies per 1/duration Hz. The default is 4.
+    valid_ibis : Array of bools size (x-1,), optional
+        True for each IBI to use, the others are left out of the fit. The default is
+        None, which uses every IBI.
+
+    Raises
+    ------
+    ValueError
+        If fewer than two IBIs are left to fit.
+
+    Returns
+    -------
+    frequency : Array of floats size (f,) where f is the # of frequencies
+        Evenly spaced frequencies in Hz, starting above 0
+    power : Array of floats size (f,)
+        Power spectral density in s^2/Hz at each frequency
+
+    '''
+    ibi_values = np.diff(beat_time)
+    ibi_time = beat_time[1:]
+    if valid_ibis is not None:
+        ibi_values = ibi_values[valid_ibis]
+        ibi_time = ibi_time[valid_ibis]
+    if len(ibi_values) < 2:
+        raise ValueError(f'The Lomb-Scargle periodogram needs at least two valid IBIs, got {len(ibi_values)}')
+    duration = ibi_time[-1] - ibi_time[0]
+    # frequency spacing finer than the 1/duration resolution of the recording
+    frequency_step = 1 / (duration*oversample)
+    frequency = np.arange(frequency_step, max_frequency, frequency_step)
+    # a single frequency gives a 0-d result, so keep it an array like frequency
+    periodogram = np.atleast_1d(sps.lombscargle(ibi_time, ibi_values - np.mean(ibi_values), 2*np.pi*frequency))
+    # a sinusoid of amplitude A gives a peak of A^2*N/4 about 1/duration Hz wide,
+    # scale it so the area under the peak is its variance A^2/2
+    power = periodogram * 2*duration / len(ibi_values)
+    return frequency, power
+
+# spectral estimates which can be selected by name in estimate_spectrum
+spectral_methods = {
+    'fft': spectrum_fft,
+    'welch': spectrum_welch,
+    'lomb': spectrum_lomb,
+}
+
+# Create function to run a spectral estimate chosen by name
+def estimate_spectrum(beat_time, method = 'welch', **kwargs):
+    '''
+    A function to estimate the PSD of the IBIs with one of the spectral_methods.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    method : string, optional
+        'fft', 'welch' or 'lomb'. The default is 'welch'.
+    **kwargs
+        Settings passed on to the method, such as dt or segment_duration.
+
+    Returns
+    -------
+    frequency : Array of floats size (f,) where f is the # of frequencies
+        Evenly spaced frequencies in Hz
+    power : Array of floats size (f,)
+        Power spectral density in s^2/Hz at each frequency
+
+    '''
+    if method not in spectral_methods:
+        raise ValueError(f"Unknown spectral method '{method}', choose from {sorted(spectral_methods)}")
+    return spectral_methods[method](np.asarray(beat_time, dtype = float), **kwargs)
+
+#%% Band power
+# Create function to integrate a PSD over a frequency band
+def band_power(frequency, power, band):
+    '''
+    A function to integrate a PSD over a frequency band. Every frequency is treated
+    as the centre of a bin one frequency step wide, and the band includes its low
+    edge but not its high edge, so neighbouring bands never count the same bin twice.
+
+    Parameters
+    ----------
+    frequency : Array of floats size (f,)
+        Evenly spaced frequencies in Hz
+    power : Array of floats size (f,)
+        Power spectral density in s^2/Hz at each frequency
+    band : tuple of floats
+        Low and high edge of the band in Hz
+
+    Returns
+    -------
+    power_in_band : float
+        Power in the band in s^2
+
+    '''
+    frequency_step = frequency[1] - frequency[0]
+    in_band = (frequency >= band[0]) & (frequency < band[1])
+    power_in_band = np.sum(power[in_band]) * frequency_step
+    return power_in_band
+
+# Create function to calculate the power in every HRV band and the LF/HF ratio
+def calculate_band_powers(beat_time, method = 'welch', bands = None, **kwargs):
+    '''
+    A function to estimate the PSD of the IBIs and integrate it over each HRV band.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    method : string, optional
+        'fft', 'welch' or 'lomb'. The default is 'welch'.
+    bands : dictionary, optional
+        Band names and (low, high) edges in Hz. The default is None, which uses
+        frequency_bands.
+    **kwargs
+        Settings passed on to the spectral method.
+
+    Returns
+    -------
+    powers : dictionary
+        Power in s^2 of each band, and 'lf_hf', the ratio of LF to HF power
+        when both bands are present.
+
+    '''
+    if bands is None:
+        bands = frequency_bands
+    frequency, power = estimate_spectrum(beat_time, method, **kwargs)
+    powers = {name: band_power(frequency, power, band) for name, band in bands.items()}
+    if 'lf' in powers and 'hf' in powers:
+        powers['lf_hf'] = powers['lf'] / powers['hf']
+    return powers
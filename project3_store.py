@@ -0,0 +1,428 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Store
+This module keeps the HRV results of many recordings in one SQLite database, so the
+activities of thousands of sessions can be compared without keeping any variables
+around. Each row holds the results of one recording, or of one window of it: its
+recording id, activity label, window start and end, the settings it was analyzed with,
+the HRV and LF/HF ratio from project3_module and every metric from project3_metrics.
+
+Rows are added to a ResultsStore in batches, each written in one transaction, which
+is far faster than a transaction per row. The label and recording id columns are
+indexed, so selecting one activity or one recording does not scan the whole table.
+Queries return NumPy structured arrays, and summarize aggregates a metric by activity
+inside the database. Adding a recording again with the same settings replaces the
+rows stored for it before.
+
+Example:
+    python project3_store.py add "rest_data (1).txt" --label Rest --window 60
+    python project3_store.py summary hrv lf_hf
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import argparse
+import os
+import sqlite3
+import numpy as np
+import project3_module as p3m
+import project3_metrics as p3metrics
+
+# default database file
+default_store_file = 'hrv_results.sqlite'
+
+# columns which identify a row and the settings it was analyzed with
+key_columns = [('recording_id', 'TEXT', object), ('label', 'TEXT', object), ('window_start', 'REAL', float),
+               ('window_end', 'REAL', float), ('fs', 'REAL', float), ('threshold', 'REAL', float),
+               ('dt', 'REAL', float)]
+# columns of results, the HRV and LF/HF ratio of project3_module and then every metric
+metric_columns = [('hrv', float), ('ratio', float)] + p3metrics.metrics_dtype
+# every column, in table order
+column_names = [column[0] for column in key_columns + metric_columns]
+
+#%% Store
+class ResultsStore:
+    '''
+    A class which appends results to and queries a SQLite results database. Rows
+    added with append are kept until batch_size of them are waiting, then written
+    together; call flush, or use the store in a with block, to write the rest.
+
+    Parameters
+    ----------
+    store_file : string, optional
+        Name of the database file, created if needed. The default is default_store_file.
+    batch_size : integer, optional
+        Number of rows written in each transaction. The default is 1000.
+
+    '''
+    def __init__(self, store_file = default_store_file, batch_size = 1000):
+        self.store_file = store_file
+        self.batch_size = batch_size
+        self.pending = []
+        self.connection = sqlite3.connect(store_file)
+        # write ahead logging lets queries run while rows are appended
+        self.connection.execute('PRAGMA journal_mode = WAL')
+        self.connection.execute('PRAGMA synchronous = NORMAL')
+        columns = [f'{column[0]} {column[1]}' for column in key_columns] + \
+            [f"{name} {'INTEGER' if dtype is int else 'REAL'}" for name, dtype in metric_columns]
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS results ({', '.join(columns)})")
+            self.connection.execute('CREATE INDEX IF NOT EXISTS results_label ON results (label)')
+            self.connection.execute('CREATE INDEX IF NOT EXISTS results_recording ON results (recording_id, window_start)')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def append(self, recording_id, label, results, window = (0, np.nan), fs = np.nan, threshold = np.nan, dt = np.nan):
+        '''
+        A function to add the results of one recording or window.
+
+        Parameters
+        ----------
+        recording_id : string
+            Name of the recording, such as its file name
+        label : string
+            Activity of the recording, such as 'Rest'
+        results : dictionary or numpy.void
+            Results by column name, such as a record from calculate_metrics with hrv
+            and ratio added. Missing columns are stored as NULL. A new row is always
+            added, even if a row with the same recording id and settings is stored;
+            use delete first, as store_recording does, to replace it.
+        window : tuple of floats, optional
+            Start and end of the window in seconds. The default is (0, nan), the
+            whole recording.
+        fs, threshold, dt : float, optional
+            Settings the results were calculated with. The defaults are nan.
+
+        Returns
+        -------
+        None.
+
+        '''
+        names = results.dtype.names if isinstance(results, np.void) else results.keys()
+        row = [recording_id, label, window[0], window[1], fs, threshold, dt]
+        for name in [column[0] for column in metric_columns]:
+            value = results[name] if name in names else None
+            # sqlite3 only takes Python numbers
+            row.append(value.item() if isinstance(value, np.generic) else value)
+        self.pending.append(row)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''
+        A function to write the waiting rows in one transaction.
+
+        Returns
+        -------
+        None.
+
+        '''
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(f"INSERT INTO results VALUES ({', '.join('?'*len(column_names))})", self.pending)
+        self.pending = []
+
+    def close(self):
+        '''
+        A function to write the waiting rows and close the database.
+
+        Returns
+        -------
+        None.
+
+        '''
+        self.flush()
+        self.connection.close()
+
+    def delete(self, **filters):
+        '''
+        A function to delete rows of the results table, including rows still waiting
+        to be written.
+
+        Parameters
+        ----------
+        **filters
+            Values to match, see select. With no filters every row is deleted.
+
+        Returns
+        -------
+        row_count : integer
+            Number of rows deleted
+
+        '''
+        self.flush()
+        clause, values = self.get_filter(filters)
+        with self.connection:
+            row_count = self.connection.execute(f'DELETE FROM results{clause}', values).rowcount
+        return row_count
+
+    def get_filter(self, filters):
+        '''
+        A function to turn column values to match into an SQL WHERE clause.
+
+        Parameters
+        ----------
+        filters : dictionary
+            Value to match for each column; a list or tuple matches any of its values
+
+        Raises
+        ------
+        ValueError
+            If a column does not exist.
+
+        Returns
+        -------
+        clause : string
+            WHERE clause, empty if there are no filters
+        values : list
+            Values of the clause's placeholders
+
+        '''
+        conditions = []
+        values = []
+        for name, value in filters.items():
+            check_columns([name])
+            if isinstance(value, (list, tuple)):
+                conditions.append(f"{name} IN ({', '.join('?'*len(value))})")
+                values.extend(value)
+            else:
+                conditions.append(f'{name} = ?')
+                values.append(value)
+        clause = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        return clause, values
+
+    def select(self, columns = None, **filters):
+        '''
+        A function to read rows of the results table.
+
+        Parameters
+        ----------
+        columns : list of strings, optional
+            Columns to read. The default is None, which reads every column.
+        **filters
+            Values to match, such as label = 'Rest' or recording_id = ['a.txt', 'b.txt'].
+
+        Returns
+        -------
+        rows : structured array size (n,) where n is the # of matching rows
+            One record per row, NULL values read as nan
+
+        '''
+        self.flush()
+        columns = column_names if columns is None else list(columns)
+        check_columns(columns)
+        clause, values = self.get_filter(filters)
+        cursor = self.connection.execute(f"SELECT {', '.join(columns)} FROM results{clause}", values)
+        dtypes = dict([(column[0], column[2]) for column in key_columns] + metric_columns)
+        # integer columns may hold NULL, so every number is read as a float
+        rows = np.array([tuple(np.nan if value is None else value for value in row) for row in cursor],
+                        dtype = [(name, dtypes[name] if dtypes[name] is object else float) for name in columns])
+        return rows
+
+    def summarize(self, metric, group_by = 'label', **filters):
+        '''
+        A function to aggregate a metric over the rows of each group, such as each
+        activity, inside the database. Rows where the metric is NULL are left out.
+
+        Parameters
+        ----------
+        metric : string
+            Column to aggregate, such as 'hrv' or 'lf_hf'
+        group_by : string, optional
+            Column to group rows by. The default is 'label'.
+        **filters
+            Values to match, see select.
+
+        Returns
+        -------
+        summary : structured array size (g,) where g is the # of groups
+            For each group, its value and the count, mean, standard deviation, minimum
+            and maximum of the metric
+
+        '''
+        self.flush()
+        check_columns([metric, group_by])
+        clause, values = self.get_filter(filters)
+        cursor = self.connection.execute(
+            f'SELECT {group_by}, COUNT({metric}), AVG({metric}), AVG({metric}*{metric}), MIN({metric}), MAX({metric}) '
+            f'FROM results{clause} GROUP BY {group_by} ORDER BY {group_by}', values)
+        rows = []
+        for group, count, mean, square_mean, minimum, maximum in cursor:
+            if count == 0:
+                rows.append((group, 0, np.nan, np.nan, np.nan, np.nan))
+                continue
+            # sample standard deviation from the mean and mean square
+            variance = max(square_mean - mean**2, 0) * count / (count - 1) if count > 1 else np.nan
+            rows.append((group, count, mean, np.sqrt(variance), minimum, maximum))
+        summary = np.array(rows, dtype = [(group_by, object), ('count', int), ('mean', float), ('std', float),
+                                          ('min', float), ('max', float)])
+        return summary
+
+    def export_parquet(self, output_file, **filters):
+        '''
+        A function to write rows of the results table to a parquet file for columnar
+        analysis tools. This needs pyarrow to be installed.
+
+        Parameters
+        ----------
+        output_file : string
+            Name of the .parquet file
+        **filters
+            Values to match, see select.
+
+        Returns
+        -------
+        None.
+
+        '''
+        # pyarrow is only needed for parquet output, so import it here
+        import pyarrow
+        import pyarrow.parquet
+        rows = self.select(**filters)
+        table = pyarrow.table({name: rows[name].tolist() for name in rows.dtype.names})
+        pyarrow.parquet.write_table(table, output_file)
+
+# Create function to check that column names exist
+def check_columns(columns):
+    '''
+    A function to check names of columns before they are put into a query.
+
+    Parameters
+    ----------
+    columns : list of strings
+        Names of columns
+
+    Raises
+    ------
+    ValueError
+        If a name is not in column_names.
+
+    Returns
+    -------
+    None.
+
+    '''
+    unknown = [name for name in columns if name not in column_names]
+    if unknown:
+        raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+
+#%% Filling the store
+# Create function to calculate and store the results of a recording and its windows
+def store_recording(store, input_file, label, duration, fs, threshold, dt = 0.1, window_duration = None,
+                    recording_id = None):
+    '''
+    A function to analyze a recording and append its results to a store, either
+    once for the whole recording or once for each window of it. Rows stored earlier
+    for the same recording id, fs, threshold and dt are deleted first, so adding a
+    recording again with the same settings replaces its rows rather than repeating
+    them, while adding it with other settings keeps both.
+
+    Parameters
+    ----------
+    store : ResultsStore
+        Store to append to
+    input_file : string
+        Name of the txt, .ecg or .npy file to analyze
+    label : string
+        Activity of the recording
+    duration : integer
+        The time in seconds that the data should be collected for
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    window_duration : float, optional
+        Length in seconds of each window. The default is None, which stores one row
+        for the whole recording.
+    recording_id : string, optional
+        Name the rows are stored under. The default is None, which uses input_file.
+
+    Returns
+    -------
+    row_count : integer
+        Number of rows appended
+
+    '''
+    if recording_id is None:
+        recording_id = input_file
+    data_file = p3m.load_data(input_file, duration, fs)
+    filtered_signal = p3m.filter_butter(data_file, fs)
+    beat_locations, beat_time = p3m.detect_beats(filtered_signal, threshold, fs)
+    store.delete(recording_id = recording_id, fs = fs, threshold = threshold, dt = dt)
+    recording_duration = len(data_file) / fs
+    if window_duration is None:
+        window_duration = recording_duration
+    window_starts = np.arange(0, recording_duration, window_duration)
+    for window_start in window_starts:
+        window_end = min(window_start + window_duration, recording_duration)
+        in_window = (beat_time >= window_start) & (beat_time < window_end)
+        results = p3metrics.calculate_metrics(beat_time[in_window])
+        results = dict(zip(results.dtype.names, results.tolist()), hrv = np.nan, ratio = np.nan)
+        if np.sum(in_window) >= 3:
+            interpolated_ibi, results['hrv'] = p3m.calculate_ibis(beat_locations[in_window], beat_time[in_window], dt)
+            frequency, power, low_freq, low_power, high_freq, high_power = p3m.frequency_filter(interpolated_ibi, dt)
+            results['ratio'] = p3m.extract_mean_power(low_power, high_power)
+        store.append(recording_id, label, results, (window_start, window_end), fs, threshold, dt)
+    return len(window_starts)
+
+#%% Command line
+# Create function to run the command line tool
+def main(argv = None):
+    '''
+    A function to parse the command line arguments and add recordings to a store,
+    print a summary of metrics by activity, or export the store to parquet.
+
+    Parameters
+    ----------
+    argv : list of strings, optional
+        Command line arguments. The default is None, which uses sys.argv.
+
+    Returns
+    -------
+    None.
+
+    '''
+    parser = argparse.ArgumentParser(description = 'Store and compare the HRV results of many recordings.')
+    parser.add_argument('--store', default = default_store_file, help = 'SQLite results database')
+    commands = parser.add_subparsers(dest = 'command', required = True)
+    add_parser = commands.add_parser('add', help = 'analyze recordings and store their results')
+    add_parser.add_argument('input_files', nargs = '+', help = 'txt, .ecg or .npy recordings')
+    add_parser.add_argument('--label', required = True, help = 'activity of the recordings')
+    add_parser.add_argument('--duration', type = int, default = 300, help = 'seconds of data to analyze')
+    add_parser.add_argument('--fs', type = int, default = 500, help = 'sampling frequency in Hz')
+    add_parser.add_argument('--threshold', type = float, default = 40, help = 'beat detection threshold')
+    add_parser.add_argument('--dt', type = float, default = 0.1, help = 'spacing of the interpolated IBIs in seconds')
+    add_parser.add_argument('--window', type = float, default = None, help = 'store results for windows of this many seconds')
+    summary_parser = commands.add_parser('summary', help = 'print metrics by activity')
+    summary_parser.add_argument('metrics', nargs = '+', help = 'columns to summarize, such as hrv or lf_hf')
+    summary_parser.add_argument('--group-by', default = 'label', help = 'column to group by')
+    export_parser = commands.add_parser('export', help = 'write the results to a parquet file')
+    export_parser.add_argument('output_file', help = 'name of the .parquet file')
+    args = parser.parse_args(argv)
+
+    with ResultsStore(args.store) as store:
+        if args.command == 'add':
+            for input_file in args.input_files:
+                row_count = store_recording(store, input_file, args.label, args.duration, args.fs, args.threshold,
+                                            args.dt, args.window, os.path.basename(input_file))
+                print(f'{input_file}: {row_count} rows')
+        elif args.command == 'summary':
+            for metric in args.metrics:
+                print(f"{metric:<20}{'count':>8}{'mean':>12}{'std':>12}{'min':>12}{'max':>12}")
+                for row in store.summarize(metric, args.group_by):
+                    print(f"{str(row[args.group_by]):<20}{row['count']:>8}{row['mean']:>12.4g}{row['std']:>12.4g}"
+                          f"{row['min']:>12.4g}{row['max']:>12.4g}")
+        else:
+            store.export_parquet(args.output_file)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Streaming
+This module processes ECG data in blocks as it arrives from the Arduino (for example
+250 samples at a time at 500 Hz) instead of in batch on a finished recording. The
+forward pass of the bandpass filter is applied causally with its state kept between
+blocks, and the backward pass is run over the last few seconds of samples, so the
+filtered signal matches the zero-phase output of filter_butter which the threshold
+of detect_beats was tuned on. Heartbeats are emitted once that look-ahead has passed,
+a refractory period removes double crossings, and the HRV and LF/HF ratio are
+updated over a rolling window of the most recent beats. Only the look-ahead and the
+rolling window are kept in memory, so the time and memory needed for each block stay
+bounded however long the recording runs.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+from collections import deque
+import numpy as np
+from scipy import fft
+from scipy import signal as sps
+import project3_detectors as p3d
+import project3_module as p3m
+
+#%% Streaming filter and beat detector
+class StreamingProcessor:
+    '''
+    A class which keeps the filter state, threshold state and recent beat times
+    needed to process an ECG signal one block at a time.
+
+    Parameters
+    ----------
+    threshold : float
+        Specified value to identify the QRS wave complex, as in detect_beats.
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    lowcut : float, optional
+        Low cutoff frequency of the bandpass filter in Hz. The default is 0.5.
+    highcut : float, optional
+        High cutoff frequency of the bandpass filter in Hz. The default is 2.5.
+    order : integer, optional
+        Order of the butterworth filter. The default is 2.
+    window_duration : float, optional
+        Length in seconds of the rolling window used for HRV and LF/HF. The default is 60.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBI timecourse. The default is 0.1.
+    lookahead : float, optional
+        Time in seconds of samples the backward pass of the filter runs over before
+        a sample is emitted, which is also the delay before a beat is reported. The
+        output matches filter_butter to within a few percent of the threshold from
+        about 3 seconds; shorter look-aheads give a lower latency but more spurious
+        crossings. The default is 3.
+    refractory : float, optional
+        Shortest allowed time in seconds between beats, see
+        project3_detectors.apply_refractory_period. The default is 0.25 (240 bpm).
+
+    '''
+    def __init__(self, threshold, fs, lowcut = 0.5, highcut = 2.5, order = 2,
+                 window_duration = 60, dt = 0.1, lookahead = 3, refractory = 0.25):
+        self.threshold = threshold
+        self.fs = fs
+        self.window_duration = window_duration
+        self.dt = dt
+        self.lookahead_count = int(lookahead*fs)
+        self.refractory = refractory
+        # second-order sections of the bandpass filter, shared with filter_butter
+        self.sos = p3m.design_filter(lowcut, highcut, order, fs)
+        # filter state, set from the first sample so the filter starts without a step
+        self.zi = None
+        # output of the forward pass which has not been emitted yet, at most one
+        # block longer than the look-ahead
+        self.forward_signal = np.empty(0)
+        # whether the last emitted sample was above the threshold
+        self.previous_above = False
+        # sample index of the last beat, so the refractory period spans blocks
+        self.last_beat = None
+        #number of samples processed and emitted so far, used to give beats absolute sample indices
+        self.sample_count = 0
+        self.emitted_count = 0
+        # times of the beats inside the rolling window
+        self.recent_beat_times = deque()
+
+    def process_block(self, samples):
+        '''
+        A function to filter a block of samples, detect the beats in the samples
+        which have passed the look-ahead, and update the rolling HRV and LF/HF ratio.
+
+        Parameters
+        ----------
+        samples : array of floats size (x,) where x is the number of samples in the block
+            1D array containing the next block of ecg voltage data
+
+        Returns
+        -------
+        beat_locations : Array of integers size (x,) where x is the # of beats detected
+            Sample indices, counted from the start of the stream, of the beats found
+            in the emitted samples.
+        beat_time : Array of floats size (x,) where x is the # of beats detected
+            Times in seconds, counted from the start of the stream, of the beats found
+            in the emitted samples.
+        hrv : float
+            Standard deviation of the interpolated IBIs in the rolling window,
+            nan until there are enough beats.
+        ratio : float
+            LF/HF ratio of the rolling window, nan until the window is long enough
+            to contain both frequency bands.
+
+        '''
+        samples = np.asarray(samples, dtype = float)
+        if len(samples) > 0:
+            # initialize the filter state from the first sample of the stream
+            if self.zi is None:
+                self.zi = sps.sosfilt_zi(self.sos) * samples[0]
+            #apply the forward pass causally, carrying its state over to the next block
+            filtered_block, self.zi = sps.sosfilt(self.sos, samples, zi = self.zi)
+            self.forward_signal = np.concatenate((self.forward_signal, filtered_block))
+            self.sample_count += len(samples)
+        return self.emit_samples(len(self.forward_signal) - self.lookahead_count)
+
+    def flush(self):
+        '''
+        A function to emit the samples still held back by the look-ahead at the end
+        of the stream.
+
+        Returns
+        -------
+        beat_locations, beat_time, hrv, ratio
+            The same outputs as process_block.
+
+        '''
+        return self.emit_samples(len(self.forward_signal))
+
+    def emit_samples(self, emit_count):
+        '''
+        A function to run the backward pass of the filter over the held samples, and
+        detect the beats in the first emit_count of them.
+
+        Parameters
+        ----------
+        emit_count : integer
+            Number of held samples to emit
+
+        Returns
+        -------
+        beat_locations, beat_time, hrv, ratio
+            The same outputs as process_block.
+
+        '''
+        if emit_count <= 0:
+            return np.empty(0, dtype = int), np.empty(0), *self.get_rolling_hrv()
+        # apply the filter backwards from the newest sample, as filter_butter does
+        reversed_signal = self.forward_signal[::-1]
+        filtered_signal = sps.sosfilt(self.sos, reversed_signal,
+                                      zi = sps.sosfilt_zi(self.sos) * reversed_signal[0])[0][::-1][:emit_count]
+        self.forward_signal = self.forward_signal[emit_count:]
+
+        # find samples where the signal goes from below to above the threshold,
+        # including a crossing between the last emitted sample and these
+        above = filtered_signal >= self.threshold
+        previous = np.insert(above[:-1], 0, self.previous_above)
+        beat_locations = np.where(above & ~previous)[0] + self.emitted_count
+        self.previous_above = above[-1]
+        self.emitted_count += emit_count
+
+        # drop crossings within the refractory period of the last beat, which may
+        # have been emitted with an earlier block
+        if self.last_beat is not None:
+            beat_locations = p3d.apply_refractory_period(np.insert(beat_locations, 0, self.last_beat),
+                                                         self.fs, self.refractory)[1:]
+        else:
+            beat_locations = p3d.apply_refractory_period(beat_locations, self.fs, self.refractory)
+        if len(beat_locations) > 0:
+            self.last_beat = beat_locations[-1]
+        beat_time = beat_locations / self.fs
+
+        # add the new beats and drop beats that have left the rolling window
+        self.recent_beat_times.extend(beat_time)
+        window_start = self.emitted_count / self.fs - self.window_duration
+        while len(self.recent_beat_times) > 0 and self.recent_beat_times[0] < window_start:
+            self.recent_beat_times.popleft()
+
+        hrv, ratio = self.get_rolling_hrv()
+        return beat_locations, beat_time, hrv, ratio
+
+    def get_rolling_hrv(self):
+        '''
+        A function to calculate the HRV and LF/HF ratio of the beats in the rolling
+        window, the same way calculate_ibis and extract_mean_power do for a whole recording.
+
+        Returns
+        -------
+        hrv : float
+            Standard deviation of the interpolated IBIs, nan with fewer than 3 beats.
+        ratio : float
+            Ratio of mean LF power to mean HF power, nan if either band has no bins.
+
+        '''
+        #need at least 2 IBIs to interpolate between
+        if len(self.recent_beat_times) < 3:
+            return np.nan, np.nan
+        # interpolate IBIs at evenly spaced times between the first and last beat
+        interpolated_time, interpolated_ibi = p3m.resample_ibis(np.array(self.recent_beat_times), self.dt)
+        if len(interpolated_time) < 2:
+            return np.nan, np.nan
+        hrv = np.std(interpolated_ibi)
+
+        # get power of the IBI timecourse in the frequency domain
+        power = np.square(np.abs(fft.rfft(interpolated_ibi - np.mean(interpolated_ibi))))
+        frequency = fft.rfftfreq(len(interpolated_ibi), self.dt)
+        low_power = power[(frequency >= p3m.ratio_bands['lf'][0]) & (frequency <= p3m.ratio_bands['lf'][1])]
+        high_power = power[(frequency >= p3m.ratio_bands['hf'][0]) & (frequency <= p3m.ratio_bands['hf'][1])]
+        #the window is too short to resolve the LF band
+        if len(low_power) == 0 or len(high_power) == 0:
+            return hrv, np.nan
+        ratio = p3m.extract_mean_power(low_power, high_power)
+        return hrv, ratio
+
+#%% Replay a recording as a stream
+# Create function to feed a recorded file through the streaming processor
+def stream_recording(input_file, threshold, fs, block_size = 250, window_duration = 60):
+    '''
+    A generator which reads a text recording in blocks, as if it were arriving live
+    from the Arduino, and yields the results of the streaming processor for each block.
+
+    Parameters
+    ----------
+    input_file : string
+        Name of the txt file to be streamed
+    threshold : float
+        Specified value to identify the QRS wave complex.
+    fs : integer
+        The sampling frequency in Hz or 1/s
+    block_size : integer, optional
+        Number of samples in each block. The default is 250.
+    window_duration : float, optional
+        Length in seconds of the rolling HRV window. The default is 60.
+
+    Yields
+    ------
+    beat_locations, beat_time, hrv, ratio
+        The outputs of StreamingProcessor.process_block for each block, and of
+        StreamingProcessor.flush at the end of the recording.
+
+    '''
+    processor = StreamingProcessor(threshold, fs, window_duration = window_duration)
+    with open(input_file, 'r') as text_file:
+        # collect parsed chunks and split them into blocks of block_size samples
+        leftover = np.empty(0)
+        for chunk in p3m.iterate_text_chunks(text_file):
+            samples = np.concatenate((leftover, chunk))
+            block_count = len(samples) // block_size
+            for block_index in range(block_count):
+                yield processor.process_block(samples[block_index*block_size:(block_index + 1)*block_size])
+            leftover = samples[block_count*block_size:]
+        # process the last partial block
+        if len(leftover) > 0:
+            yield processor.process_block(leftover)
+    # emit the samples held back by the look-ahead
+    yield processor.flush()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Windowed
+This module calculates time-resolved HRV and LF/HF traces, for example over a 60 s
+window moved along the recording 5 s at a time, instead of one value per recording.
+The IBIs are interpolated once for the whole recording. The HRV of every window comes
+from running sums of the IBIs and their squares, so each window costs the same however
+long it is, and the spectra of the windows are taken together in batches of FFTs.
+The total work grows linearly with the length of the recording.
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import numpy as np
+from scipy import fft
+import project3_module as p3m
+
+#%% Windowed HRV and LF/HF
+# Create function to calculate HRV and LF/HF in sliding windows
+def calculate_windowed_hrv(beat_time, window_duration = 60, hop_duration = 5, dt = 0.1,
+                           windows_per_batch = 1024, interpolation = 'linear'):
+    '''
+    A function to calculate the HRV (standard deviation of the interpolated IBIs) and
+    the LF/HF ratio in windows which slide along the recording.
+
+    Parameters
+    ----------
+    beat_time : Array of floats size (x,) where x is the # of beats detected
+        Times in seconds at which the beats occur
+    window_duration : float, optional
+        Length of each window in seconds. The default is 60.
+    hop_duration : float, optional
+        Time in seconds between the starts of neighbouring windows. The default is 5.
+    dt : float, optional
+        Spacing in seconds of the interpolated IBIs. The default is 0.1.
+    windows_per_batch : integer, optional
+        Number of window spectra computed at once, which bounds the memory used.
+        The default is 1024.
+    interpolation : string, optional
+        'linear', 'cubic' or 'pchip', see interpolate_ibis. The default is 'linear'.
+
+    Returns
+    -------
+    window_time : Array of floats size (w,) where w is the # of windows
+        Time in seconds of the middle of each window
+    hrv : Array of floats size (w,)
+        HRV of each window
+    ratio : Array of floats size (w,)
+        LF/HF ratio of each window, the ratio of the mean power in each of
+        project3_module.ratio_bands, as project3_module.Spectrum.get_ratio gives
+
+    '''
+    interpolated_time, interpolated_ibi = p3m.resample_ibis(beat_time, dt, interpolation)
+    window_length = int(round(window_duration / dt))
+    hop_length = max(int(round(hop_duration / dt)), 1)
+    if len(interpolated_ibi) < window_length:
+        return np.empty(0), np.empty(0), np.empty(0)
+    window_start = np.arange(0, len(interpolated_ibi) - window_length + 1, hop_length)
+    window_time = interpolated_time[window_start] + (window_length - 1)*dt/2
+
+    # running sums of the IBIs and their squares give each window's mean and variance,
+    # the overall mean is removed first so the sums stay small
+    centered = interpolated_ibi - np.mean(interpolated_ibi)
+    running_sum = np.concatenate(([0], np.cumsum(centered)))
+    running_square_sum = np.concatenate(([0], np.cumsum(np.square(centered))))
+    window_sum = running_sum[window_start + window_length] - running_sum[window_start]
+    window_square_sum = running_square_sum[window_start + window_length] - running_square_sum[window_start]
+    window_mean = window_sum / window_length
+    hrv = np.sqrt(np.maximum(window_square_sum / window_length - np.square(window_mean), 0))
+
+    # the windows all have the same length, so they share one frequency axis
+    frequency = fft.rfftfreq(window_length, dt)
+    # the ratio bands include both edges, as Spectrum.get_ratio takes them
+    low_band = (frequency >= p3m.ratio_bands['lf'][0]) & (frequency <= p3m.ratio_bands['lf'][1])
+    high_band = (frequency >= p3m.ratio_bands['hf'][0]) & (frequency <= p3m.ratio_bands['hf'][1])
+    # view every window of the series without copying it
+    windows = np.lib.stride_tricks.sliding_window_view(centered, window_length)
+    ratio = np.empty(len(window_start))
+    for batch_start in range(0, len(window_start), windows_per_batch):
+        batch = slice(batch_start, batch_start + windows_per_batch)
+        # remove each window's own mean, then transform the whole batch at once
+        batch_windows = windows[window_start[batch]] - window_mean[batch, np.newaxis]
+        power = np.square(np.abs(fft.rfft(batch_windows, axis = -1)))
+        ratio[batch] = np.mean(power[:, low_band], axis = -1) / np.mean(power[:, high_band], axis = -1)
+    return window_time, hrv, ratio
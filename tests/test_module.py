@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Project 3: Module tests
+Tests that the analysis functions give the results the rest of the project relies on.
+Run them from the project folder with:
+    python -m pytest
+
+@authors: laurenallen, altagodfrey
+"""
+
+# Import libraries
+import asyncio
+import os
+import shutil
+import numpy as np
+import pytest
+import project3_module as p3m
+import project3_batch as p3b
+
+# folder holding the bundled recordings
+data_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the bundled recordings
+recordings = ['rest_data (1).txt', 'on_phone_data (1).txt', 'stressful_rest (1).txt', 'wallsit_data (1).txt']
+
+#%% Helpers
+# Create function to run the module's analysis of one recording
+def analyze(input_file, method = 'linear', dtype = None):
+    '''
+    A function to run every stage of project3_module on 5 minutes of a bundled recording.
+
+    Returns
+    -------
+    beat_count : integer
+        Number of beats detected
+    hrv : float
+        Standard deviation of the interpolated IBIs
+    ratio : float
+        LF/HF ratio
+
+    '''
+    data_file = p3m.load_data(os.path.join(data_dir, input_file), 300, 500, use_sidecar = False, dtype = dtype)
+    filtered_signal = p3m.filter_butter(data_file, 500)
+    beat_locations, beat_time = p3m.detect_beats(filtered_signal, 40, 500)
+    interpolated_ibi, hrv = p3m.calculate_ibis(beat_locations, beat_time, 0.1, method)
+    frequency, power, low_freq, low_power, high_freq, high_power = p3m.frequency_filter(interpolated_ibi, 0.1)
+    return len(beat_locations), hrv, p3m.extract_mean_power(low_power, high_power)
+
+#%% Loading data
+@pytest.mark.parametrize('start, duration', [(0, 300), (7.3, 20), (390, 60)])
+def test_load_data_paths_agree(tmp_path, monkeypatch, start, duration):
+    '''The text, chunked text and .npy sidecar paths of load_data load the same window.'''
+    input_file = shutil.copy(os.path.join(data_dir, recordings[0]), str(tmp_path / 'recording.txt'))
+    samples = np.loadtxt(input_file)
+    expected = samples[int(start*500):int(start*500) + duration*500]
+    text_data = p3m.load_data(input_file, duration, 500, start)
+    # parse in chunks much smaller than the window
+    monkeypatch.setattr(p3m, 'chunk_size', 1000)
+    chunked_data = p3m.load_data(input_file, duration, 500, start)
+    monkeypatch.undo()
+    sidecar_file = p3m.convert_to_sidecar(input_file)
+    assert np.array_equal(np.load(sidecar_file), samples)
+    # the text must not be parsed once the sidecar exists
+    monkeypatch.setattr(p3m, 'iterate_text_chunks', None)
+    sidecar_data = p3m.load_data(input_file, duration, 500, start)
+    monkeypatch.undo()
+    text_only_data = p3m.load_data(input_file, duration, 500, start, use_sidecar = False)
+    for data_file in (text_data, chunked_data, sidecar_data, text_only_data):
+        assert data_file.dtype == np.float64
+        assert np.array_equal(data_file, expected)
+
+#%% IBI resampling
+@pytest.mark.parametrize('duration', [300, 3600, 24*3600])
+@pytest.mark.parametrize('method', ['linear', 'cubic', 'pchip'])
+def test_resample_ibis_grid(duration, method):
+    '''The IBI grid runs every dt from the second beat to the last beat.'''
+    rng = np.random.default_rng(0)
+    beat_time = np.cumsum(0.85 + 0.05*rng.standard_normal(int(duration / 0.6)))
+    beat_time = beat_time[beat_time < duration]
+    interpolated_time, interpolated_ibi = p3m.resample_ibis(beat_time, 0.1, method)
+    expected_count = int(np.ceil((beat_time[-1] - beat_time[1]) / 0.1))
+    assert abs(len(interpolated_ibi) - expected_count) <= 1
+    assert len(interpolated_ibi) <= duration / 0.1
+    assert interpolated_time[0] == beat_time[1]
+    assert interpolated_time[-1] < beat_time[-1]
+    assert np.all(np.isfinite(interpolated_ibi))
+
+#%% Signal data type
+@pytest.mark.parametrize('input_file', recordings)
+def test_float32_matches_float64(input_file):
+    '''Analyzing in float32 gives the HRV and LF/HF ratio of float64 to within 1%.'''
+    hrv, ratio = analyze(input_file, dtype = np.float64)[1:]
+    hrv_32, ratio_32 = analyze(input_file, dtype = np.float32)[1:]
+    assert hrv_32 == pytest.approx(hrv, rel = 0.01)
+    assert ratio_32 == pytest.approx(ratio, rel = 0.01)
+
+def test_cache_keys_include_dtype():
+    '''Signals loaded and filtered in float32 and float64 are cached apart.'''
+    import project3_cache as p3c
+    keys_64 = p3c.get_stage_keys('0', 300, 500, 40, 0.1, dtype = np.float64)
+    keys_32 = p3c.get_stage_keys('0', 300, 500, 40, 0.1, dtype = np.float32)
+    assert keys_64 == p3c.get_stage_keys('0', 300, 500, 40, 0.1)
+    assert all(keys_64[stage] != keys_32[stage] for stage in p3c.stage_outputs)
+
+#%% Stage cache
+def test_cache_second_run_reads_every_stage(tmp_path, monkeypatch):
+    '''A second run of the same recording and settings computes nothing.'''
+    import project3_cache as p3c
+    input_file = os.path.join(data_dir, recordings[0])
+    first = p3c.run_cached_pipeline(input_file, 60, 500, 40, directory = str(tmp_path))
+
+    def fail(stage, *args, **kwargs):
+        raise AssertionError(f'{stage} was computed instead of read from the cache')
+    monkeypatch.setattr(p3c, 'compute_stage', fail)
+    second = p3c.run_cached_pipeline(input_file, 60, 500, 40, directory = str(tmp_path))
+    assert first.keys() == second.keys()
+    for name in first:
+        assert np.array_equal(first[name], second[name])
+
+@pytest.mark.parametrize('setting, value, recomputed', [
+    ('threshold', 45, ['beats', 'ibis', 'spectrum']),
+    ('dt', 0.2, ['ibis', 'spectrum']),
+    ('highcut', 3, ['filter', 'beats', 'ibis', 'spectrum']),
+])
+def test_cache_changed_setting_recomputes_later_stages(tmp_path, monkeypatch, setting, value, recomputed):
+    '''Changing a setting recomputes the stage that uses it and the stages after it only.'''
+    import project3_cache as p3c
+    settings = {'input_file': os.path.join(data_dir, recordings[0]), 'duration': 60, 'fs': 500,
+                'threshold': 40, 'dt': 0.1, 'directory': str(tmp_path)}
+    p3c.run_cached_pipeline(**settings)
+    computed = []
+    compute_stage = p3c.compute_stage
+    def record(stage, *args, **kwargs):
+        computed.append(stage)
+        return compute_stage(stage, *args, **kwargs)
+    monkeypatch.setattr(p3c, 'compute_stage', record)
+    settings[setting] = value
+    results = p3c.run_cached_pipeline(**settings)
+    assert computed == recomputed
+    # the reused and recomputed stages give the same results as a run without the cache
+    uncached = p3c.run_cached_pipeline(**settings, use_cache = False)
+    for name in results:
+        assert np.array_equal(results[name], uncached[name])
+
+def test_cache_evicts_least_recently_used(tmp_path):
+    '''Eviction deletes the least recently used files until the cache fits the limit.'''
+    import project3_cache as p3c
+    # five 1000-byte results written a minute apart
+    for index in range(5):
+        p3c.write_stage('load', f'{index:032d}', {'data_file': np.zeros(1000, dtype = np.uint8)},
+                        str(tmp_path), max_bytes = 2**20)
+        cache_file = p3c.get_cache_file('load', f'{index:032d}', str(tmp_path))
+        os.utime(cache_file, (1000 + 60*index, 1000 + 60*index))
+    file_size = os.path.getsize(cache_file)
+    # reading the oldest result makes it the most recently used
+    assert p3c.read_stage('load', f'{0:032d}', str(tmp_path)) is not None
+
+    assert p3c.evict(str(tmp_path), max_bytes = 3*file_size) == 2
+    kept = sorted(os.listdir(tmp_path))
+    assert kept == [os.path.basename(p3c.get_cache_file('load', f'{index:032d}')) for index in (0, 3, 4)]
+    # a cache within the limit is left alone
+    assert p3c.evict(str(tmp_path), max_bytes = 3*file_size) == 0
+
+#%% Batch engine
+@pytest.mark.parametrize('method', ['linear', 'cubic', 'pchip'])
+def test_batch_matches_module(method):
+    '''The batch engine gives the same beats, HRV and LF/HF ratio as the module.'''
+    input_files = [os.path.join(data_dir, input_file) for input_file in recordings]
+    results = p3b.analyze_recordings(input_files, 300, 500, 40, 0.1, method)
+    for input_file, row in zip(recordings, results):
+        beat_count, hrv, ratio = analyze(input_file, method)
+        assert row['beat_count'] == beat_count
+        assert row['hrv'] == pytest.approx(hrv, rel = 1e-9)
+        assert row['ratio'] == pytest.approx(ratio, rel = 1e-9)
+
+#%% Signal quality
+@pytest.mark.parametrize('window_duration', [2, 5])
+def test_quality_masks_bad_spans(window_duration):
+    '''A clean ECG is kept, while flat-line and saturated spans are masked.'''
+    import project3_benchmark as p3bench
+    import project3_quality as p3q
+    # a synthetic ECG rounded to whole ADC values, as the Arduino records it
+    raw_signal = np.round(p3bench.generate_synthetic_ecg(60, 500)[0])
+    filtered_signal = p3m.filter_butter(raw_signal, 500)
+    # the highest and lowest samples of a clean recording are not clipped
+    assert np.all(p3q.score_windows(raw_signal, filtered_signal, 500, window_duration)['clipping'] == 0)
+    assert np.all(p3q.get_quality_mask(raw_signal, filtered_signal, 500, window_duration)[0])
+
+    # a loose lead from 10 to 20 s, and an amplifier saturating at the ADC limits from 40 to 50 s
+    raw_signal[10*500:20*500] = raw_signal[10*500]
+    raw_signal[40*500:50*500] = np.clip(10*(raw_signal[40*500:50*500] - 300) + 300, *p3q.adc_levels)
+    mask = p3q.get_quality_mask(raw_signal, p3m.filter_butter(raw_signal, 500), 500, window_duration)[0]
+    assert not np.any(mask[10*500:20*500])
+    assert not np.any(mask[40*500:50*500])
+    # the windows clear of the bad spans and the filter's ringing after them stay good
+    assert np.all(mask[:9*500]) and np.all(mask[32*500:38*500])
+
+def test_ectopic_ibis_are_invalid():
+    '''A premature beat invalidates the short IBI before it and the long IBI after it.'''
+    import project3_quality as p3q
+    beat_time = np.arange(1, 61, 0.8)
+    beat_time[30] -= 0.3
+    valid_ibis = p3q.find_valid_ibis(beat_time, 500)
+    assert not valid_ibis[29] and not valid_ibis[30]
+    assert np.sum(valid_ibis) == len(valid_ibis) - 2
+    # an IBI spanning a masked sample is invalid too
+    mask = np.ones(61*500, dtype = bool)
+    mask[int(beat_time[10]*500) + 10] = False
+    valid_ibis = p3q.find_valid_ibis(beat_time, 500, mask)
+    assert not valid_ibis[10] and np.sum(valid_ibis) == len(valid_ibis) - 3
+
+#%% HRV metrics
+def test_sample_entropy_matches_brute_force():
+    '''Sample entropy from the k-d trees equals comparing every pair of patterns.'''
+    import project3_metrics as p3metrics
+    values = 0.85 + 0.05*np.random.default_rng(1).standard_normal(300)
+    tolerance = 0.2*np.std(values)
+    patterns = np.lib.stride_tricks.sliding_window_view(values, 3)
+    match_counts = [0, 0]
+    for first in range(len(patterns)):
+        for second in range(first + 1, len(patterns)):
+            distance = np.abs(patterns[first] - patterns[second])
+            match_counts[0] += np.max(distance[:2]) <= tolerance
+            match_counts[1] += np.max(distance) <= tolerance
+    assert p3metrics.calculate_sample_entropy(values) == pytest.approx(-np.log(match_counts[1] / match_counts[0]))
+
+@pytest.mark.parametrize('min_scale, max_scale', [(4, 16), (16, 64)])
+def test_dfa_alpha_matches_brute_force(min_scale, max_scale):
+    '''DFA alpha 1 and alpha 2 equal fitting a line to each window in turn.'''
+    import project3_metrics as p3metrics
+    values = np.random.default_rng(2).standard_normal(4000)
+    profile = np.cumsum(values - np.mean(values))
+    fluctuation = []
+    for scale in range(min_scale, max_scale + 1):
+        residuals = []
+        for window_start in range(0, len(profile) - scale + 1, scale):
+            window = profile[window_start:window_start + scale]
+            position = np.arange(scale)
+            residuals.append(window - np.polyval(np.polyfit(position, window, 1), position))
+        fluctuation.append(np.sqrt(np.mean(np.square(residuals))))
+    alpha = np.polyfit(np.log(np.arange(min_scale, max_scale + 1)), np.log(fluctuation), 1)[0]
+    assert p3metrics.calculate_dfa_alpha(values, min_scale, max_scale) == pytest.approx(alpha, rel = 1e-9)
+    # white noise scales with an exponent of about 0.5, its running sum about 1.5
+    assert p3metrics.calculate_dfa_alpha(values, min_scale, max_scale) == pytest.approx(0.5, abs = 0.15)
+    assert p3metrics.calculate_dfa_alpha(profile, min_scale, max_scale) == pytest.approx(1.5, abs = 0.15)
+
+def test_poincare_widths():
+    '''SD1 is the spread of successive differences over root 2, and SD2 follows from SDNN.'''
+    import project3_metrics as p3metrics
+    nn_intervals = 0.85 + 0.05*np.random.default_rng(3).standard_normal(200)
+    metrics = p3metrics.calculate_metrics(np.concatenate(([0], np.cumsum(nn_intervals))))
+    sd1 = np.std(np.diff(nn_intervals), ddof = 1) / np.sqrt(2)
+    assert metrics['sd1'] == pytest.approx(sd1, rel = 1e-12)
+    assert metrics['sd2'] == pytest.approx(np.sqrt(2*np.var(nn_intervals, ddof = 1) - sd1**2), rel = 1e-12)
+    assert metrics['sdnn'] == pytest.approx(np.std(nn_intervals, ddof = 1), rel = 1e-12)
+    assert metrics['beat_count'] == 201
+
+#%% Spectrum
+@pytest.mark.parametrize('input_file', recordings)
+def test_spectrum_matches_frequency_filter(input_file):
+    '''Spectrum band powers and ratios equal frequency_filter and extract_mean_power.'''
+    beat_locations, beat_time = p3m.detect_beats(p3m.filter_butter(p3m.load_data(
+        os.path.join(data_dir, input_file), 300, 500, use_sidecar = False), 500), 40, 500)
+    interpolated_ibi = p3m.calculate_ibis(beat_locations, beat_time, 0.1)[0]
+    low_power, high_power = p3m.frequency_filter(interpolated_ibi, 0.1)[3::2]
+    spectrum = p3m.Spectrum(interpolated_ibi, 0.1)
+    band_power = spectrum.get_band_power([(0.04, 0.15), (0.15, 0.4)])
+    assert band_power == pytest.approx([np.mean(low_power), np.mean(high_power)], rel = 1e-9)
+    assert spectrum.get_band_power((0.04, 0.15), 'sum') == pytest.approx(np.sum(low_power), rel = 1e-9)
+    assert spectrum.get_ratio() == pytest.approx(p3m.extract_mean_power(low_power, high_power), rel = 1e-9)
+
+    # padding to a fast length moves every frequency a little, see Spectrum
+    padded_low_power, padded_high_power = p3m.frequency_filter(interpolated_ibi, 0.1, pad = True)[3::2]
+    padded_ratio = p3m.Spectrum(interpolated_ibi, 0.1, pad = True).get_ratio()
+    assert padded_ratio == pytest.approx(p3m.extract_mean_power(padded_low_power, padded_high_power), rel = 1e-9)
+    assert padded_ratio == pytest.approx(spectrum.get_ratio(), rel = 0.15)
+
+def test_spectrum_empty_band():
+    '''A band holding no frequencies has no mean power.'''
+    spectrum = p3m.Spectrum(np.random.default_rng(0).standard_normal(600), 0.1)
+    assert np.isnan(spectrum.get_band_power((0.1001, 0.1002)))
+    assert spectrum.get_band_power((0.1001, 0.1002), 'sum') == 0
+
+@pytest.mark.parametrize('method', ['fft', 'welch', 'lomb'])
+def test_spectral_methods_find_lf_power(method):
+    '''IBIs modulated at 0.1 Hz with amplitude A put about A^2/2 of power in the LF band.'''
+    import project3_spectral as p3s
+    amplitude = 0.05
+    # each beat follows the last by an IBI of 0.8 s plus a 0.1 Hz sinusoid
+    beat_time = [0.0]
+    while beat_time[-1] < 300:
+        beat_time.append(beat_time[-1] + 0.8 + amplitude*np.sin(2*np.pi*0.1*beat_time[-1]))
+    powers = p3s.calculate_band_powers(np.array(beat_time), method)
+    # linear interpolation of the IBIs smooths the peak a little
+    assert powers['lf'] == pytest.approx(amplitude**2 / 2, rel = 0.06)
+    assert powers['hf'] < 0.01*powers['lf'] and powers['vlf'] < 0.01*powers['lf']
+
+def test_lomb_needs_two_ibis():
+    '''The Lomb-Scargle periodogram rejects beat series with fewer than two valid IBIs.'''
+    import project3_spectral as p3s
+    for beat_time in ([], [1.0], [1.0, 1.8]):
+        with pytest.raises(ValueError, match = 'two valid IBIs'):
+            p3s.estimate_spectrum(beat_time, 'lomb')
+    with pytest.raises(ValueError, match = 'two valid IBIs'):
+        p3s.estimate_spectrum([1.0, 1.8, 2.6, 3.4], 'lomb', valid_ibis = np.array([False, True, False]))
+    assert len(p3s.estimate_spectrum([1.0, 1.8, 2.7], 'lomb')[1]) > 0
+
+#%% Windowed HRV
+def test_windowed_matches_spectrum():
+    '''Each window's HRV and LF/HF ratio match those of its IBIs analyzed alone.'''
+    import project3_windowed as p3w
+    rng = np.random.default_rng(0)
+    beat_time = np.cumsum(0.85 + 0.05*rng.standard_normal(800))
+    window_time, hrv, ratio = p3w.calculate_windowed_hrv(beat_time, 60, 30, 0.1, windows_per_batch = 4)
+    interpolated_ibi = p3m.resample_ibis(beat_time, 0.1)[1]
+    assert len(window_time) > 4
+    for window_index in range(len(window_time)):
+        window_ibi = interpolated_ibi[window_index*300:window_index*300 + 600]
+        assert hrv[window_index] == pytest.approx(np.std(window_ibi), rel = 1e-6)
+        assert ratio[window_index] == pytest.approx(p3m.Spectrum(window_ibi, 0.1).get_ratio(), rel = 1e-9)
+
+#%% Detectors
+@pytest.mark.parametrize('method', ['threshold', 'refractory', 'find_peaks', 'pan_tompkins'])
+def test_detectors_take_float_fs(method):
+    '''Every detector gives the same beats for an integer and a float sampling frequency.'''
+    import project3_detectors as p3d
+    signal = p3m.filter_butter(p3m.load_data(os.path.join(data_dir, recordings[0]), 60, 500, use_sidecar = False), 500)
+    beat_locations = p3d.detect(signal, 500, method)[0]
+    assert len(beat_locations) > 0
+    assert np.array_equal(p3d.detect(signal, 500.0, method)[0], beat_locations)
+
+#%% Multi-lead signals
+def test_filter_butter_filters_each_lead():
+    '''Filtering the leads of a multi-lead signal together equals filtering each lead alone.'''
+    import project3_benchmark as p3bench
+    signals = np.column_stack([p3bench.generate_synthetic_ecg(60, 500, 60 + 10*lead, seed = lead)[0]
+                               for lead in range(3)])
+    filtered_signals = p3m.filter_butter(signals, 500, axis = 0)
+    assert filtered_signals.shape == signals.shape
+    for lead in range(3):
+        assert np.allclose(filtered_signals[:, lead], p3m.filter_butter(signals[:, lead], 500), rtol = 1e-12, atol = 1e-9)
+    # and so do the beats detected in every lead at once
+    beat_locations = p3m.detect_beats(filtered_signals, 40, 500)[0]
+    for lead in range(3):
+        assert np.array_equal(beat_locations[lead], p3m.detect_beats(filtered_signals[:, lead], 40, 500)[0])
+
+def test_fuse_beats_merges_offset_leads():
+    '''Beats a few samples apart in different leads become one beat at their mean sample.'''
+    true_locations = np.arange(250, 10000, 420)
+    lead_0 = true_locations
+    # a lead 3 samples late, with a noise spike between two beats
+    lead_1 = np.sort(np.append(true_locations + 3, 2100))
+    # a lead 3 samples early which misses one beat
+    lead_2 = np.delete(true_locations - 3, 5)
+    fused_locations, fused_time = p3m.fuse_beats([lead_0, lead_1, lead_2], 500)
+    # the spike is in one lead only and is dropped, the missed beat is in two and is
+    # kept at the mean of those two leads, 1.5 samples late, rounded to 2
+    expected_locations = true_locations.copy()
+    expected_locations[5] += 2
+    assert np.array_equal(fused_locations, expected_locations)
+    assert np.array_equal(fused_time, expected_locations / 500)
+    # requiring every lead drops the beat that one lead missed
+    assert np.array_equal(p3m.fuse_beats([lead_0, lead_1, lead_2], 500, min_leads = 3)[0],
+                          np.delete(true_locations, 5))
+    # leads further apart than the tolerance are not merged
+    assert len(p3m.fuse_beats([lead_0, lead_0 + 30], 500, tolerance = 0.05, min_leads = 1)[0]) == 2*len(true_locations)
+
+#%% Binary recordings
+def test_multi_lead_recordings_are_rejected(tmp_path):
+    '''.ecg recordings and chunked analysis refuse a multi-lead recording clearly.'''
+    import project3_chunked as p3ch
+    import project3_recording as p3r
+    input_file = tmp_path / 'two_leads.txt'
+    np.savetxt(input_file, np.arange(2000).reshape(-1, 2), fmt = '%d')
+    with pytest.raises(ValueError, match = 'single lead'):
+        p3r.convert_to_recording(str(input_file), 500)
+    assert not os.path.exists(p3r.get_recording_file(str(input_file)))
+    with pytest.raises(ValueError, match = 'single lead'):
+        p3ch.process_recording_chunked(str(input_file), str(tmp_path / 'results'), 500, 40)
+
+@pytest.mark.parametrize('dtype, compress', [(np.int16, True), (np.int16, False), (np.float32, True)])
+def test_recording_round_trip(tmp_path, dtype, compress):
+    '''A window read from a .ecg recording, across a block boundary, equals the text.'''
+    import project3_recording as p3r
+    samples = np.loadtxt(os.path.join(data_dir, recordings[0]))
+    if dtype == np.float32:
+        # values float32 holds exactly, which int16 cannot store
+        samples = samples/4 + 0.125
+    input_file = str(tmp_path / 'recording.txt')
+    np.savetxt(input_file, samples, fmt = '%.3f')
+    recording_file = p3r.convert_to_recording(input_file, 500, label = 'rest', dtype = dtype,
+                                              compress = compress, block_size = 1000)
+    header = p3r.read_header(recording_file)
+    assert (header['sample_count'], header['fs'], header['label']) == (len(samples), 500, 'rest')
+    assert np.array_equal(p3r.read_window(recording_file), samples)
+    assert np.array_equal(p3r.read_window(recording_file, 1900, 2500), samples[1900:4400])
+    # a window running past the end is cut short
+    assert np.array_equal(p3r.read_window(recording_file, len(samples) - 10, 100), samples[-10:])
+    if dtype == np.int16:
+        # samples which are not whole numbers cannot be stored as int16, and the
+        # failed conversion leaves the earlier recording in place
+        np.savetxt(input_file, samples + 0.5, fmt = '%.1f')
+        with pytest.raises(ValueError, match = 'int16'):
+            p3r.convert_to_recording(input_file, 500, recording_file)
+        assert np.array_equal(p3r.read_window(recording_file), samples)
+
+def test_recording_bad_header(tmp_path):
+    '''A .ecg file with a bad magic value, data type code or a cut header is refused.'''
+    import project3_recording as p3r
+    input_file = str(tmp_path / 'recording.txt')
+    np.savetxt(input_file, np.arange(5000) % 1000, fmt = '%d')
+    with open(p3r.convert_to_recording(input_file, 500), 'rb') as binary_file:
+        contents = binary_file.read()
+    for name, damaged in (('magic', b'X' + contents[1:]), ('dtype', contents[:8] + b'\x07' + contents[9:]),
+                          ('cut', contents[:10])):
+        damaged_file = tmp_path / f'{name}.ecg'
+        damaged_file.write_bytes(damaged)
+        with pytest.raises(ValueError):
+            p3r.read_window(str(damaged_file))
+
+#%% Chunked processing
+def test_chunked_matches_in_memory(tmp_path):
+    '''Processing in chunks which do not divide the recording matches processing it whole.'''
+    import project3_chunked as p3ch
+    input_file = os.path.join(data_dir, recordings[0])
+    results = p3ch.process_recording_chunked(input_file, str(tmp_path), 500, 40, chunk_duration = 37,
+                                             use_sidecar = False)
+    data_file = p3m.load_data(input_file, 3600, 500, use_sidecar = False)
+    filtered_signal = p3m.filter_butter(data_file, 500)
+    beat_locations, beat_time = p3m.detect_beats(filtered_signal, 40, 500)
+    interpolated_ibi, hrv = p3m.calculate_ibis(beat_locations, beat_time, 0.1)
+    # the recording does not end on a chunk boundary
+    assert len(data_file) % (37*500) != 0
+    assert results['sample_count'] == len(data_file)
+    assert results['beat_count'] == len(beat_locations)
+    assert np.max(np.abs(np.load(results['filtered_signal']) - filtered_signal)) < 1e-6
+    assert np.array_equal(np.load(results['beat_locations']), beat_locations)
+    assert np.array_equal(np.load(results['beat_time']), beat_time)
+    assert np.allclose(np.load(results['interpolated_ibi']), interpolated_ibi, rtol = 1e-9, atol = 0)
+    assert results['hrv'] == pytest.approx(hrv, rel = 1e-9)
+
+#%% Streaming
+@pytest.mark.parametrize('input_file', recordings)
+def test_streaming_matches_offline(input_file):
+    '''Streaming a recording in blocks finds the beats detect_beats finds offline.'''
+    import project3_streaming as p3st
+    signal = p3m.load_data(os.path.join(data_dir, input_file), 3600, 500, use_sidecar = False)
+    offline_beats = p3m.detect_beats(p3m.filter_butter(signal, 500), 40, 500)[0]
+    streamed_beats = np.concatenate([block_results[0] for block_results in
+                                     p3st.stream_recording(os.path.join(data_dir, input_file), 40, 500)])
+    assert len(streamed_beats) == pytest.approx(len(offline_beats), rel = 0.01)
+    assert np.min(np.diff(streamed_beats)) >= 0.25*500
+
+def test_ring_buffer_wraps_around():
+    '''The ring buffer keeps samples in order across the end of its array and never overwrites them.'''
+    import project3_ingest as p3i
+    ring = p3i.RingBuffer(8)
+    assert ring.write(np.arange(6)) == 6
+    assert np.array_equal(ring.read(4), np.arange(4))
+    # these samples run past the end of the array and wrap around to its start
+    assert ring.write(np.arange(6, 12)) == 6
+    assert ring.count == 8 and ring.get_space() == 0
+    # a full buffer takes nothing more
+    assert ring.write(np.arange(12, 14)) == 0
+    assert np.array_equal(ring.read(), np.arange(4, 12))
+    assert ring.count == 0 and len(ring.read()) == 0
+
+def test_ingest_backpressure():
+    '''A stream arriving faster than its ring buffer drains waits for space and loses no samples.'''
+    import project3_ingest as p3i
+    signal = p3m.load_data(os.path.join(data_dir, recordings[0]), 20, 500, use_sidecar = False)
+    service = p3i.IngestionService(40, 500, block_size = 250, buffer_duration = 1)
+
+    async def ingest_all_at_once():
+        # every sample is already waiting, far more than the 1 s buffer holds
+        reader = asyncio.StreamReader()
+        reader.feed_data(''.join(f'{sample:g}\n' for sample in signal).encode())
+        reader.feed_eof()
+        return await service.ingest('rest', reader)
+    beat_time = asyncio.run(ingest_all_at_once())
+    stats = service.get_stats()['rest']
+    assert stats['backpressure_count'] > 0
+    assert stats['max_buffered'] <= service.buffer_capacity
+    assert stats['samples_received'] == stats['samples_processed'] == len(signal)
+    assert stats['beat_count'] == len(beat_time)
+
+def test_ingest_replay_matches_offline(tmp_path):
+    '''Replaying recordings over TCP through the ingestion service finds the beats detect_beats finds.'''
+    import project3_ingest as p3i
+    # the first minute of two recordings, replayed 100 times faster than real time
+    input_files = []
+    offline_counts = []
+    for input_file in recordings[:2]:
+        signal = p3m.load_data(os.path.join(data_dir, input_file), 60, 500, use_sidecar = False)
+        offline_counts.append(len(p3m.detect_beats(p3m.filter_butter(signal, 500), 40, 500)[0]))
+        input_files.append(str(tmp_path / input_file))
+        np.savetxt(input_files[-1], signal, fmt = '%g')
+    service = p3i.IngestionService(40, 500)
+
+    async def replay_and_ingest():
+        servers, sources = await p3i.replay_recordings(input_files, 500, speed = 100)
+        try:
+            return await asyncio.wait_for(service.run(dict(zip(recordings, sources))), 60)
+        finally:
+            for server in servers:
+                server.close()
+    beat_times = asyncio.run(replay_and_ingest())
+    for input_file, offline_count in zip(recordings, offline_counts):
+        assert abs(len(beat_times[input_file]) - offline_count) <= 1
+        assert service.get_stats()[input_file]['samples_processed'] == 60*500
+
+#%% Results store
+def test_store_round_trip(tmp_path):
+    '''Appended rows come back from select and summarize, filtered by any column.'''
+    import project3_store as p3store
+    hrv = {'Rest': [0.05, 0.07, 0.06], 'Stress': [0.02, 0.03]}
+    # a batch size which leaves rows waiting when they are queried
+    with p3store.ResultsStore(str(tmp_path / 'results.sqlite'), batch_size = 2) as store:
+        for label, values in hrv.items():
+            for index, value in enumerate(values):
+                store.append(f'{label}_{index}.txt', label, {'hrv': value, 'lf_hf': 2*value},
+                             (0, 60), 500, 40, 0.1)
+        rows = store.select()
+        assert len(rows) == 5 and rows.dtype.names == tuple(p3store.column_names)
+        # columns which were not given are NULL, and read as nan
+        assert np.all(np.isnan(rows['ratio']))
+
+        rest = store.select(['recording_id', 'hrv'], label = 'Rest')
+        assert rest.dtype.names == ('recording_id', 'hrv')
+        assert list(rest['recording_id']) == ['Rest_0.txt', 'Rest_1.txt', 'Rest_2.txt']
+        assert np.array_equal(rest['hrv'], hrv['Rest'])
+        assert len(store.select(recording_id = ['Rest_1.txt', 'Stress_0.txt'])) == 2
+        assert len(store.select(label = 'Rest', threshold = 45)) == 0
+
+        summary = store.summarize('hrv')
+        assert list(summary['label']) == ['Rest', 'Stress']
+        for row in summary:
+            values = hrv[row['label']]
+            assert row['count'] == len(values)
+            assert row['mean'] == pytest.approx(np.mean(values))
+            assert row['std'] == pytest.approx(np.std(values, ddof = 1))
+            assert (row['min'], row['max']) == (min(values), max(values))
+        summary = store.summarize('lf_hf', label = 'Stress')
+        assert len(summary) == 1 and summary['mean'][0] == pytest.approx(2*np.mean(hrv['Stress']))
+        # a metric which was never stored counts no rows
+        assert np.all(store.summarize('ratio')['count'] == 0)
+        with pytest.raises(ValueError):
+            store.select(['not_a_column'])
+
+def test_store_readding_replaces_rows(tmp_path):
+    '''Adding a recording again with the same settings replaces its rows, with other settings keeps both.'''
+    import project3_store as p3store
+    input_file = os.path.join(data_dir, recordings[0])
+    with p3store.ResultsStore(str(tmp_path / 'results.sqlite')) as store:
+        assert p3store.store_recording(store, input_file, 'Rest', 120, 500, 40, window_duration = 60) == 2
+        first = store.select()
+        assert p3store.store_recording(store, input_file, 'Rest', 120, 500, 40, window_duration = 60) == 2
+        second = store.select()
+        assert len(second) == 2
+        for name in ('window_start', 'hrv', 'ratio'):
+            assert np.array_equal(first[name], second[name], equal_nan = True)
+        p3store.store_recording(store, input_file, 'Rest', 120, 500, 45, window_duration = 60)
+        assert len(store.select()) == 4
+        assert len(store.select(threshold = 40)) == 2
+        # append itself always adds a row
+        store.append(input_file, 'Rest', {'hrv': 0.05}, (0, 60), 500, 40, 0.1)
+        assert len(store.select(threshold = 40)) == 3
+
+def test_store_reads_while_writing(tmp_path):
+    '''A second connection reads the committed rows while a writer holds an open transaction.'''
+    import project3_store as p3store
+    store_file = str(tmp_path / 'results.sqlite')
+    with p3store.ResultsStore(store_file) as writer:
+        writer.append('a.txt', 'Rest', {'hrv': 0.05})
+        writer.flush()
+        assert writer.connection.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        # hold the write lock with rows which are not committed yet
+        writer.connection.execute('BEGIN IMMEDIATE')
+        writer.connection.execute("INSERT INTO results (recording_id, label, hrv) VALUES ('b.txt', 'Rest', 0.06)")
+        reader = p3store.ResultsStore(store_file)
+        reader.connection.execute('PRAGMA busy_timeout = 0')
+        try:
+            assert list(reader.select()['recording_id']) == ['a.txt']
+            assert reader.summarize('hrv')['count'][0] == 1
+            writer.connection.commit()
+            assert list(reader.select()['recording_id']) == ['a.txt', 'b.txt']
+        finally:
+            reader.close()
+
+#%% Command line tools
+def test_parallel_matches_pipeline():
+    '''project3_parallel and hrv-analyze give the same results for a file.'''
+    import project3_analyze as p3a
+    import project3_parallel as p3par
+    input_files = [os.path.join(data_dir, input_file) for input_file in recordings[:2]]
+    parallel_results = p3par.analyze_in_parallel(input_files, 300, 500, 40, workers = 1)
+    pipeline_results = p3a.Pipeline(use_cache = False).run(input_files)
+    assert parallel_results.tolist() == pipeline_results.tolist()
+    for input_file, row in zip(recordings, parallel_results):
+        beat_count, hrv, ratio = analyze(input_file)
+        assert (row['beat_count'], row['hrv'], row['ratio']) == (beat_count, hrv, ratio)